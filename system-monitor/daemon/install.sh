@@ -20,7 +20,7 @@ mkdir -p /var/log/system_monitor
 
 # Install Python dependencies
 echo -e "${YELLOW}Installing Python dependencies...${NC}"
-pip3 install websockets typing-extensions
+pip3 install websockets typing-extensions numpy
 
 # Copy files
 echo -e "${YELLOW}Copying files...${NC}"
@@ -1,18 +1,37 @@
 #!/usr/bin/env python3
 
+import argparse
 import asyncio
+import errno
 import json
 import socket
 import struct
 import logging
 import websockets
+try:
+    import numpy as np
+except ImportError:  # format_metrics falls back to the pure-Python path
+    np = None
 from datetime import datetime
-from typing import Set, Dict, Any
+from typing import Set, Dict, Any, Iterator, List, Optional, Tuple, Union
 import ctypes
+import heapq
+import random
+import resource
+import threading
+from bisect import bisect_left
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter, itemgetter
 from pathlib import Path
 import signal
 import sys
+import calendar
+import mmap
 import os
+import pwd
+import time
 
 # Configure logging
 logging.basicConfig(
@@ -27,9 +46,124 @@ logger = logging.getLogger('SystemMonitor')
 
 # Constants matching kernel module
 NETLINK_TEST = 31
+TASK_COMM_LEN = 16
+
+# Frame protocol v2: header, CPU usage array, process array, split into
+# parts of at most FRAME_PART_MAX bytes (see kernel_module/README.md)
+METRICS_MAGIC = 0x534d4652  # "SMFR"
+METRICS_VERSION = 2
+SM_MSG_METRICS = 0x11       # NLMSG_MIN_TYPE + 1
+FRAME_PART_MAX = 32 * 1024
+FRAME_SIZE_LIMIT = 64 << 20  # larger frames are rejected, not reassembled
+FRAME_SORTED_CPU = 0x1  # header flag: processes sorted by CPU, busiest first
+FRAME_TOP_RSS = 0x2     # header flag: processes are the top N by RSS
+FRAME_CPU_TIME = 0x4    # header flag: process cpu_time is filled in
+FRAME_TASK_IDS = 0x8    # header flag: process ppid and tgid are filled in
+FRAME_THREADS = 0x10    # header flag: one record per thread, not per process
+SM_MSG_CONTROL = 0x12   # NLMSG_MIN_TYPE + 2, daemon -> module
+CONTROL_MSG = struct.Struct('=I')  # interval_ms, 0 pauses sampling
+MODULE_INTERVAL_PARAM = '/sys/module/system_monitor/parameters/interval_ms'
+
+# Adaptive sampling: faster while clients are connected
+SAMPLE_ACTIVE_MS = 500
+SAMPLE_IDLE_MS = 2000
+SAMPLE_IDLE_GRACE = 10.0  # seconds without clients before slowing down
+# Intervals the kernel module accepts, as its SM_INTERVAL_MIN_MS/MAX_MS
+SAMPLE_MIN_MS = 100
+SAMPLE_MAX_MS = 60000
+HISTORY_SECONDS = 300  # history kept for clients at the active interval
+FRAME_PART = struct.Struct('=III')  # sequence, offset, total_len
+FRAME_MAX_PROCESSES = 100  # processes per /proc frame, as the module default
+
+# Fixed v1 layout (struct system_metrics), still decoded for old modules
+# and captures
 MAX_PROCESSES = 100
 NR_CPUS = 32
-TASK_COMM_LEN = 16
+
+# Process rows sent to clients per frame
+PROCESS_ROWS = 100
+
+# Netlink message header (struct nlmsghdr) and standard message types
+NLMSG_HDR = struct.Struct('=IHHII')  # len, type, flags, seq, pid
+NLMSG_HDRLEN = NLMSG_HDR.size
+NLMSG_ALIGNTO = 4
+NLMSG_NOOP = 0x1
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+NLMSG_OVERRUN = 0x4
+NLMSG_CONTROL = frozenset((NLMSG_NOOP, NLMSG_ERROR, NLMSG_OVERRUN))
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+
+# Receive path: datagrams land in a small ring of preallocated buffers
+RECV_BUFFER_SIZE = 65536
+RECV_RING_SLOTS = 4
+NETLINK_RCVBUF = 1 << 20  # absorbs bursts while the loop is busy
+
+# Capture files: header, then (seconds since start, length, datagram) records
+CAPTURE_MAGIC = b'SMCP'
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct('=4sI')  # magic, version
+CAPTURE_RECORD = struct.Struct('=dI')   # offset seconds, datagram length
+SYNTHETIC_VARIANTS = 64  # distinct pregenerated synthetic frames
+
+# /proc collector
+PROC_STAT_READ_SIZE = 1024  # /proc/[pid]/stat is well under this
+PROC_FD_RESERVE = 256       # descriptors left for sockets and the store
+PROC_REFRESH_TICKS = 60     # idle processes get their stat re-read this often
+
+# Per-process enrichment from /proc, off the event loop
+ENRICH_SHARDS = 4         # worker threads, each owning the pids = n mod shards
+ENRICH_CMDLINE_MAX = 256  # bytes of /proc/[pid]/cmdline kept
+
+# Persistent store: one segment file per hour under STORE_DIR
+STORE_DIR = '/var/lib/system_monitor'
+STORE_MAGIC = b'SMTS'
+STORE_VERSION = 1
+STORE_TOP_PROCESSES = 10
+STORE_RETENTION_HOURS = 7 * 24
+STORE_COMPACT_AFTER_HOURS = 24
+STORE_COMPACT_SECONDS = 60  # one sample per minute once compacted
+SEGMENT_SECONDS = 3600
+SEGMENT_COMPACTED = 0x1
+MEMORY_FIELDS = ('total', 'used', 'free', 'cached', 'available', 'buffers')
+
+# Per-process history index
+PROCESS_INDEX_CAPACITY = 512  # processes tracked before LRU eviction
+PROCESS_HISTORY_SIZE = 300    # samples kept per process
+
+# Broadcast path: clients with more than this many unsent bytes are evicted
+SEND_BUFFER_LIMIT = 1 << 20
+
+# Client subscriptions: the optional parts of a metrics message, and the
+# process sort keys with whether they sort descending
+SUBSCRIBE_FIELDS = ('cpu_usage', 'cpu_average', 'memory', 'processes',
+                    'timestamp', 'collect_ms', 'history_delta')
+SUBSCRIBE_SORT_KEYS = {'cpu_usage': True, 'mem_usage': True, 'pid': False,
+                       'name': False}
+SUBSCRIBE_RATE_SLACK = 0.05  # tick jitter tolerated by max_rate, fraction
+
+# Binary metrics messages, chosen per client with a WebSocket subprotocol.
+# Clients that offer neither subprotocol get JSON.
+SUBPROTOCOL_JSON = 'sysmon.json'
+SUBPROTOCOL_BINARY = 'sysmon.binary.v1'
+BINARY_MAGIC = b'SMWB'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sHHId')  # magic, version, fields, seq, epoch
+BINARY_COUNT = struct.Struct('<H')
+BINARY_MAX_COUNT = 0xFFFF  # most CPUs, process rows or history points
+BINARY_FLOAT = struct.Struct('<f')
+BINARY_MEMORY = struct.Struct('<6Q')  # MEMORY_FIELDS
+BINARY_HISTORY = struct.Struct('<IH')  # since, points
+BINARY_STRINGS = struct.Struct('<I')   # byte length of a string column
+# Process columns: row key and array typecode; 'c' is one Latin-1
+# character per row and 's' NUL-separated UTF-8 strings
+BINARY_PROCESS_COLUMNS = (
+    ('pid', 'i'), ('cpu_usage', 'f'), ('mem_usage', 'Q'), ('state', 'c'),
+    ('priority', 'Q'), ('nice', 'Q'), ('start_time', 'Q'),
+    ('cpu_time', 'd'), ('virt', 'Q'), ('shared', 'Q'), ('threads', 'I'),
+    ('name', 's'), ('user', 's'), ('cmdline', 's'), ('ppid', 'i'),
+    ('tgid', 'i'))
 
 class ProcessInfo(ctypes.Structure):
     """Process information structure matching kernel module"""
@@ -41,9 +175,40 @@ class ProcessInfo(ctypes.Structure):
         ('mem_usage', ctypes.c_ulong),
         ('state', ctypes.c_long),
         ('priority', ctypes.c_ulong),
-        ('nice', ctypes.c_ulong)
+        ('nice', ctypes.c_ulong),
+        ('start_time', ctypes.c_ulonglong),  # ns since boot
+        ('cpu_time', ctypes.c_uint64),       # ns on CPU, all threads
+        ('ppid', ctypes.c_int),              # parent process
+        ('tgid', ctypes.c_int)               # process a thread belongs to
     ]
 
+PROCESS_INFO_SIZE = ctypes.sizeof(ProcessInfo)
+# v1 records and the first v2 modules end before cpu_time
+PROCESS_INFO_MIN_SIZE = ProcessInfo.cpu_time.offset
+# Modules before ppid and tgid were appended end after cpu_time
+PROCESS_INFO_CPU_TIME_SIZE = ProcessInfo.ppid.offset
+
+_process_types: Dict[int, type] = {PROCESS_INFO_SIZE: ProcessInfo}
+
+def process_info_type(stride: int) -> type:
+    """ProcessInfo cut or padded to the process_info_len a frame declares"""
+    cls = _process_types.get(stride)
+    if cls is None:
+        fields = [(name, ctype) for name, ctype in ProcessInfo._fields_
+                  if getattr(ProcessInfo, name).offset +
+                  ctypes.sizeof(ctype) <= stride]
+        used = (getattr(ProcessInfo, fields[-1][0]).offset +
+                ctypes.sizeof(fields[-1][1]))
+        if stride > used:
+            # A newer module appended fields this daemon does not know
+            fields.append(('_reserved', ctypes.c_char * (stride - used)))
+        cls = type(f'ProcessInfo{stride}', (ctypes.Structure,), {
+            '_pack_': 1,
+            '_fields_': fields
+        })
+        _process_types[stride] = cls
+    return cls
+
 class MemoryInfo(ctypes.Structure):
     """Memory information structure matching kernel module"""
     _pack_ = 1
@@ -57,32 +222,2012 @@ class MemoryInfo(ctypes.Structure):
     ]
 
 class SystemMetrics(ctypes.Structure):
-    """System metrics structure matching kernel module"""
+    """v1 fixed-size metrics structure"""
     _pack_ = 1
     _fields_ = [
         ('cpu_usage', ctypes.c_ulong * NR_CPUS),
         ('memory', MemoryInfo),
-        ('processes', ProcessInfo * MAX_PROCESSES),
+        ('processes', process_info_type(PROCESS_INFO_MIN_SIZE) * MAX_PROCESSES),
         ('process_count', ctypes.c_int),
         ('timestamp', ctypes.c_ulong)
     ]
 
+class FrameHeader(ctypes.Structure):
+    """v2 frame header, followed by the CPU usage and process arrays"""
+    _pack_ = 1
+    _fields_ = [
+        ('magic', ctypes.c_uint32),
+        ('version', ctypes.c_uint16),
+        ('header_len', ctypes.c_uint16),       # offset of the CPU array
+        ('cpu_count', ctypes.c_uint32),
+        ('process_count', ctypes.c_uint32),
+        ('process_info_len', ctypes.c_uint16),  # stride of the process array
+        ('flags', ctypes.c_uint16),
+        ('timestamp_ns', ctypes.c_uint64),
+        ('memory', MemoryInfo),
+        ('collect_ns', ctypes.c_uint64)         # time spent collecting
+    ]
+
+SYSTEM_METRICS_SIZE = ctypes.sizeof(SystemMetrics)
+FRAME_HEADER_SIZE = ctypes.sizeof(FrameHeader)
+# Modules before collect_ns was appended send shorter headers
+FRAME_HEADER_MIN_SIZE = FrameHeader.collect_ns.offset
+FRAME_HEADER = struct.Struct('=IHHIIHHQ')  # FrameHeader up to memory
+# The same fields with magic through process_info_len as one bytes key
+FRAME_LAYOUT = struct.Struct('=18sHQ')
+SYSTEM_METRICS_TAIL = struct.Struct('=iQ')  # process_count, timestamp
+SYSTEM_METRICS_TAIL_OFFSET = SystemMetrics.process_count.offset
+COLLECT_NS = struct.Struct('=Q')
+CPU_USAGE_SIZE = ctypes.sizeof(ctypes.c_uint64)
+BYTE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+if np is not None:
+    # NumPy view of the same packed layout, for vectorized formatting
+    _ULONG = np.dtype(ctypes.c_ulong)
+    _LONG = np.dtype(ctypes.c_long)
+    PROCESS_DTYPE = np.dtype([
+        ('pid', np.int32),
+        ('cpu_usage', _ULONG),
+        ('comm', f'S{TASK_COMM_LEN}'),
+        ('mem_usage', _ULONG),
+        ('state', _LONG),
+        ('priority', _ULONG),
+        ('nice', _ULONG),
+        ('start_time', np.uint64),
+        ('cpu_time', np.uint64),
+        ('ppid', np.int32),
+        ('tgid', np.int32)
+    ])
+    assert PROCESS_DTYPE.itemsize == PROCESS_INFO_SIZE
+    _process_dtypes = {PROCESS_INFO_SIZE: PROCESS_DTYPE}
+
+    def process_dtype(stride: int) -> 'np.dtype':
+        """PROCESS_DTYPE with the item size a frame declares"""
+        dtype = _process_dtypes.get(stride)
+        if dtype is None:
+            fields = PROCESS_DTYPE.fields
+            names = [name for name in PROCESS_DTYPE.names
+                     if fields[name][1] + fields[name][0].itemsize <= stride]
+            dtype = np.dtype({
+                'names': names,
+                'formats': [fields[name][0] for name in names],
+                'offsets': [fields[name][1] for name in names],
+                'itemsize': stride
+            })
+            _process_dtypes[stride] = dtype
+        return dtype
+
+class MetricsFrame:
+    """A decoded metrics frame, viewing its receive buffer in place.
+
+    v2 frames and v1 struct system_metrics payloads both decode to this,
+    so formatting does not depend on which one the source sent.
+    """
+    __slots__ = ('buffer', 'timestamp', 'flags', 'memory', 'cpu_usage',
+                 'processes', 'process_count', 'processes_offset',
+                 'process_stride', 'legacy_tail', 'collect_ns')
+
+    @classmethod
+    def decode(cls, buffer: bytearray, offset: int,
+               length: int) -> Optional['MetricsFrame']:
+        """Overlay a v2 frame of length bytes at offset in buffer"""
+        if length < FRAME_HEADER_MIN_SIZE:
+            logger.warning(f"Short metrics frame: {length} bytes")
+            return None
+        (magic, version, header_len, cpu_count, process_count, stride,
+         flags, timestamp_ns) = FRAME_HEADER.unpack_from(buffer, offset)
+        if (magic != METRICS_MAGIC or version < METRICS_VERSION
+                or header_len < FRAME_HEADER_MIN_SIZE
+                or stride < PROCESS_INFO_MIN_SIZE):
+            logger.warning(f"Unsupported metrics frame (magic={magic:#x}, "
+                           f"version={version}, header_len={header_len}, "
+                           f"process_info_len={stride})")
+            return None
+        cpus = offset + header_len
+        processes = cpus + cpu_count * CPU_USAGE_SIZE
+        if processes + process_count * stride > offset + length:
+            logger.warning(f"Truncated metrics frame: {cpu_count} CPUs and "
+                           f"{process_count} processes in {length} bytes")
+            return None
+
+        frame = cls()
+        frame.buffer = buffer
+        frame.timestamp = timestamp_ns / 1e9
+        frame.flags = flags
+        frame.memory = MemoryInfo.from_buffer(
+            buffer, offset + FrameHeader.memory.offset)
+        frame.cpu_usage = (ctypes.c_uint64 * cpu_count).from_buffer(
+            buffer, cpus)
+        frame.processes = (process_info_type(stride) *
+                           process_count).from_buffer(buffer, processes)
+        frame.process_count = process_count
+        frame.processes_offset = processes
+        frame.process_stride = stride
+        frame.legacy_tail = None
+        frame.collect_ns = cls.read_collect_ns(buffer, offset, header_len)
+        return frame
+
+    @staticmethod
+    def read_collect_ns(buffer: bytearray, offset: int,
+                        header_len: int) -> Optional[int]:
+        """The frame's collection time, if its header is long enough"""
+        if header_len < FRAME_HEADER_SIZE:
+            return None
+        return COLLECT_NS.unpack_from(
+            buffer, offset + FrameHeader.collect_ns.offset)[0]
+
+    @classmethod
+    def decode_legacy(cls, buffer: bytearray,
+                      offset: int) -> 'MetricsFrame':
+        """Overlay a v1 struct system_metrics at offset in buffer"""
+        metrics = SystemMetrics.from_buffer(buffer, offset)
+        frame = cls()
+        frame.buffer = buffer
+        frame.flags = 0
+        frame.memory = metrics.memory
+        frame.cpu_usage = metrics.cpu_usage
+        frame.processes = metrics.processes
+        frame.processes_offset = offset + SystemMetrics.processes.offset
+        frame.process_stride = PROCESS_INFO_MIN_SIZE
+        frame.legacy_tail = offset + SYSTEM_METRICS_TAIL_OFFSET
+        frame.collect_ns = None
+        frame.refresh_legacy()
+        return frame
+
+    def refresh_legacy(self) -> None:
+        """Re-read the fields of a v1 overlay after the buffer was reused"""
+        count, timestamp = SYSTEM_METRICS_TAIL.unpack_from(self.buffer,
+                                                           self.legacy_tail)
+        self.timestamp = float(timestamp)
+        if count < 0:
+            count = 0
+        elif count > MAX_PROCESSES:
+            count = MAX_PROCESSES
+        self.process_count = count
+
+class FrameBuffer:
+    """A v2 frame being built, with ctypes views of each section"""
+
+    def __init__(self, cpu_count: int, process_capacity: int):
+        self.cpu_count = cpu_count
+        self.process_capacity = process_capacity
+        self.data = bytearray(FRAME_HEADER_SIZE + cpu_count * CPU_USAGE_SIZE +
+                              process_capacity * PROCESS_INFO_SIZE)
+        self.header = FrameHeader.from_buffer(self.data)
+        self.header.magic = METRICS_MAGIC
+        self.header.version = METRICS_VERSION
+        self.header.header_len = FRAME_HEADER_SIZE
+        self.header.cpu_count = cpu_count
+        self.header.process_info_len = PROCESS_INFO_SIZE
+        self.cpu_usage = (ctypes.c_uint64 * cpu_count).from_buffer(
+            self.data, FRAME_HEADER_SIZE)
+        self.processes = (ProcessInfo * process_capacity).from_buffer(
+            self.data, FRAME_HEADER_SIZE + cpu_count * CPU_USAGE_SIZE)
+
+    def datagrams(self, sequence: int) -> List[bytearray]:
+        """The frame as it is now, split into netlink datagrams"""
+        length = (FRAME_HEADER_SIZE + self.cpu_count * CPU_USAGE_SIZE +
+                  self.header.process_count * PROCESS_INFO_SIZE)
+        view = memoryview(self.data)[:length]
+        datagrams = []
+        for offset in range(0, length, FRAME_PART_MAX):
+            chunk = view[offset:offset + FRAME_PART_MAX]
+            last = offset + len(chunk) == length
+            datagram = netlink_frame(
+                FRAME_PART.pack(sequence & 0xffffffff, offset, length) +
+                chunk, SM_MSG_METRICS, 0 if last else NLM_F_MULTI)
+            datagrams.append(datagram)
+        return datagrams
+
+def nlmsg_align(length: int) -> int:
+    """Round a netlink message length up to NLMSG_ALIGNTO"""
+    return (length + NLMSG_ALIGNTO - 1) & ~(NLMSG_ALIGNTO - 1)
+
+class NetlinkReceiveRing:
+    """Preallocated receive buffers with metrics frames overlaid in place.
+
+    Datagrams are received straight into one of a few fixed bytearrays and
+    frames are decoded as ctypes overlays on the payload. A frame that fits
+    in one datagram is decoded without any copy; one split into several
+    parts is reassembled into one of as many assembly buffers, which are
+    reused while the frame size allows. Decoded frames are cached per
+    (slot, offset, layout), so a steady stream of frames allocates a few
+    hundred bytes of small objects per frame instead of a receive buffer
+    per datagram; it is not faster than copying a v1 frame out of a fresh
+    buffer. The ring only advances past a slot once a frame was decoded
+    from it, so a decoded frame stays valid until RECV_RING_SLOTS - 1 newer
+    frames have arrived.
+    """
+
+    def __init__(self, slots: int = RECV_RING_SLOTS,
+                 size: int = RECV_BUFFER_SIZE):
+        self.buffers = [bytearray(size) for _ in range(slots)]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        self.overlays: List[Dict[Any, MetricsFrame]] = [
+            {} for _ in range(slots)]
+        self.assembly: List[bytearray] = [bytearray() for _ in range(slots)]
+        self.assembly_views = [memoryview(buf) for buf in self.assembly]
+        self.assembly_overlays: List[Dict[Any, MetricsFrame]] = [
+            {} for _ in range(slots)]
+        self.assembly_slot = 0
+        self.assembling: Optional[Tuple[int, int]] = None  # sequence, next
+        self.incomplete = 0  # multipart frames abandoned for a missing part
+        self.slot = 0
+        self.recorder: Optional['FrameRecorder'] = None
+
+    def receive(self, sock: socket.socket) -> List[MetricsFrame]:
+        """Receive one datagram from sock and return the frames it completes.
+
+        Raises BlockingIOError when the socket queue is empty.
+        """
+        slot = self.slot
+        nbytes = sock.recv_into(self.views[slot])
+        if self.recorder is not None:
+            self.recorder.write(self.views[slot][:nbytes])
+        frames = self.decode(slot, nbytes)
+        if frames:
+            self.slot = (slot + 1) % len(self.buffers)
+        return frames
+
+    def decode(self, slot: int, nbytes: int) -> List[MetricsFrame]:
+        """Return the frames completed by a received datagram"""
+        buffer = self.buffers[slot]
+        overlays = self.overlays[slot]
+        frames = []
+        offset = 0
+        # Metrics messages are tested first and nlmsg_align() is inlined:
+        # this runs for every datagram
+        while offset + NLMSG_HDRLEN <= nbytes:
+            msg_len, msg_type, msg_flags, _seq, _pid = NLMSG_HDR.unpack_from(
+                buffer, offset)
+            if msg_len < NLMSG_HDRLEN or offset + msg_len > nbytes:
+                logger.warning(f"Truncated netlink message at offset {offset} "
+                               f"(nlmsg_len={msg_len}, datagram={nbytes})")
+                break
+            payload = offset + NLMSG_HDRLEN
+            offset += (msg_len + NLMSG_ALIGNTO - 1) & -NLMSG_ALIGNTO
+            length = msg_len - NLMSG_HDRLEN
+
+            if msg_type == SM_MSG_METRICS:
+                frame = self.decode_part(slot, payload, length)
+                if frame is not None:
+                    frames.append(frame)
+            elif (length >= SYSTEM_METRICS_SIZE
+                  and msg_type not in NLMSG_CONTROL):
+                # v1 module: one struct system_metrics per message
+                frame = overlays.get(payload)
+                if frame is None:
+                    frame = MetricsFrame.decode_legacy(buffer, payload)
+                    overlays[payload] = frame
+                else:
+                    frame.refresh_legacy()
+                frames.append(frame)
+            else:
+                self.skip_message(msg_type, msg_flags, length)
+        return frames
+
+    @staticmethod
+    def skip_message(msg_type: int, msg_flags: int, length: int) -> None:
+        """Log a netlink message without metrics unless it is expected"""
+        if msg_type == NLMSG_ERROR:
+            logger.warning("Received NLMSG_ERROR from kernel")
+        elif msg_type == NLMSG_NOOP or msg_type == NLMSG_OVERRUN:
+            pass
+        elif msg_type == NLMSG_DONE and length == 0:
+            pass  # terminator of a multipart sequence
+        else:
+            logger.warning(f"Short metrics payload: {length} bytes "
+                           f"(type={msg_type}, flags={msg_flags:#x})")
+
+    def decode_part(self, slot: int, payload: int,
+                    length: int) -> Optional[MetricsFrame]:
+        """Decode one part of a v2 frame, returning the frame once complete"""
+        if length < FRAME_PART.size:
+            logger.warning(f"Short frame part: {length} bytes")
+            return None
+        buffer = self.buffers[slot]
+        sequence, part_offset, total = FRAME_PART.unpack_from(buffer, payload)
+        data = payload + FRAME_PART.size
+        size = length - FRAME_PART.size
+        if total > FRAME_SIZE_LIMIT:
+            logger.warning(f"Oversized metrics frame: {total} bytes")
+            return None
+
+        if part_offset == 0 and size >= total:
+            # The whole frame in one part: overlay the receive buffer
+            if self.assembling is not None:
+                self.drop_incomplete()
+            return self.overlay(self.overlays[slot], buffer, data, total)
+
+        if part_offset == 0:
+            self.drop_incomplete()
+            self.assembly_slot = (self.assembly_slot + 1) % len(self.assembly)
+            if len(self.assembly[self.assembly_slot]) < total:
+                # Overlays keep the old buffer exported, so replace it
+                target = self.assembly[self.assembly_slot] = bytearray(total)
+                self.assembly_views[self.assembly_slot] = memoryview(target)
+                self.assembly_overlays[self.assembly_slot] = {}
+        elif self.assembling != (sequence, part_offset):
+            if self.assembling is not None:
+                self.drop_incomplete()
+            return None  # joined mid-frame or lost a part
+        target = self.assembly[self.assembly_slot]
+        if part_offset + size > min(total, len(target)):
+            logger.warning(f"Frame part overruns frame {sequence} "
+                           f"({part_offset}+{size} of {total} bytes)")
+            self.assembling = None
+            return None
+        self.assembly_views[self.assembly_slot][
+            part_offset:part_offset + size] = self.views[slot][data:data + size]
+        if part_offset + size < total:
+            self.assembling = (sequence, part_offset + size)
+            return None
+        self.assembling = None
+        return self.overlay(self.assembly_overlays[self.assembly_slot],
+                            target, 0, total)
+
+    def drop_incomplete(self) -> None:
+        if self.assembling is not None:
+            self.assembling = None
+            self.incomplete += 1
+            logger.warning(f"Dropped incomplete multipart frame "
+                           f"(total: {self.incomplete})")
+
+    @staticmethod
+    def overlay(overlays: Dict[Any, MetricsFrame], buffer: bytearray,
+                offset: int, length: int) -> Optional[MetricsFrame]:
+        """Decode the frame at offset, reusing a cached overlay if the
+        layout matches the last frame decoded there"""
+        layout, flags, timestamp_ns = FRAME_LAYOUT.unpack_from(buffer, offset)
+        key = (offset, length, layout)
+        frame = overlays.get(key)
+        if frame is None:
+            frame = MetricsFrame.decode(buffer, offset, length)
+            if frame is None:
+                return None
+            if len(overlays) >= 64:
+                overlays.clear()
+            overlays[key] = frame
+        else:
+            frame.flags = flags
+            frame.timestamp = timestamp_ns / 1e9
+            if frame.collect_ns is not None:
+                # header_len is part of the key, so the field is still there
+                frame.collect_ns = COLLECT_NS.unpack_from(
+                    buffer, offset + FRAME_HEADER_MIN_SIZE)[0]
+        return frame
+
+def netlink_frame(payload: bytes, msg_type: int = NLMSG_DONE,
+                  flags: int = 0) -> bytearray:
+    """Wrap a payload in an nlmsghdr the way the kernel module sends it"""
+    length = NLMSG_HDRLEN + len(payload)
+    frame = bytearray(nlmsg_align(length))
+    NLMSG_HDR.pack_into(frame, 0, length, msg_type, flags, 0, 0)
+    frame[NLMSG_HDRLEN:length] = payload
+    return frame
+
+class FrameRecorder:
+    """Append every received datagram to a capture file for later replay"""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'wb')
+        self.file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+        self.started = time.monotonic()
+        self.count = 0
+
+    def write(self, datagram: memoryview) -> None:
+        self.file.write(CAPTURE_RECORD.pack(time.monotonic() - self.started,
+                                            len(datagram)))
+        self.file.write(datagram)
+        self.count += 1
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+            logger.info(f"Recorded {self.count} datagrams")
+
+class FrameSource:
+    """Userspace stand-in for the kernel module.
+
+    A feeder thread writes netlink-framed datagrams into one end of a
+    Unix socket pair, and the daemon reads the other end exactly as it
+    reads the netlink socket, so the whole receive path is exercised. Like
+    the kernel's multicast, the feeder never blocks: frames that do not
+    fit in the receive queue are dropped and counted, and the remaining
+    parts of a multipart frame are not sent once one of them was dropped.
+    """
+
+    def __init__(self, rate: Optional[float] = None):
+        self.rate = rate  # frames per second, None for source timing, 0 paused
+        self.sent = 0     # frames
+        self.dropped = 0  # frames
+        self.started = 0.0  # monotonic time the feeder started
+        self.tx: Optional[socket.socket] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()  # rate changed or stopping
+
+    def datagrams(self) -> Iterator[Tuple[float, List[bytes]]]:
+        """Yield (seconds since start, datagrams of one frame) pairs"""
+        raise NotImplementedError
+
+    def open(self) -> socket.socket:
+        """Start feeding and return the socket to read datagrams from"""
+        # SOCK_SEQPACKET keeps datagram boundaries, but its queue is bounded
+        # by the send buffer rather than by net.unix.max_dgram_qlen (10)
+        rx, self.tx = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.tx.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                           NETLINK_RCVBUF)
+        rx.setblocking(False)
+        self.tx.setblocking(False)
+        self.thread = threading.Thread(target=self.feed, daemon=True,
+                                       name=type(self).__name__)
+        self.thread.start()
+        return rx
+
+    def set_interval(self, interval_ms: int) -> None:
+        """Produce a frame every interval_ms from now on, or pause at 0"""
+        self.rate = 1000.0 / interval_ms if interval_ms else 0.0
+        self.wakeup.set()
+
+    def sleep_until(self, deadline: float) -> bool:
+        """Wait for deadline; False if woken early or stopping"""
+        delay = deadline - time.monotonic()
+        if delay > 0 and self.wakeup.wait(delay):
+            self.wakeup.clear()
+            return False
+        return not self.stopping.is_set()
+
+    def feed(self) -> None:
+        self.started = time.monotonic()
+        frames = self.datagrams()
+        rate = self.rate
+        # A paced frame is due at base + (index - base_index) / rate. When
+        # the rate changes the schedule restarts one new interval after the
+        # previous frame, or now if that has passed, so a pause is not made
+        # up with a burst. The frame is only produced once due, so it is
+        # fresh.
+        base, base_index = self.started, 0
+        deadline = self.started
+        index = 0
+        while not self.stopping.is_set():
+            try:
+                if self.rate != rate:
+                    rate = self.rate
+                    if index and rate:
+                        base = max(deadline + 1.0 / rate, time.monotonic())
+                        base_index = index
+                if rate == 0:
+                    self.wakeup.wait()  # paused until set_interval
+                    self.wakeup.clear()
+                    continue
+                if rate is not None:
+                    deadline = base + (index - base_index) / rate
+                    if not self.sleep_until(deadline):
+                        continue
+                    _offset, datagrams = next(frames)
+                else:
+                    offset, datagrams = next(frames)
+                    deadline = self.started + offset
+                    while not self.sleep_until(deadline):
+                        if self.stopping.is_set():
+                            return
+            except StopIteration:
+                break
+            index += 1
+            try:
+                for datagram in datagrams:
+                    self.tx.send(datagram)
+                self.sent += 1
+            except BlockingIOError:
+                self.dropped += 1
+            except OSError:
+                break  # reader closed
+        logger.info(f"{type(self).__name__} finished: {self.sent} sent, "
+                    f"{self.dropped} dropped")
+
+    def close(self) -> None:
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+        if self.tx:
+            self.tx.close()
+
+class SyntheticSource(FrameSource):
+    """Generate plausible metrics frames at a fixed rate.
+
+    A short random walk of frames is generated up front and cycled, with
+    only the sequence and timestamp rewritten per send, so the feeder costs
+    almost nothing even at 1000 frames/s. Frames larger than FRAME_PART_MAX
+    are split into parts like the kernel module does. The processes form a
+    random tree, and the last `threads` rows are extra threads of them, as
+    the module sends with report_threads.
+    """
+
+    # Where each part's sequence and the first part's timestamp_ns live
+    SEQUENCE_OFFSET = NLMSG_HDRLEN
+    TIMESTAMP_OFFSET = (NLMSG_HDRLEN + FRAME_PART.size +
+                        FrameHeader.timestamp_ns.offset)
+    SEQUENCE = struct.Struct('=I')
+    TIMESTAMP = struct.Struct('=Q')
+
+    def __init__(self, rate: float = 1.0, cpu_count: int = 8,
+                 process_count: int = PROCESS_ROWS, seed: int = 0,
+                 threads: int = 0):
+        super().__init__(rate)
+        if cpu_count <= 0:
+            raise ValueError("cpu_count must be positive")
+        if process_count < 0:
+            raise ValueError("process_count must not be negative")
+        if threads and not 0 < threads < process_count:
+            raise ValueError("threads must be fewer than the processes")
+        self.frames = self.generate(cpu_count, process_count, seed, threads)
+
+    @staticmethod
+    def generate(cpu_count: int, process_count: int, seed: int,
+                 threads: int = 0) -> List[List[bytearray]]:
+        rng = random.Random(seed)
+        tree = random.Random(seed)  # apart, so the metrics stay the same
+        leaders = process_count - threads
+        frame = FrameBuffer(cpu_count, process_count)
+        memory = frame.header.memory
+        memory.total = 16 << 30
+        frame.header.process_count = process_count
+        frame.header.flags = FRAME_TASK_IDS | (FRAME_THREADS if threads else 0)
+        for i in range(process_count):
+            proc = frame.processes[i]
+            proc.pid = 1000 + i
+            if i < leaders:
+                proc.tgid = proc.pid
+                proc.ppid = 1000 + tree.randrange(i) if i else 1
+            else:
+                leader = frame.processes[tree.randrange(leaders)]
+                proc.tgid = leader.pid
+                proc.ppid = leader.ppid
+            proc.comm = f"synthetic{i}".encode()[:TASK_COMM_LEN - 1]
+            proc.state = ord('S')
+            proc.priority = 120
+            proc.start_time = (i + 1) * 1000000000
+            proc.mem_usage = rng.randint(1 << 20, 1 << 30)
+        cpu = [rng.randint(0, 100) for _ in range(cpu_count)]
+
+        frames = []
+        for _ in range(SYNTHETIC_VARIANTS):
+            for i in range(cpu_count):
+                cpu[i] = min(100, max(0, cpu[i] + rng.randint(-10, 10)))
+                frame.cpu_usage[i] = cpu[i]
+            for i in range(process_count):
+                proc = frame.processes[i]
+                proc.cpu_usage = min(100, max(0, proc.cpu_usage +
+                                              rng.randint(-5, 5)))
+                proc.mem_usage = max(1 << 20, proc.mem_usage +
+                                     rng.randint(-1 << 20, 1 << 20))
+            used = min(memory.total,
+                       sum(frame.processes[i].mem_usage
+                           for i in range(process_count)) + (2 << 30))
+            memory.used = used
+            memory.free = memory.total - used
+            memory.available = memory.free
+            frames.append(frame.datagrams(0))
+        return frames
+
+    def timestamp_ns(self, index: int) -> int:
+        """Timestamp stamped into the index-th frame sent"""
+        return time.time_ns()
+
+    def datagrams(self) -> Iterator[Tuple[float, List[bytes]]]:
+        index = 0
+        while True:
+            datagrams = self.frames[index % len(self.frames)]
+            for datagram in datagrams:
+                self.SEQUENCE.pack_into(datagram, self.SEQUENCE_OFFSET,
+                                        index & 0xffffffff)
+            self.TIMESTAMP.pack_into(datagrams[0], self.TIMESTAMP_OFFSET,
+                                     self.timestamp_ns(index))
+            yield 0.0, datagrams
+            index += 1
+
+class ReplaySource(FrameSource):
+    """Replay a capture written by FrameRecorder.
+
+    Frames are sent with their recorded spacing divided by speed, or at a
+    fixed rate if one is given. Frames keep their recorded timestamps.
+    Datagrams flagged NLM_F_MULTI are grouped with the ones that follow,
+    up to the last part of the frame.
+    """
+
+    def __init__(self, path: str, rate: Optional[float] = None,
+                 speed: float = 1.0, repeat: bool = False):
+        super().__init__(rate)
+        self.path = path
+        self.speed = speed
+        self.repeat = repeat
+        with open(path, 'rb') as f:
+            self.read_header(f)
+
+    @staticmethod
+    def read_header(f) -> None:
+        header = f.read(CAPTURE_HEADER.size)
+        if len(header) < CAPTURE_HEADER.size:
+            raise ValueError(f"{f.name}: not a capture file")
+        magic, version = CAPTURE_HEADER.unpack(header)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            raise ValueError(f"{f.name}: unsupported capture "
+                             f"(magic={magic!r}, version={version})")
+
+    def datagrams(self) -> Iterator[Tuple[float, List[bytes]]]:
+        base = 0.0
+        with open(self.path, 'rb') as f:
+            while True:
+                self.read_header(f)
+                last = 0.0
+                count = 0
+                parts: List[bytes] = []
+                while True:
+                    record = f.read(CAPTURE_RECORD.size)
+                    if len(record) < CAPTURE_RECORD.size:
+                        break
+                    offset, length = CAPTURE_RECORD.unpack(record)
+                    datagram = f.read(length)
+                    if len(datagram) < length:
+                        logger.warning(f"{self.path}: truncated record")
+                        break
+                    parts.append(datagram)
+                    if (len(datagram) >= NLMSG_HDRLEN and
+                            NLMSG_HDR.unpack_from(datagram)[2] & NLM_F_MULTI):
+                        continue
+                    last = offset / self.speed
+                    count += 1
+                    yield base + last, parts
+                    parts = []
+                if not self.repeat or not count:
+                    return
+                base += last
+                f.seek(0)
+
+class ProcTask:
+    """Per-process state the /proc collector keeps between ticks"""
+    __slots__ = ('pid', 'stat_fd', 'sched_fd', 'runtime', 'cpu', 'comm',
+                 'state', 'priority', 'nice', 'start_time', 'rss', 'threads',
+                 'cpu_time', 'ppid')
+
+    def __init__(self, pid: int, stat_fd: Optional[int],
+                 sched_fd: Optional[int]):
+        self.pid = pid
+        # Kept open across ticks; None past the descriptor budget
+        self.stat_fd = stat_fd
+        self.sched_fd = sched_fd
+        self.runtime = -1   # main thread CPU time from schedstat, in ns
+        self.cpu_time = -1  # CPU time of all threads, in ns
+        self.threads = 0
+        self.cpu = 0
+        self.comm = None
+        self.start_time = None  # tells a reused pid apart
+
+    def parse(self, raw: bytes, page_size: int, ns_per_tick: float) -> None:
+        """Update fields from a /proc/[pid]/stat line"""
+        # comm may contain spaces and parentheses: split on the last ')'
+        close = raw.rindex(b')')
+        self.comm = raw[raw.index(b'(') + 1:close]
+        fields = raw[close + 2:].split()
+        self.state = fields[0][0]
+        self.ppid = int(fields[1])
+        self.priority = int(fields[15]) + 100  # task->prio, as the module sends
+        self.nice = int(fields[16])
+        self.threads = int(fields[17])
+        self.start_time = int(int(fields[19]) * ns_per_tick)
+        self.rss = int(fields[21]) * page_size
+        # utime + stime of every thread
+        self.cpu_time = int((int(fields[11]) + int(fields[12])) * ns_per_tick)
+
+class ProcCollector(FrameSource):
+    """Build metrics frames from /proc instead of the kernel module.
+
+    Files are kept open and re-read with pread, so a tick costs one small
+    read per process rather than an open/read/close per file, and /proc is
+    only listed when a new pid was allocated. Each tick reads
+    /proc/[pid]/schedstat, which is far cheaper for the kernel to produce
+    than /proc/[pid]/stat. It only covers the main thread, so the stat
+    line is read and parsed only for multithreaded processes,
+    single-threaded ones whose CPU time moved, and a rotating
+    1/PROC_REFRESH_TICKS of the rest (to catch RSS changes).
+    Per-process CPU usage is the share of one CPU used since the previous
+    tick, and the busiest max_processes processes are sent with their
+    total CPU time.
+    """
+
+    def __init__(self, rate: float = 1.0, proc: str = '/proc',
+                 max_processes: int = FRAME_MAX_PROCESSES):
+        super().__init__(rate)
+        self.proc = proc
+        self.max_processes = max_processes
+        self.page_size = resource.getpagesize()
+        self.ns_per_tick = 1e9 / os.sysconf('SC_CLK_TCK')
+        self.stat_fd = os.open(f"{proc}/stat", os.O_RDONLY | os.O_CLOEXEC)
+        self.meminfo_fd = os.open(f"{proc}/meminfo",
+                                  os.O_RDONLY | os.O_CLOEXEC)
+        self.loadavg_fd = os.open(f"{proc}/loadavg",
+                                  os.O_RDONLY | os.O_CLOEXEC)
+        self.last_pid = b''
+        # schedstat needs CONFIG_SCHED_INFO; without it every stat is read
+        self.schedstat = os.path.exists(f"{proc}/self/schedstat")
+        self.fd_budget = self.raise_fd_limit() - PROC_FD_RESERVE
+        self.open_fds = 0
+        self.tasks: Dict[int, ProcTask] = {}
+        self.cpu_times: List[Tuple[int, int]] = []  # (busy, total) per CPU
+        self.ticks = 0
+        self.last_scan = 0  # CLOCK_MONOTONIC ns
+        self.frame: Optional[FrameBuffer] = None  # sized on the first tick
+
+    @staticmethod
+    def raise_fd_limit() -> int:
+        """Raise the soft descriptor limit to the hard one, return it"""
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and soft < hard:
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+                soft = hard
+            except (ValueError, OSError):
+                pass
+        return soft
+
+    def read_cpu(self) -> None:
+        """Per-CPU busy percentage since the previous tick, as the module does"""
+        data = os.pread(self.stat_fd, 65536, 0)
+        previous = self.cpu_times
+        current = []
+        for line in data.split(b'\n')[1:]:
+            if not line.startswith(b'cpu'):
+                break
+            user, nice, system, idle, iowait, irq, softirq = map(
+                int, line.split()[1:8])
+            busy = user + nice + system + irq + softirq
+            current.append((busy, busy + idle + iowait))
+        if self.frame is None or self.frame.cpu_count != len(current):
+            # First tick or a CPU was hotplugged
+            self.frame = FrameBuffer(len(current), self.max_processes)
+        cpu_usage = self.frame.cpu_usage
+        for cpu, (busy, total) in enumerate(current):
+            if cpu < len(previous) and total > previous[cpu][1]:
+                cpu_usage[cpu] = ((busy - previous[cpu][0]) * 100 //
+                                  (total - previous[cpu][1]))
+            else:
+                cpu_usage[cpu] = 0
+        self.cpu_times = current
+
+    def read_memory(self) -> None:
+        values = {}
+        for line in os.pread(self.meminfo_fd, 65536, 0).splitlines():
+            key, _, rest = line.partition(b':')
+            values[key] = int(rest.split()[0]) * 1024
+        memory = self.frame.header.memory
+        memory.total = values[b'MemTotal']
+        memory.free = values[b'MemFree']
+        memory.buffers = values[b'Buffers']
+        memory.cached = values[b'Cached']
+        memory.available = values.get(b'MemAvailable', memory.free)
+        memory.used = max(0, memory.total - memory.free - memory.buffers -
+                          memory.cached)
+
+    def open_file(self, pid: int, name: str) -> Optional[int]:
+        if self.open_fds >= self.fd_budget:
+            return None
+        fd = os.open(f"{self.proc}/{pid}/{name}", os.O_RDONLY | os.O_CLOEXEC)
+        self.open_fds += 1
+        return fd
+
+    def read_file(self, fd: Optional[int], pid: int, name: str) -> bytes:
+        if fd is not None:
+            return os.pread(fd, PROC_STAT_READ_SIZE, 0)
+        with open(f"{self.proc}/{pid}/{name}", 'rb') as f:
+            return f.read(PROC_STAT_READ_SIZE)
+
+    def add_task(self, pid: int) -> None:
+        task = self.tasks[pid] = ProcTask(pid, None, None)
+        try:
+            task.stat_fd = self.open_file(pid, 'stat')
+            if self.schedstat:
+                task.sched_fd = self.open_file(pid, 'schedstat')
+        except OSError:
+            self.drop_task(task)  # already gone
+
+    def drop_task(self, task: ProcTask) -> None:
+        for fd in (task.stat_fd, task.sched_fd):
+            if fd is not None:
+                os.close(fd)
+                self.open_fds -= 1
+        del self.tasks[task.pid]
+
+    def read_processes(self, elapsed: float) -> Tuple[List[ProcTask],
+                                                      List[ProcTask]]:
+        """Refresh every process, return (busy, idle) for those still alive"""
+        tasks = self.tasks
+        # The last field of loadavg is the most recently allocated pid: if it
+        # has not moved, no process was created and the listing is skipped.
+        # Exited processes are noticed when their files fail to read.
+        last_pid = os.pread(self.loadavg_fd, 256, 0).split()[-1]
+        if last_pid != self.last_pid:
+            self.last_pid = last_pid
+            for name in os.listdir(self.proc):
+                if name.isdigit() and int(name) not in tasks:
+                    self.add_task(int(name))
+
+        page_size = self.page_size
+        ns_per_tick = self.ns_per_tick
+        schedstat = self.schedstat
+        refresh = self.ticks % PROC_REFRESH_TICKS
+        self.ticks += 1
+        # CPU ns -> percent of one CPU over the elapsed interval
+        scale = 100.0 / (elapsed * 1e9) if elapsed > 0 else 0.0
+        busy, idle, exited = [], [], []
+        for task in tasks.values():
+            try:
+                if schedstat:
+                    fd = task.sched_fd
+                    raw = (os.pread(fd, PROC_STAT_READ_SIZE, 0)
+                           if fd is not None else
+                           self.read_file(None, task.pid, 'schedstat'))
+                    runtime = int(raw[:raw.index(b' ')])
+                    # schedstat only covers the main thread, so processes
+                    # with other threads always have their stat read
+                    if (runtime == task.runtime and task.threads == 1 and
+                            task.pid % PROC_REFRESH_TICKS != refresh):
+                        task.cpu = 0  # has not run: stat is unchanged too
+                        idle.append(task)
+                        continue
+                    task.runtime = runtime
+                previous = task.cpu_time
+                started = task.start_time
+                task.parse(self.read_file(task.stat_fd, task.pid, 'stat'),
+                           page_size, ns_per_tick)
+            except (OSError, ValueError):
+                # ESRCH once the process has exited, even if its pid is
+                # reused; empty reads for exiting tasks fail to parse
+                exited.append(task)
+                continue
+            if started is not None and task.start_time != started:
+                # Past the descriptor budget files are read by path, which
+                # follows a reused pid to the new process: start over
+                previous = -1
+            task.cpu = (round(max(0, task.cpu_time - previous) * scale)
+                        if previous >= 0 else 0)
+            (busy if task.cpu else idle).append(task)
+        for task in exited:
+            self.drop_task(task)
+        return busy, idle
+
+    def collect(self) -> None:
+        """Fill self.frame with one tick of /proc data"""
+        started = time.monotonic_ns()
+        elapsed = (started - self.last_scan) / 1e9 if self.last_scan else 0.0
+        self.last_scan = started
+
+        self.read_cpu()
+        self.read_memory()
+        busy, idle = self.read_processes(elapsed)
+        # Most processes are idle: rank only the busy ones by CPU and fill
+        # any remaining rows with the largest idle ones
+        limit = self.max_processes
+        top = heapq.nlargest(limit, busy,
+                             key=lambda task: (task.cpu, task.rss))
+        if len(top) < limit:
+            top += heapq.nlargest(limit - len(top), idle,
+                                  key=attrgetter('rss'))
+        processes = self.frame.processes
+        for i, task in enumerate(top):
+            proc = processes[i]
+            proc.pid = task.pid
+            proc.comm = task.comm[:TASK_COMM_LEN - 1]
+            proc.cpu_usage = task.cpu
+            proc.mem_usage = task.rss
+            proc.state = task.state
+            proc.priority = task.priority
+            proc.nice = task.nice
+            proc.start_time = task.start_time
+            proc.cpu_time = task.cpu_time
+            proc.ppid = task.ppid
+            proc.tgid = task.pid
+        header = self.frame.header
+        header.process_count = len(top)
+        header.flags = FRAME_SORTED_CPU | FRAME_CPU_TIME | FRAME_TASK_IDS
+        header.timestamp_ns = time.time_ns()
+        header.collect_ns = time.monotonic_ns() - started
+
+    def datagrams(self) -> Iterator[Tuple[float, List[bytes]]]:
+        sequence = 0
+        while True:
+            try:
+                self.collect()
+            except OSError as e:
+                logger.error(f"Error reading {self.proc}: {e}")
+                if self.stopping.wait(1.0):
+                    return
+                continue
+            yield 0.0, self.frame.datagrams(sequence)
+            sequence += 1
+
+    def close(self) -> None:
+        super().close()
+        for task in list(self.tasks.values()):
+            self.drop_task(task)
+        for fd in (self.stat_fd, self.meminfo_fd, self.loadavg_fd):
+            if fd is not None:
+                os.close(fd)
+        self.stat_fd = self.meminfo_fd = self.loadavg_fd = None
+
+class EnrichEntry:
+    """Open files and static fields for one reported process"""
+    __slots__ = ('stat_fd', 'statm_fd', 'user', 'cmdline')
+
+    def __init__(self, stat_fd: int, statm_fd: int, user: str, cmdline: str):
+        self.stat_fd = stat_fd
+        self.statm_fd = statm_fd
+        self.user = user
+        self.cmdline = cmdline
+
+    def close(self) -> None:
+        os.close(self.stat_fd)
+        os.close(self.statm_fd)
+
+class EnrichShard:
+    """Reads /proc details for the processes of one shard.
+
+    A shard only ever runs in one worker at a time, so its cache needs no
+    locking. Entries are keyed by (pid, start_time) as reported in the
+    frame, so a reused pid gets a fresh entry, and are closed as soon as
+    their process is no longer reported.
+    """
+
+    usernames: Dict[int, str] = {}  # uid -> name, shared by all shards
+
+    def __init__(self, proc: str = '/proc'):
+        self.proc = proc
+        self.page_size = resource.getpagesize()
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.entries: Dict[Tuple[int, int], EnrichEntry] = {}
+
+    @classmethod
+    def username(cls, uid: int) -> str:
+        name = cls.usernames.get(uid)
+        if name is None:
+            try:
+                name = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                name = str(uid)
+            cls.usernames[uid] = name
+        return name
+
+    def open_entry(self, pid: int) -> EnrichEntry:
+        base = f"{self.proc}/{pid}"
+        with open(f"{base}/status", 'rb') as f:
+            status = f.read()
+        uid = int(status[status.index(b'\nUid:') + 5:].split(None, 1)[0])
+        with open(f"{base}/cmdline", 'rb') as f:
+            cmdline = f.read(ENRICH_CMDLINE_MAX)
+        cmdline = cmdline.rstrip(b'\0').replace(b'\0', b' ')
+        stat_fd = os.open(f"{base}/stat", os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            statm_fd = os.open(f"{base}/statm", os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            os.close(stat_fd)
+            raise
+        return EnrichEntry(stat_fd, statm_fd, self.username(uid),
+                           cmdline.decode('utf-8', 'replace'))
+
+    def collect(self, keys: List[Tuple[int, int]]
+                ) -> Dict[Tuple[int, int], Dict[str, Any]]:
+        """Return the dynamic and cached static fields for each key"""
+        entries = self.entries
+        for key in set(entries).difference(keys):
+            entries.pop(key).close()
+
+        page_size = self.page_size
+        clock_ticks = self.clock_ticks
+        results = {}
+        for key in keys:
+            try:
+                entry = entries.get(key)
+                if entry is None:
+                    entry = entries[key] = self.open_entry(key[0])
+                stat = os.pread(entry.stat_fd, PROC_STAT_READ_SIZE, 0)
+                statm = os.pread(entry.statm_fd, PROC_STAT_READ_SIZE, 0)
+                fields = stat[stat.rindex(b')') + 2:].split()
+                size, _resident, shared = statm.split(None, 3)[:3]
+            except (OSError, ValueError):
+                # Exited (ESRCH) or vanished between the frame and now
+                entry = entries.pop(key, None)
+                if entry is not None:
+                    entry.close()
+                continue
+            results[key] = {
+                'virt': int(size) * page_size,
+                'shared': int(shared) * page_size,
+                'cpu_time': (int(fields[11]) + int(fields[12])) / clock_ticks,
+                'threads': int(fields[17]),
+                'user': entry.user,
+                'cmdline': entry.cmdline
+            }
+        return results
+
+    def close(self) -> None:
+        for entry in self.entries.values():
+            entry.close()
+        self.entries.clear()
+
+class ProcessEnricher:
+    """Adds /proc details the frame does not carry to each process row.
+
+    Reported processes are sharded by pid across a small thread pool; the
+    event loop only awaits the merged result. Frames are never held back
+    for it: each frame is merged with the most recent completed result,
+    and a new refresh starts only once the previous one has finished, so
+    broadcast latency does not grow with the process count.
+    """
+
+    def __init__(self, shards: int = ENRICH_SHARDS, proc: str = '/proc'):
+        self.shards = [EnrichShard(proc) for _ in range(shards)]
+        self.pool = ThreadPoolExecutor(max_workers=shards,
+                                       thread_name_prefix='enrich')
+        self.latest: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self.refreshing: Optional[asyncio.Task] = None
+
+    def merge(self, processes: List[Dict[str, Any]]) -> None:
+        """Add the latest known details to process rows in place"""
+        latest = self.latest
+        for row in processes:
+            details = latest.get((row['pid'], row['start_time']))
+            if details is not None:
+                # Fields the frame carried itself (cpu_time) are fresher
+                for key, value in details.items():
+                    row.setdefault(key, value)
+
+    def refresh(self, processes: List[Dict[str, Any]]) -> None:
+        """Start reading details for these processes unless already busy"""
+        if self.refreshing is not None and not self.refreshing.done():
+            return
+        count = len(self.shards)
+        keys = [[] for _ in range(count)]
+        for row in processes:
+            keys[row['pid'] % count].append((row['pid'], row['start_time']))
+        self.refreshing = asyncio.ensure_future(self.collect(keys))
+
+    async def collect(self, keys: List[List[Tuple[int, int]]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self.pool, shard.collect, shard_keys)
+                for shard, shard_keys in zip(self.shards, keys)))
+        except Exception as e:
+            logger.error(f"Error enriching processes: {e}", exc_info=True)
+            return
+        latest = {}
+        for result in results:
+            latest.update(result)
+        self.latest = latest
+
+    def close(self) -> None:
+        if self.refreshing is not None:
+            self.refreshing.cancel()
+        self.pool.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+class MetricsHistory:
+    """Fixed-capacity ring buffer of history samples.
+
+    Each series is a preallocated array('d') sharing one head index, so
+    appending is O(1) with no per-sample objects, and timestamps are epoch
+    seconds. window() returns memoryview segments over the arrays rather
+    than copies.
+    """
+
+    SERIES = ('timestamp', 'cpu', 'memory')
+
+    def __init__(self, capacity: int, series: Tuple[str, ...] = SERIES):
+        self.capacity = capacity
+        self.series = series
+        self.arrays = {name: array('d', bytes(8 * capacity))
+                       for name in series}
+        self.views = {name: memoryview(data)
+                      for name, data in self.arrays.items()}
+        self.columns = [self.arrays[name] for name in series]
+        self.start = 0  # physical index of the oldest sample
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self, *values: float) -> None:
+        """Append one value per series, overwriting the oldest once full"""
+        end = self.start + self.length
+        if end >= self.capacity:
+            end -= self.capacity
+        for column, value in zip(self.columns, values):
+            column[end] = value
+        if self.length < self.capacity:
+            self.length += 1
+        else:
+            self.start = end + 1 if end + 1 < self.capacity else 0
+
+    def timestamp_at(self, index: int) -> float:
+        """Timestamp of the index-th oldest sample"""
+        return self.arrays['timestamp'][(self.start + index) % self.capacity]
+
+    def index_since(self, timestamp: float) -> int:
+        """Index of the oldest sample taken at or after timestamp"""
+        stamps = self.arrays['timestamp']
+        start = self.start
+        end = start + self.length
+        if end <= self.capacity:
+            return bisect_left(stamps, timestamp, start, end) - start
+        # Wrapped: search whichever physical segment holds the boundary
+        if timestamp <= stamps[self.capacity - 1]:
+            return bisect_left(stamps, timestamp, start, self.capacity) - start
+        return (bisect_left(stamps, timestamp, 0, end - self.capacity)
+                + self.capacity - start)
+
+    def segments(self, name: str, first: int = 0) -> List[memoryview]:
+        """Zero-copy views of a series from the first-th oldest sample on"""
+        view = self.views[name]
+        begin = self.start + first
+        end = self.start + self.length
+        if end <= self.capacity:
+            return [view[begin:end]]
+        if begin >= self.capacity:
+            return [view[begin - self.capacity:end - self.capacity]]
+        return [view[begin:], view[:end - self.capacity]]
+
+    def window(self, seconds: float,
+               now: Optional[float] = None) -> Dict[str, List[memoryview]]:
+        """Zero-copy views of every series over the last seconds"""
+        if now is None:
+            now = self.timestamp_at(self.length - 1) if self.length else 0.0
+        first = self.index_since(now - seconds)
+        return {name: self.segments(name, first) for name in self.series}
+
+    def to_dict(self, first: int = 0) -> Dict[str, List[float]]:
+        """Materialize the series as lists, e.g. for JSON encoding"""
+        return {name: [value for segment in self.segments(name, first)
+                       for value in segment.tolist()]
+                for name in self.series}
+
+class HistoryRollup:
+    """Incrementally maintained min/max/avg rollup of the history.
+
+    Samples are folded into the open bucket as they arrive; when a sample
+    falls into a new bucket the open one is closed and appended to a
+    MetricsHistory ring, so memory stays bounded by the tier's capacity.
+    """
+
+    SERIES = ('timestamp',
+              'cpu_min', 'cpu_max', 'cpu_avg',
+              'memory_min', 'memory_max', 'memory_avg')
+
+    def __init__(self, bucket_seconds: int, capacity: int):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = MetricsHistory(capacity, self.SERIES)
+        self.bucket_start: Optional[float] = None
+        self.count = 0
+
+    def add(self, timestamp: float, cpu: float, memory: float) -> None:
+        """Fold one raw sample into the rollup"""
+        bucket = timestamp - timestamp % self.bucket_seconds
+        if bucket != self.bucket_start:
+            if self.count:
+                self.buckets.append(*self.open_bucket())
+            self.bucket_start = bucket
+            self.count = 0
+        if self.count:
+            self.cpu_min = min(self.cpu_min, cpu)
+            self.cpu_max = max(self.cpu_max, cpu)
+            self.memory_min = min(self.memory_min, memory)
+            self.memory_max = max(self.memory_max, memory)
+            self.cpu_sum += cpu
+            self.memory_sum += memory
+        else:
+            self.cpu_min = self.cpu_max = self.cpu_sum = cpu
+            self.memory_min = self.memory_max = self.memory_sum = memory
+        self.count += 1
+
+    def open_bucket(self) -> Tuple[float, ...]:
+        """Values of the bucket still being filled, in SERIES order"""
+        return (float(self.bucket_start),
+                float(self.cpu_min), float(self.cpu_max),
+                self.cpu_sum / self.count,
+                float(self.memory_min), float(self.memory_max),
+                self.memory_sum / self.count)
+
+    def to_dict(self, since: Optional[float] = None) -> Dict[str, List[float]]:
+        """Closed buckets starting at or after since, plus the open one"""
+        first = self.buckets.index_since(since) if since is not None else 0
+        result = self.buckets.to_dict(first)
+        if self.count and (since is None or self.bucket_start >= since):
+            for name, value in zip(self.SERIES, self.open_bucket()):
+                result[name].append(value)
+        return result
+
+# History tiers served to clients: resolution -> (bucket seconds, buckets)
+HISTORY_ROLLUPS = {
+    '10s': (10, 360),    # last hour
+    '1m': (60, 1440)     # last 24 hours
+}
+
+class ProcessCpuTracker:
+    """Per-interval CPU usage of each process from its cumulative CPU time.
+
+    Remembers (pid, start_time, cpu_time) of the processes in the previous
+    frame and matches the next frame against them, with NumPy
+    searchsorted over pid-sorted arrays when available and a dict
+    otherwise. Usage is measured between the two frames' timestamps, so it
+    stays right when frames were coalesced. Processes not in the previous
+    frame, or whose pid was reused, keep the usage the source reported.
+    Only the last frame's processes are kept, so exited pids drop out on
+    their own.
+    """
+
+    def __init__(self):
+        self.timestamp: Optional[float] = None
+        self.previous: Dict[int, Tuple[int, int]] = {}  # pid -> start, time
+        self.pids = None         # NumPy path: previous frame, sorted by pid
+        self.start_times = None
+        self.cpu_times = None
+
+    def reset(self) -> None:
+        """Forget the previous frame, e.g. one without cpu_time arrived"""
+        self.timestamp = None
+        self.previous = {}
+        self.pids = self.start_times = self.cpu_times = None
+
+    def scale(self, timestamp: float) -> float:
+        """Percent of one CPU per ns of CPU time since the previous frame"""
+        elapsed = timestamp - self.timestamp if self.timestamp else 0.0
+        self.timestamp = timestamp
+        return 100.0 / (elapsed * 1e9) if elapsed > 0 else 0.0
+
+    def update_rows(self, timestamp: float, rows: List[Dict[str, Any]],
+                    cpu_times: List[int]) -> None:
+        """Set each row's cpu_usage from its cpu_time, in place"""
+        scale = self.scale(timestamp)
+        previous = self.previous
+        current = {}
+        for row, cpu_time in zip(rows, cpu_times):
+            pid = row['pid']
+            start_time = row['start_time']
+            current[pid] = (start_time, cpu_time)
+            last = previous.get(pid)
+            if (scale and last is not None and last[0] == start_time
+                    and cpu_time >= last[1]):
+                row['cpu_usage'] = round((cpu_time - last[1]) * scale, 1)
+        self.previous = current
+
+    def update_arrays(self, timestamp: float, pids: 'np.ndarray',
+                      start_times: 'np.ndarray', cpu_times: 'np.ndarray',
+                      reported: 'np.ndarray') -> 'np.ndarray':
+        """Vectorized update_rows: return usage per process as float64"""
+        scale = self.scale(timestamp)
+        usage = reported.astype(np.float64)
+        # Searching with sorted pids keeps the lookups cache friendly
+        order = np.argsort(pids)
+        pids = pids[order]
+        start_times = start_times[order]
+        cpu_times = cpu_times[order]
+        if scale and self.pids is not None and len(self.pids):
+            index = np.searchsorted(self.pids, pids)
+            index[index == len(self.pids)] = 0
+            last = self.cpu_times[index]
+            known = ((self.pids[index] == pids) &
+                     (self.start_times[index] == start_times) &
+                     (cpu_times >= last))
+            usage[order[known]] = np.round(
+                (cpu_times[known] - last[known]) * scale, 1)
+        self.pids = pids
+        self.start_times = start_times
+        self.cpu_times = cpu_times
+        return usage
+
+class ProcessSeries:
+    """Recent CPU and RSS samples of one process instance"""
+
+    SERIES = ('timestamp', 'cpu', 'rss', 'cpu_sum')
+
+    __slots__ = ('pid', 'start_time', 'name', 'history', 'cpu_sum',
+                 'last_seen', 'cpus', 'cpu_sums')
+
+    def __init__(self, pid: int, start_time: int, name: str):
+        self.pid = pid
+        self.start_time = start_time
+        self.name = name
+        self.history = MetricsHistory(PROCESS_HISTORY_SIZE, self.SERIES)
+        self.cpus = self.history.arrays['cpu']
+        self.cpu_sums = self.history.arrays['cpu_sum']
+        self.cpu_sum = 0.0  # running total, for O(1) window averages
+        self.last_seen = 0.0
+
+    def append(self, timestamp: float, cpu: float, rss: float) -> None:
+        self.cpu_sum += cpu
+        self.last_seen = timestamp
+        self.history.append(timestamp, cpu, rss, self.cpu_sum)
+
+    def average_cpu(self, since: float) -> Optional[float]:
+        """Mean CPU over the samples taken at or after since"""
+        if self.last_seen < since:
+            return None
+        history = self.history
+        first = history.index_since(since)
+        head = history.start + first
+        if head >= history.capacity:
+            head -= history.capacity
+        tail = history.start + history.length - 1
+        if tail >= history.capacity:
+            tail -= history.capacity
+        base = self.cpu_sums[head] - self.cpus[head]
+        return (self.cpu_sums[tail] - base) / (history.length - first)
+
+class ProcessHistoryIndex:
+    """Per-process CPU/RSS series keyed by (pid, start time).
+
+    The start time keeps a reused PID from inheriting another process's
+    history. Entries are kept in least-recently-seen order and the oldest
+    are evicted once capacity is exceeded, which drops exited processes
+    first since live ones are refreshed every tick.
+    """
+
+    def __init__(self, capacity: int = PROCESS_INDEX_CAPACITY):
+        self.capacity = capacity
+        self.entries: 'OrderedDict[Tuple[int, int], ProcessSeries]' = \
+            OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def update(self, timestamp: float,
+               processes: List[Dict[str, Any]]) -> None:
+        """Record one tick's formatted process list"""
+        entries = self.entries
+        for proc in processes:
+            key = (proc['pid'], proc['start_time'])
+            series = entries.get(key)
+            if series is None:
+                series = entries[key] = ProcessSeries(
+                    proc['pid'], proc['start_time'], proc['name'])
+            else:
+                entries.move_to_end(key)
+            series.append(timestamp, proc['cpu_usage'], proc['mem_usage'])
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def top(self, seconds: float, limit: int = 10,
+            now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Processes with the highest mean CPU over the last seconds"""
+        if now is None:
+            now = time.time()
+        since = now - seconds
+        ranked = []
+        for series in self.entries.values():
+            average = series.average_cpu(since)
+            if average is not None:
+                ranked.append((average, series))
+        return [{
+            'pid': series.pid,
+            'start_time': series.start_time,
+            'name': series.name,
+            'cpu_average': average
+        } for average, series in heapq.nlargest(
+            limit, ranked, key=lambda item: item[0])]
+
+    def series(self, pid: int,
+               start_time: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Recorded samples of a process (the newest instance of pid)"""
+        for (entry_pid, entry_start), series in reversed(self.entries.items()):
+            if entry_pid == pid and start_time in (None, entry_start):
+                data = series.history.to_dict()
+                del data['cpu_sum']
+                return dict(data, pid=pid, start_time=entry_start,
+                            name=series.name)
+        return None
+
+class SegmentHeader(ctypes.Structure):
+    """Header at the start of every store segment file"""
+    _pack_ = 1
+    _fields_ = [
+        ('magic', ctypes.c_char * 4),
+        ('version', ctypes.c_uint16),
+        ('flags', ctypes.c_uint16),
+        ('cpu_count', ctypes.c_uint16),
+        ('process_count', ctypes.c_uint16),
+        ('record_size', ctypes.c_uint32),
+        ('start', ctypes.c_uint64)  # epoch seconds of the segment's hour
+    ]
+
+class StoredProcess(ctypes.Structure):
+    """Per-process entry of a stored sample"""
+    _pack_ = 1
+    _fields_ = [
+        ('pid', ctypes.c_int32),
+        ('cpu_usage', ctypes.c_float),
+        ('mem_usage', ctypes.c_uint64),
+        ('comm', ctypes.c_char * TASK_COMM_LEN)
+    ]
+
+_store_record_types: Dict[Tuple[int, int], type] = {}
+
+def store_record_type(cpu_count: int, process_count: int) -> type:
+    """Fixed-size record layout for the given CPU and process counts.
+
+    The counts are written to each segment header, so segments written
+    with a different layout stay readable.
+    """
+    key = (cpu_count, process_count)
+    record_type = _store_record_types.get(key)
+    if record_type is None:
+        class StoredSample(ctypes.Structure):
+            _pack_ = 1
+            _fields_ = [
+                ('timestamp', ctypes.c_double),
+                ('cpu_usage', ctypes.c_float * cpu_count),
+                ('memory', ctypes.c_uint64 * len(MEMORY_FIELDS)),
+                ('process_count', ctypes.c_uint16),
+                ('processes', StoredProcess * process_count)
+            ]
+        record_type = _store_record_types[key] = StoredSample
+    return record_type
+
+class MetricsStore:
+    """Append-only on-disk time-series store.
+
+    Each UTC hour gets a segment file: a SegmentHeader followed by
+    fixed-size records, so reads memory-map the file and binary-search the
+    timestamps without parsing. Segments older than compact_after_hours are
+    downsampled to one record per compact_seconds (keeping the busiest
+    sample of each interval) and deleted after retention_hours.
+    """
+
+    def __init__(self, directory: str,
+                 cpu_count: int = NR_CPUS,
+                 process_count: int = STORE_TOP_PROCESSES,
+                 retention_hours: int = STORE_RETENTION_HOURS,
+                 compact_after_hours: int = STORE_COMPACT_AFTER_HOURS,
+                 compact_seconds: int = STORE_COMPACT_SECONDS):
+        self.directory = Path(directory)
+        self.cpu_count = cpu_count
+        self.process_count = process_count
+        self.retention = retention_hours * 3600
+        self.compact_after = compact_after_hours * 3600
+        self.compact_seconds = compact_seconds
+        self.record_type = store_record_type(cpu_count, process_count)
+        self.record = self.record_type()
+        self.fd: Optional[int] = None
+        self.segment_start: Optional[int] = None
+        self.segment_path: Optional[Path] = None
+
+    def close(self) -> None:
+        """Close the segment being written"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.segment_start = None
+            self.segment_path = None
+
+    @staticmethod
+    def segment_name(start: int, suffix: int = 0) -> str:
+        """File name of the segment covering the hour starting at start"""
+        name = time.strftime('%Y%m%dT%H', time.gmtime(start))
+        return f"{name}.{suffix}.seg" if suffix else f"{name}.seg"
+
+    @staticmethod
+    def segment_start_of(path: Path) -> int:
+        """Epoch start of the hour a segment file covers"""
+        return calendar.timegm(time.strptime(path.name[:11], '%Y%m%dT%H'))
+
+    @staticmethod
+    def read_header(fd: int) -> Optional[SegmentHeader]:
+        """Read and validate a segment header"""
+        data = os.pread(fd, ctypes.sizeof(SegmentHeader), 0)
+        if len(data) < ctypes.sizeof(SegmentHeader):
+            return None
+        header = SegmentHeader.from_buffer_copy(data)
+        if header.magic != STORE_MAGIC or header.version != STORE_VERSION:
+            return None
+        return header
+
+    def open_segment(self, start: int) -> None:
+        """Open (or create) the segment for the hour starting at start"""
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        record_size = ctypes.sizeof(self.record_type)
+        suffix = 0
+        while True:
+            path = self.directory / self.segment_name(start, suffix)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            size = os.fstat(fd).st_size
+            if size == 0:
+                header = SegmentHeader(STORE_MAGIC, STORE_VERSION, 0,
+                                       self.cpu_count, self.process_count,
+                                       record_size, start)
+                os.write(fd, header)
+                break
+            header = self.read_header(fd)
+            if (header is not None and not header.flags & SEGMENT_COMPACTED
+                    and header.record_size == record_size
+                    and header.cpu_count == self.cpu_count
+                    and header.process_count == self.process_count):
+                # Drop a record torn by a crash mid-write
+                torn = (size - ctypes.sizeof(SegmentHeader)) % record_size
+                if torn:
+                    os.ftruncate(fd, size - torn)
+                break
+            # Written with another layout; continue in a sibling file
+            os.close(fd)
+            suffix += 1
+
+        self.fd = fd
+        self.segment_start = start
+        self.segment_path = path
+        logger.info(f"Writing metrics segment {path}")
+
+    def append(self, metrics: Dict[str, Any]) -> bool:
+        """Append one formatted sample; returns True if a new segment began"""
+        timestamp = metrics['epoch']
+        start = int(timestamp) - int(timestamp) % SEGMENT_SECONDS
+        cpus = metrics['cpu_usage']
+        if len(cpus) != self.cpu_count:
+            # Frames carry the online CPUs only; a new count means a new
+            # record layout, so continue in a sibling segment
+            self.cpu_count = len(cpus)
+            self.record_type = store_record_type(self.cpu_count,
+                                                 self.process_count)
+            self.record = self.record_type()
+            self.close()
+        rotated = start != self.segment_start
+        if rotated:
+            self.open_segment(start)
+
+        record = self.record
+        ctypes.memset(ctypes.addressof(record), 0, ctypes.sizeof(record))
+        record.timestamp = timestamp
+        record.cpu_usage[:] = cpus
+        memory = metrics['memory']
+        record.memory[:] = [memory[field] for field in MEMORY_FIELDS]
+        processes = metrics['processes'][:self.process_count]
+        record.process_count = len(processes)
+        for stored, proc in zip(record.processes, processes):
+            stored.pid = proc['pid']
+            stored.cpu_usage = proc['cpu_usage']
+            stored.mem_usage = proc['mem_usage']
+            stored.comm = proc['name'].encode('utf-8', 'ignore')[:TASK_COMM_LEN]
+        os.write(self.fd, record)
+        return rotated
+
+    def segment_files(self) -> List[Tuple[int, Path]]:
+        """All segment files as (hour start, path), oldest first"""
+        if not self.directory.is_dir():
+            return []
+        segments = []
+        for path in self.directory.glob('*.seg'):
+            try:
+                segments.append((self.segment_start_of(path), path))
+            except ValueError:
+                logger.warning(f"Ignoring unexpected file {path}")
+        segments.sort()
+        return segments
+
+    @staticmethod
+    def record_to_dict(record, cpu_count: int) -> Dict[str, Any]:
+        """Convert a stored record to the JSON-friendly query format"""
+        return {
+            'timestamp': record.timestamp,
+            'cpu_usage': list(record.cpu_usage[:cpu_count]),
+            'memory': dict(zip(MEMORY_FIELDS, record.memory)),
+            'processes': [{
+                'pid': proc.pid,
+                'name': proc.comm.decode('utf-8', 'ignore'),
+                'cpu_usage': round(proc.cpu_usage, 2),
+                'mem_usage': proc.mem_usage
+            } for proc in record.processes[:record.process_count]]
+        }
+
+    def read_segment(self, path: Path, start: float,
+                     end: float) -> List[Dict[str, Any]]:
+        """Samples of one segment with start <= timestamp <= end"""
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            header = self.read_header(f.fileno())
+            if header is None or size <= ctypes.sizeof(SegmentHeader):
+                return []
+            count = (size - ctypes.sizeof(SegmentHeader)) // header.record_size
+            if not count:
+                return []
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+        try:
+            record_type = store_record_type(header.cpu_count,
+                                            header.process_count)
+            records = (record_type * count).from_buffer(
+                mapped, ctypes.sizeof(SegmentHeader))
+            low, high = 0, count
+            while low < high:
+                mid = (low + high) // 2
+                if records[mid].timestamp < start:
+                    low = mid + 1
+                else:
+                    high = mid
+            samples = []
+            record = None
+            for index in range(low, count):
+                record = records[index]
+                if record.timestamp > end:
+                    break
+                samples.append(self.record_to_dict(record, header.cpu_count))
+            del record, records
+            return samples
+        finally:
+            mapped.close()
+
+    def query(self, start: float, end: float,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Samples between start and end, evenly thinned to at most limit"""
+        samples = []
+        for segment_start, path in self.segment_files():
+            if segment_start + SEGMENT_SECONDS <= start or segment_start > end:
+                continue
+            samples.extend(self.read_segment(path, start, end))
+        if limit and len(samples) > limit:
+            stride = -(-len(samples) // limit)
+            samples = samples[::stride]
+        return samples
+
+    def maintain(self, now: Optional[float] = None) -> None:
+        """Delete segments past retention and compact old ones"""
+        now = time.time() if now is None else now
+        for segment_start, path in self.segment_files():
+            if path == self.segment_path:
+                continue
+            age = now - (segment_start + SEGMENT_SECONDS)
+            try:
+                if age >= self.retention:
+                    path.unlink()
+                    logger.info(f"Removed expired segment {path}")
+                elif age >= self.compact_after:
+                    self.compact(path)
+            except OSError as e:
+                logger.error(f"Error maintaining segment {path}: {e}")
+
+    def compact(self, path: Path) -> None:
+        """Downsample a segment in place to one record per compact_seconds"""
+        with open(path, 'rb') as f:
+            header = self.read_header(f.fileno())
+            if header is None or header.flags & SEGMENT_COMPACTED:
+                return
+            data = f.read()
+
+        record_size = header.record_size
+        cpu_count = header.cpu_count
+        offset = ctypes.sizeof(SegmentHeader)
+        count = (len(data) - offset) // record_size
+        record_type = store_record_type(cpu_count, header.process_count)
+
+        # Keep the busiest sample of each interval so spikes survive
+        kept: Dict[int, Tuple[float, int]] = {}
+        for index in range(count):
+            record = record_type.from_buffer_copy(
+                data, offset + index * record_size)
+            bucket = int(record.timestamp) // self.compact_seconds
+            load = sum(record.cpu_usage[:cpu_count])
+            if bucket not in kept or load > kept[bucket][0]:
+                kept[bucket] = (load, index)
+
+        header.flags |= SEGMENT_COMPACTED
+        temp = path.with_suffix('.tmp')
+        with open(temp, 'wb') as f:
+            f.write(header)
+            for bucket in sorted(kept):
+                begin = offset + kept[bucket][1] * record_size
+                f.write(data[begin:begin + record_size])
+        os.replace(temp, path)
+        logger.info(f"Compacted segment {path}: {count} -> {len(kept)} records")
+
+class Subscription:
+    """What a group of clients receives in each metrics message.
+
+    Clients that ask for the same fields, process rows, sort key and rate
+    share one Subscription, so each tick is encoded once per subscription
+    rather than once per client.
+    """
+
+    def __init__(self, fields: Tuple[str, ...], processes: int, sort: str,
+                 max_rate: Optional[float]):
+        self.fields = fields
+        self.processes = processes
+        self.sort = sort
+        self.max_rate = max_rate
+        self.min_interval = 0.0
+        if max_rate:
+            self.min_interval = (1.0 - SUBSCRIBE_RATE_SLACK) / max_rate
+        self.clients: Set[websockets.WebSocketServerProtocol] = set()
+        self.last_sent = float('-inf')  # CLOCK_MONOTONIC
+
+    @property
+    def key(self) -> Tuple:
+        return (self.fields, self.processes, self.sort, self.max_rate)
+
+    @classmethod
+    def default(cls, max_processes: int = PROCESS_ROWS) -> 'Subscription':
+        """Everything, every tick: what clients get until they subscribe"""
+        return cls(SUBSCRIBE_FIELDS, max_processes, 'cpu_usage', None)
+
+    @classmethod
+    def parse(cls, request: Dict[str, Any],
+              max_processes: int = PROCESS_ROWS) -> 'Subscription':
+        """Validate a subscribe request, raising ValueError if malformed.
+
+        Omitted settings take their defaults, with all of the up to
+        max_processes rows the daemon sends. Settings that cannot affect
+        the message are normalized, so equivalent requests share a key.
+        """
+        fields = request.get('fields', SUBSCRIBE_FIELDS)
+        if (not isinstance(fields, list) and fields is not SUBSCRIBE_FIELDS
+                or not all(field in SUBSCRIBE_FIELDS for field in fields)):
+            raise ValueError(f"fields must be a list of {SUBSCRIBE_FIELDS}")
+        # Rows beyond what the binary encoding can count are never sent
+        max_processes = min(max_processes, BINARY_MAX_COUNT)
+        processes = request.get('processes', max_processes)
+        if (not isinstance(processes, int) or isinstance(processes, bool)
+                or not 0 <= processes <= max_processes):
+            raise ValueError(f"processes must be 0 to {max_processes}")
+        sort = request.get('sort', 'cpu_usage')
+        if sort not in SUBSCRIBE_SORT_KEYS:
+            raise ValueError(f"sort must be one of "
+                             f"{tuple(SUBSCRIBE_SORT_KEYS)}")
+        max_rate = request.get('max_rate')
+        if max_rate is not None and (
+                not isinstance(max_rate, (int, float))
+                or isinstance(max_rate, bool) or not max_rate > 0):
+            raise ValueError("max_rate must be a positive number")
+
+        # Keep SUBSCRIBE_FIELDS order so the key does not depend on the
+        # order the client listed them in
+        fields = tuple(field for field in SUBSCRIBE_FIELDS if field in fields)
+        if 'processes' not in fields:
+            processes, sort = 0, 'cpu_usage'
+        return cls(fields, processes, sort,
+                   float(max_rate) if max_rate else None)
+
+    def describe(self) -> Dict[str, Any]:
+        """The subscription as confirmed to the client"""
+        return {'fields': list(self.fields), 'processes': self.processes,
+                'sort': self.sort, 'max_rate': self.max_rate}
+
+    def due(self, now: float) -> bool:
+        """Whether max_rate allows another message at now"""
+        return now - self.last_sent >= self.min_interval
+
+    def select(self, metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """The subscribed parts of formatted metrics, without history"""
+        body = {field: metrics[field] for field in self.fields
+                if field in metrics and field != 'processes'}
+        body['epoch'] = metrics['epoch']
+        if 'processes' in self.fields:
+            rows = metrics.get('processes', [])
+            # Rows arrive sorted by CPU usage, busiest first
+            if self.sort != 'cpu_usage':
+                rows = sorted(rows, key=itemgetter(self.sort),
+                              reverse=SUBSCRIBE_SORT_KEYS[self.sort])
+            body['processes'] = rows[:self.processes]
+        return body
+
+def pack_array(typecode: str, values) -> bytes:
+    """values as a little-endian C array"""
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def unpack_array(typecode: str, data: bytes, offset: int,
+                 count: int) -> Tuple[list, int]:
+    """count little-endian values at offset, and the offset after them"""
+    unpacked = array(typecode)
+    end = offset + count * unpacked.itemsize
+    unpacked.frombytes(data[offset:end])
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked.tolist(), end
+
+def encode_binary_processes(rows: List[Dict[str, Any]]) -> List[bytes]:
+    """Process rows as a column mask and one packed array per column.
+
+    A column is left out when no row has the key (e.g. the /proc details
+    without enrichment); rows missing a key that others have get 0 or an
+    empty string.
+    """
+    columns = 0
+    parts = [b'']
+    for bit, (key, typecode) in enumerate(BINARY_PROCESS_COLUMNS):
+        try:
+            values = list(map(itemgetter(key), rows))
+        except KeyError:
+            if not any(key in row for row in rows):
+                continue
+            default = '' if typecode in 'cs' else 0
+            values = [row.get(key, default) for row in rows]
+        columns |= 1 << bit
+        if typecode == 'c':
+            parts.append(''.join(values).encode('latin-1', 'replace'))
+        elif typecode == 's':
+            data = '\0'.join(values).encode('utf-8', 'replace')
+            parts += [BINARY_STRINGS.pack(len(data)), data]
+        else:
+            parts.append(pack_array(typecode, values))
+    parts[0] = BINARY_COUNT.pack(len(rows)) + BINARY_COUNT.pack(columns)
+    return parts
+
+def encode_binary_metrics(frame: Dict[str, Any]) -> bytes:
+    """Pack a metrics message in the binary layout.
+
+    The header's field mask has bit i set when SUBSCRIBE_FIELDS[i] is
+    present, and the present fields follow in that order. Derived strings
+    (timestamp, *_formatted, mem_percent) are left for the client to
+    compute from the numbers.
+    """
+    fields = 0
+    parts = [b'']
+    for bit, field in enumerate(SUBSCRIBE_FIELDS):
+        if field not in frame:
+            continue
+        fields |= 1 << bit
+        value = frame[field]
+        if field == 'cpu_usage':
+            parts += [BINARY_COUNT.pack(len(value)), pack_array('f', value)]
+        elif field in ('cpu_average', 'collect_ms'):
+            parts.append(BINARY_FLOAT.pack(
+                float('nan') if value is None else value))
+        elif field == 'memory':
+            parts.append(BINARY_MEMORY.pack(
+                *(value[name] for name in MEMORY_FIELDS)))
+        elif field == 'processes':
+            parts += encode_binary_processes(value)
+        elif field == 'history_delta':
+            parts += [BINARY_HISTORY.pack(value['since'],
+                                          len(value['timestamp'])),
+                      pack_array('d', value['timestamp']),
+                      pack_array('f', value['cpu']),
+                      pack_array('f', value['memory'])]
+        # timestamp has no payload: it is epoch as local ISO 8601
+    parts[0] = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, fields,
+                                  frame['seq'], frame['epoch'])
+    return b''.join(parts)
+
+def decode_binary_metrics(data: bytes) -> Dict[str, Any]:
+    """Unpack a binary metrics message into the fields JSON would carry"""
+    magic, version, fields, seq, epoch = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"not a binary metrics message "
+                         f"(magic {magic!r}, version {version})")
+    frame: Dict[str, Any] = {'type': 'metrics', 'seq': seq, 'epoch': epoch}
+    offset = BINARY_HEADER.size
+    for bit, field in enumerate(SUBSCRIBE_FIELDS):
+        if not fields & 1 << bit:
+            continue
+        if field == 'cpu_usage':
+            (count,) = BINARY_COUNT.unpack_from(data, offset)
+            frame[field], offset = unpack_array('f', data, offset + 2, count)
+        elif field in ('cpu_average', 'collect_ms'):
+            (value,) = BINARY_FLOAT.unpack_from(data, offset)
+            frame[field] = None if value != value else value  # NaN is null
+            offset += BINARY_FLOAT.size
+        elif field == 'memory':
+            frame[field] = dict(zip(MEMORY_FIELDS,
+                                    BINARY_MEMORY.unpack_from(data, offset)))
+            offset += BINARY_MEMORY.size
+        elif field == 'processes':
+            frame[field], offset = decode_binary_processes(data, offset)
+        elif field == 'history_delta':
+            since, count = BINARY_HISTORY.unpack_from(data, offset)
+            offset += BINARY_HISTORY.size
+            delta: Dict[str, Any] = {'since': since}
+            for name, typecode in (('timestamp', 'd'), ('cpu', 'f'),
+                                   ('memory', 'f')):
+                delta[name], offset = unpack_array(typecode, data, offset,
+                                                   count)
+            frame[field] = delta
+        elif field == 'timestamp':
+            frame[field] = datetime.fromtimestamp(epoch).isoformat()
+    return frame
+
+def decode_binary_processes(data: bytes,
+                            offset: int) -> Tuple[List[Dict[str, Any]], int]:
+    (count,) = BINARY_COUNT.unpack_from(data, offset)
+    (columns,) = BINARY_COUNT.unpack_from(data, offset + 2)
+    offset += 4
+    keys = []
+    values = []
+    for bit, (key, typecode) in enumerate(BINARY_PROCESS_COLUMNS):
+        if not columns & 1 << bit:
+            continue
+        keys.append(key)
+        if typecode == 'c':
+            values.append(list(
+                bytes(data[offset:offset + count]).decode('latin-1')))
+            offset += count
+        elif typecode == 's':
+            (length,) = BINARY_STRINGS.unpack_from(data, offset)
+            offset += BINARY_STRINGS.size
+            text = bytes(data[offset:offset + length]).decode('utf-8')
+            values.append(text.split('\0') if count else [])
+            offset += length
+        else:
+            column, offset = unpack_array(typecode, data, offset, count)
+            values.append(column)
+    return [dict(zip(keys, row)) for row in zip(*values)], offset
+
 class SystemMonitorDaemon:
     """Main daemon class for system monitoring"""
 
-    def __init__(self, websocket_port: int = 8765):
+    def __init__(self, websocket_port: int = 8765,
+                 max_history_size: Optional[int] = None,
+                 store_dir: Optional[str] = STORE_DIR,
+                 source: Optional[FrameSource] = None,
+                 record_path: Optional[str] = None,
+                 enrich: bool = True,
+                 sample_intervals: Optional[Tuple[int, int]] = None,
+                 process_limit: int = PROCESS_ROWS):
         self.websocket_port = websocket_port
         self.clients: Set[websockets.WebSocketServerProtocol] = set()
-        self.metrics_history: Dict[str, list] = {
-            'cpu': [],
-            'memory': [],
-            'timestamp': []
+        # Default: HISTORY_SECONDS at the active sampling interval, or at
+        # one sample a second
+        if max_history_size is None:
+            interval_ms = sample_intervals[0] if sample_intervals else 1000
+            max_history_size = HISTORY_SECONDS * 1000 // interval_ms
+        self.max_history_size = max_history_size
+        self.process_limit = process_limit  # process rows sent per frame
+        self.cpu_tracker = ProcessCpuTracker()
+        self.metrics_history = MetricsHistory(max_history_size)
+        self.history_rollups = {
+            resolution: HistoryRollup(bucket_seconds, capacity)
+            for resolution, (bucket_seconds, capacity)
+            in HISTORY_ROLLUPS.items()
         }
-        self.max_history_size = 300  # 5 minutes at 1-second intervals
+        self.sequence = 0  # number of the latest history point
+        self.process_index = ProcessHistoryIndex()
+        self.store = MetricsStore(store_dir) if store_dir else None
+        self.enricher = ProcessEnricher() if enrich else None
         self.running = True
         self.loop = None
         self.server = None
-        self.setup_netlink_socket()
+        self.recv_ring = NetlinkReceiveRing()
+        self.pending_frame: Optional[MetricsFrame] = None
+        self.pending_received = 0.0
+        self.frame_ready: Optional[asyncio.Event] = None
+        self.netlink_stats = {
+            'datagrams': 0,
+            'frames': 0,
+            'coalesced': 0,
+            'overruns': 0,
+            'last_latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+            'last_collect_ms': 0.0,
+            'max_collect_ms': 0.0
+        }
+        self.broadcast_stats = {'evicted': 0, 'encoded': 0}
+        # Clients grouped by what they subscribed to, and the last seq
+        # each client has seen, which its next history_delta starts from
+        self.subscriptions: Dict[Tuple, Subscription] = {}
+        self.client_subscriptions: Dict[websockets.WebSocketServerProtocol,
+                                        Subscription] = {}
+        self.client_seq: Dict[websockets.WebSocketServerProtocol, int] = {}
+        # (active_ms, idle_ms) to adapt the source's sampling rate to
+        # whether anyone is watching, or None to leave it alone
+        self.sample_intervals = sample_intervals
+        self.sample_interval: Optional[int] = None  # last one requested
+        self.initial_interval: Optional[int] = None  # module's, restored on exit
+        self.idle_handle: Optional[asyncio.TimerHandle] = None
+        self.source = source
+        if record_path:
+            self.recv_ring.recorder = FrameRecorder(record_path)
+        if source:
+            self.sock = source.open()
+            logger.info(f"Reading frames from {type(source).__name__}")
+        else:
+            self.setup_netlink_socket()
         self.setup_signal_handlers()
         logger.info("Daemon initialized")
 
@@ -111,9 +2256,29 @@ class SystemMonitorDaemon:
             )
             self.clients.clear()
 
+        if self.idle_handle is not None:
+            self.idle_handle.cancel()
+        # Leave the module sampling at the rate it was loaded with
+        if self.initial_interval is not None and hasattr(self, 'sock'):
+            self.sample_interval = None
+            self.set_sample_interval(self.initial_interval)
+
         # Close netlink socket
         if hasattr(self, 'sock'):
+            if self.loop and self.sock.fileno() != -1:
+                self.loop.remove_reader(self.sock.fileno())
             self.sock.close()
+        if self.source:
+            self.source.close()
+        if self.recv_ring.recorder:
+            self.recv_ring.recorder.close()
+
+        if self.enricher:
+            self.enricher.close()
+
+        # Close the segment being written
+        if self.store:
+            self.store.close()
 
         # Close websocket server
         if self.server:
@@ -128,6 +2293,8 @@ class SystemMonitorDaemon:
             self.sock = socket.socket(socket.AF_NETLINK, 
                                     socket.SOCK_RAW, 
                                     NETLINK_TEST)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 NETLINK_RCVBUF)
             self.sock.bind((0, 1))  # Use group 1 for multicast
             self.sock.setblocking(False)
             logger.info("Netlink socket initialized successfully")
@@ -143,18 +2310,156 @@ class SystemMonitorDaemon:
             bytes_value /= 1024
         return f"{bytes_value:.2f}PB"
 
-    def format_metrics(self, metrics: SystemMetrics) -> Dict[str, Any]:
+    def format_bytes_vectorized(self, values) -> List[str]:
+        """format_bytes over a NumPy array of byte counts"""
+        values = values.astype(np.float64)
+        exponent = sum((values >= 1024.0 ** power).astype(np.int64)
+                       for power in range(1, 6))
+        scaled = values / np.power(1024.0, exponent)
+        return [f"{value:.2f}{BYTE_UNITS[unit]}"
+                for value, unit in zip(scaled.tolist(), exponent.tolist())]
+
+    def summarize_frame(self, metrics: MetricsFrame) -> Tuple[List[int], float, List[Dict[str, Any]]]:
+        """Per-CPU usage, CPU average and process rows sorted by CPU"""
+        cpu_usage = list(metrics.cpu_usage)
+        active_cpus = [x for x in cpu_usage if x > 0]
+        cpu_average = sum(active_cpus) / len(active_cpus) if active_cpus else 0
+
+        total = metrics.memory.total
+        presorted = metrics.flags & FRAME_SORTED_CPU
+        has_cpu_time = (metrics.flags & FRAME_CPU_TIME and
+                        metrics.process_stride >= PROCESS_INFO_CPU_TIME_SIZE)
+        has_task_ids = (metrics.flags & FRAME_TASK_IDS and
+                        metrics.process_stride >= PROCESS_INFO_SIZE)
+        count = metrics.process_count
+        if presorted:
+            count = min(count, self.process_limit)
+        processes = []
+        cpu_times = []
+        for i in range(count):
+            proc = metrics.processes[i]
+            processes.append({
+                'pid': proc.pid,
+                'name': proc.comm.decode('utf-8', 'ignore').strip('\x00'),
+                'cpu_usage': proc.cpu_usage,
+                'mem_usage': proc.mem_usage,
+                'mem_formatted': self.format_bytes(proc.mem_usage),
+                'mem_percent': proc.mem_usage * (100.0 / total) if total else 0.0,
+                'state': chr(proc.state),
+                'priority': proc.priority,
+                'nice': proc.nice,
+                'start_time': proc.start_time
+            })
+            if has_cpu_time:
+                cpu_times.append(proc.cpu_time)
+                processes[-1]['cpu_time'] = proc.cpu_time / 1e9
+            if has_task_ids:
+                processes[-1]['ppid'] = proc.ppid
+                processes[-1]['tgid'] = proc.tgid
+
+        if has_cpu_time:
+            self.cpu_tracker.update_rows(metrics.timestamp, processes,
+                                         cpu_times)
+        else:
+            self.cpu_tracker.reset()
+
+        # Sort processes by CPU usage, unless the source already did. Usage
+        # measured here can reorder the rows of a sorted frame slightly.
+        if not presorted or has_cpu_time:
+            processes.sort(key=lambda x: x['cpu_usage'], reverse=True)
+        return cpu_usage, cpu_average, processes[:self.process_limit]
+
+    def summarize_frame_vectorized(self, metrics: MetricsFrame) -> Tuple[List[int], float, List[Dict[str, Any]]]:
+        """NumPy version of summarize_frame.
+
+        The process array is viewed in place through process_dtype; sorting,
+        the CPU average and memory percentages are computed on arrays, and
+        dicts are only built for the rows that will be sent.
+        """
+        cpus = np.ctypeslib.as_array(metrics.cpu_usage)
+        active_cpus = cpus[cpus > 0]
+        cpu_average = float(active_cpus.mean()) if active_cpus.size else 0
+
+        procs = np.frombuffer(metrics.buffer,
+                              dtype=process_dtype(metrics.process_stride),
+                              count=metrics.process_count,
+                              offset=metrics.processes_offset)
+        has_cpu_time = (metrics.flags & FRAME_CPU_TIME and
+                        'cpu_time' in procs.dtype.names)
+        if has_cpu_time:
+            usage = self.cpu_tracker.update_arrays(
+                metrics.timestamp, procs['pid'], procs['start_time'],
+                procs['cpu_time'], procs['cpu_usage'])
+        else:
+            self.cpu_tracker.reset()
+            usage = procs['cpu_usage']
+        if metrics.flags & FRAME_SORTED_CPU:
+            procs = procs[:self.process_limit]
+            usage = usage[:self.process_limit]
+        if not metrics.flags & FRAME_SORTED_CPU or has_cpu_time:
+            # Stable descending sort, matching list.sort(reverse=True)
+            order = np.argsort(-usage.astype(np.float64),
+                               kind='stable')[:self.process_limit]
+            rows = procs[order]
+            usage = usage[order]
+        else:
+            rows = procs
+        total = metrics.memory.total
+        mem_usage = rows['mem_usage']
+        mem_percent = (mem_usage * (100.0 / total) if total
+                       else np.zeros(len(rows)))
+
+        processes = [{
+            'pid': pid,
+            'name': comm.split(b'\0', 1)[0].decode('utf-8', 'ignore'),
+            'cpu_usage': cpu,
+            'mem_usage': mem,
+            'mem_formatted': mem_formatted,
+            'mem_percent': percent,
+            'state': chr(state),
+            'priority': priority,
+            'nice': nice,
+            'start_time': start_time
+        } for (pid, comm, cpu, mem, mem_formatted, percent, state, priority,
+               nice, start_time)
+            in zip(rows['pid'].tolist(), rows['comm'].tolist(),
+                   usage.tolist(), mem_usage.tolist(),
+                   self.format_bytes_vectorized(mem_usage),
+                   mem_percent.tolist(), rows['state'].tolist(),
+                   rows['priority'].tolist(), rows['nice'].tolist(),
+                   rows['start_time'].tolist())]
+        if has_cpu_time:
+            for row, cpu_time in zip(processes,
+                                     (rows['cpu_time'] / 1e9).tolist()):
+                row['cpu_time'] = cpu_time
+        if metrics.flags & FRAME_TASK_IDS and 'tgid' in rows.dtype.names:
+            for row, ppid, tgid in zip(processes, rows['ppid'].tolist(),
+                                       rows['tgid'].tolist()):
+                row['ppid'] = ppid
+                row['tgid'] = tgid
+        return cpus.tolist(), cpu_average, processes
+
+    def format_metrics(self, metrics: MetricsFrame) -> Dict[str, Any]:
         """Format metrics into a dictionary"""
         try:
             # Validate and format timestamp
             try:
-                timestamp = datetime.fromtimestamp(metrics.timestamp).isoformat()
-            except (ValueError, OSError):
-                timestamp = datetime.now().isoformat()
+                epoch = metrics.timestamp
+                timestamp = datetime.fromtimestamp(epoch).isoformat()
+            except (ValueError, OSError, OverflowError):
+                epoch = time.time()
+                timestamp = datetime.fromtimestamp(epoch).isoformat()
                 logger.warning("Invalid timestamp received, using current time")
 
+            if np is not None:
+                cpu_usage, cpu_average, processes = \
+                    self.summarize_frame_vectorized(metrics)
+            else:
+                cpu_usage, cpu_average, processes = \
+                    self.summarize_frame(metrics)
+
             formatted = {
-                'cpu_usage': [metrics.cpu_usage[i] for i in range(NR_CPUS)],
+                'cpu_usage': cpu_usage,
                 'memory': {
                     'total': metrics.memory.total,
                     'used': metrics.memory.used,
@@ -166,133 +2471,484 @@ class SystemMonitorDaemon:
                     'used_formatted': self.format_bytes(metrics.memory.used),
                     'free_formatted': self.format_bytes(metrics.memory.free)
                 },
-                'processes': [],
-                'timestamp': timestamp
+                'processes': processes,
+                'timestamp': timestamp,
+                'epoch': epoch,
+                'cpu_average': cpu_average,
+                # Time the source spent collecting the frame, if it says
+                'collect_ms': (metrics.collect_ns / 1e6
+                               if metrics.collect_ns is not None else None)
             }
 
-            # Process information
-            for i in range(metrics.process_count):
-                proc = metrics.processes[i]
-                formatted['processes'].append({
-                    'pid': proc.pid,
-                    'name': proc.comm.decode('utf-8', 'ignore').strip('\x00'),
-                    'cpu_usage': proc.cpu_usage,
-                    'mem_usage': proc.mem_usage,
-                    'mem_formatted': self.format_bytes(proc.mem_usage),
-                    'state': chr(proc.state),
-                    'priority': proc.priority,
-                    'nice': proc.nice
-                })
-
-            # Sort processes by CPU usage
-            formatted['processes'].sort(
-                key=lambda x: x['cpu_usage'], 
-                reverse=True
-            )
-
-            # Calculate CPU average
-            active_cpus = [x for x in formatted['cpu_usage'] if x > 0]
-            formatted['cpu_average'] = (
-                sum(active_cpus) / len(active_cpus) if active_cpus else 0
-            )
-
             return formatted
         except Exception as e:
             logger.error(f"Error formatting metrics: {e}", exc_info=True)
             return {}
 
-    def update_metrics_history(self, metrics: Dict[str, Any]) -> None:
-        """Update metrics history"""
+    def update_metrics_history(self, metrics: Dict[str, Any]) -> Dict[str, list]:
+        """Update metrics history and return the points that were appended.
+
+        The sequence number only moves on when a point was appended, so
+        every seq a client is sent has its point in the history.
+        """
+        delta: Dict[str, list] = {'cpu': [], 'memory': [], 'timestamp': []}
         try:
-            self.metrics_history['cpu'].append(metrics['cpu_average'])
-            self.metrics_history['memory'].append(
-                metrics['memory']['used'] / metrics['memory']['total'] * 100
-            )
-            self.metrics_history['timestamp'].append(metrics['timestamp'])
+            cpu = metrics['cpu_average']
+            memory = metrics['memory']['used'] / metrics['memory']['total'] * 100
+            timestamp = metrics['epoch']
 
-            # Maintain history size
-            if len(self.metrics_history['cpu']) > self.max_history_size:
-                for key in self.metrics_history:
-                    self.metrics_history[key].pop(0)
+            self.metrics_history.append(timestamp, cpu, memory)
+            self.sequence += 1
+            for rollup in self.history_rollups.values():
+                rollup.add(timestamp, cpu, memory)
+            delta = {'cpu': [cpu], 'memory': [memory], 'timestamp': [timestamp]}
         except Exception as e:
             logger.error(f"Error updating history: {e}", exc_info=True)
+        return delta
+
+    def history_snapshot(self) -> str:
+        """Encode the full history, sent on connect and on resync requests"""
+        return json.dumps({
+            'type': 'snapshot',
+            'seq': self.sequence,
+            'history': self.metrics_history.to_dict()
+        }, separators=(',', ':'))
+
+    def history_window(self, seconds: Any, resolution: Any = None) -> str:
+        """Encode the last seconds of history (all of it if omitted).
+
+        resolution selects raw samples ('1s', the default) or one of the
+        HISTORY_ROLLUPS tiers.
+        """
+        if seconds is not None and (
+                not isinstance(seconds, (int, float))
+                or isinstance(seconds, bool) or seconds <= 0):
+            return json.dumps({'type': 'error',
+                               'message': 'history seconds must be a '
+                                          'positive number'})
+        history = self.metrics_history
+        since = None
+        if seconds is not None and history:
+            since = history.timestamp_at(len(history) - 1) - seconds
+
+        if resolution in (None, '1s'):
+            first = history.index_since(since) if since is not None else 0
+            series = history.to_dict(first)
+        elif resolution in self.history_rollups:
+            series = self.history_rollups[resolution].to_dict(since)
+        else:
+            return json.dumps({
+                'type': 'error',
+                'message': f"unknown history resolution {resolution!r}",
+                'resolutions': ['1s', *self.history_rollups]
+            })
 
-    async def broadcast_metrics(self, metrics: Dict[str, Any]) -> None:
-        """Broadcast metrics to all connected WebSocket clients"""
+        return json.dumps({
+            'type': 'history',
+            'seconds': seconds,
+            'resolution': resolution or '1s',
+            'history': series
+        }, separators=(',', ':'))
+
+    def top_processes(self, request: Dict[str, Any]) -> str:
+        """Rank processes by mean CPU over a recent window"""
+        seconds = request.get('seconds', 300)
+        limit = request.get('limit', 10)
+        if (not isinstance(seconds, (int, float)) or isinstance(seconds, bool)
+                or seconds <= 0):
+            return json.dumps({'type': 'error',
+                               'message': 'top_processes seconds must be a '
+                                          'positive number'})
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            return json.dumps({'type': 'error',
+                               'message': 'top_processes limit must be a '
+                                          'positive integer'})
+        return json.dumps({
+            'type': 'top_processes',
+            'seconds': seconds,
+            'processes': self.process_index.top(seconds, limit)
+        }, separators=(',', ':'))
+
+    async def query_store(self, request: Dict[str, Any]) -> str:
+        """Answer a range query against the on-disk store"""
+        start, end = request.get('start'), request.get('end', time.time())
+        limit = request.get('limit', 3600)
+        if not self.store:
+            return json.dumps({'type': 'error',
+                               'message': 'persistent store is disabled'})
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                   for v in (start, end)):
+            return json.dumps({'type': 'error',
+                               'message': 'query needs numeric start and '
+                                          'end'})
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            return json.dumps({'type': 'error',
+                               'message': 'query limit must be a positive '
+                                          'integer'})
+        samples = await self.loop.run_in_executor(
+            None, self.store.query, start, end, limit)
+        return json.dumps({
+            'type': 'query',
+            'start': start,
+            'end': end,
+            'samples': samples
+        }, separators=(',', ':'))
+
+    async def broadcast_metrics(self, metrics: Dict[str, Any],
+                                history_delta: Dict[str, list]) -> None:
+        """Broadcast metrics to all connected WebSocket clients.
+
+        Each frame carries only the history points appended since the
+        previous sequence number; clients get the full history from the
+        snapshot sent on connect and ask for a resync if they see a gap.
+        """
         if not self.clients:
             return
 
-        try:
-            metrics['history'] = self.metrics_history
-            message = json.dumps(metrics)
-            
-            disconnected = set()
-            for client in self.clients:
+        # Serialize once per subscription, encoding and history position;
+        # in steady state every client of a subscription is at the same
+        # seq, so that is once per subscription and encoding.
+        # websockets.broadcast frames the message once and writes it to
+        # every client without waiting on any of them.
+        seq = self.sequence
+        now = time.monotonic()
+        for subscription in list(self.subscriptions.values()):
+            if not subscription.clients or not subscription.due(now):
+                continue
+            subscription.last_sent = now
+            body = None
+            positions: Dict[Tuple[bool, int], list] = {}
+            for client in subscription.clients:
+                position = (client.subprotocol == SUBPROTOCOL_BINARY,
+                            self.client_seq.get(client, seq - 1))
+                positions.setdefault(position, []).append(client)
+            for (binary, since), clients in positions.items():
+                # A group that fails to encode does not hold back the rest
                 try:
-                    await client.send(message)
-                except websockets.exceptions.ConnectionClosed:
-                    disconnected.add(client)
+                    if body is None:
+                        body = subscription.select(metrics)
+                    frame = dict(body, type='metrics', seq=seq)
+                    if 'history_delta' in subscription.fields:
+                        frame['history_delta'] = self.history_delta_since(
+                            since, history_delta,
+                            BINARY_MAX_COUNT if binary else None)
+                    if binary:
+                        message = encode_binary_metrics(frame)
+                    else:
+                        message = json.dumps(frame, separators=(',', ':'))
+                    self.broadcast_stats['encoded'] += 1
+                    self.send_to_clients(message, clients)
+                    for client in clients:
+                        self.client_seq[client] = seq
                 except Exception as e:
-                    logger.error(f"Error sending to client: {e}")
-                    disconnected.add(client)
+                    logger.error(f"Error broadcasting metrics: {e}",
+                                 exc_info=True)
 
-            self.clients -= disconnected
-            
-            if disconnected:
-                logger.info(f"Removed {len(disconnected)} disconnected clients")
-        except Exception as e:
-            logger.error(f"Error broadcasting metrics: {e}", exc_info=True)
+    def history_delta_since(self, since: int, history_delta: Dict[str, list],
+                            limit: Optional[int] = None) -> Dict[str, Any]:
+        """History points appended after sequence since, at most limit.
+
+        One sample is appended per sequence number, so a client that
+        skipped ticks (max_rate) gets the newest sequence - since samples.
+        If some were overwritten already or are over the limit, since
+        moves up and the client sees a gap.
+        """
+        missed = self.sequence - since
+        if missed == 1:
+            return dict(history_delta, since=since)
+        history = self.metrics_history
+        missed = max(0, min(missed, len(history),
+                            missed if limit is None else limit))
+        return dict(history.to_dict(len(history) - missed),
+                    since=self.sequence - missed)
+
+    def send_to_clients(self, message: Union[str, bytes],
+                        clients=None) -> None:
+        """Write a prepared message to every client that is keeping up.
+
+        Clients whose unsent backlog exceeds SEND_BUFFER_LIMIT are evicted
+        rather than allowed to grow the daemon's memory or hold back others.
+        """
+        ready = []
+        for client in list(self.clients if clients is None else clients):
+            transport = client.transport
+            if transport is None or transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > SEND_BUFFER_LIMIT:
+                self.evict_client(client)
+            else:
+                ready.append(client)
+        websockets.broadcast(ready, message)
+
+    def evict_client(self, client: websockets.WebSocketServerProtocol) -> None:
+        """Drop a client that cannot keep up with the broadcast rate"""
+        if client not in self.clients:
+            return
+        self.remove_client(client)
+        self.broadcast_stats['evicted'] += 1
+        logger.warning(f"Evicting slow client {client.remote_address}: "
+                       f"{client.transport.get_write_buffer_size()} bytes "
+                       f"pending")
+        self.loop.create_task(
+            client.close(code=1008, reason='client too slow'))
+
+    def subscribe(self, client: websockets.WebSocketServerProtocol,
+                  subscription: Subscription) -> Subscription:
+        """Move a client to subscription, or the equal one already in use"""
+        subscription = self.subscriptions.setdefault(subscription.key,
+                                                     subscription)
+        previous = self.client_subscriptions.get(client)
+        if previous is not None:
+            self.unsubscribe(client, previous)
+        subscription.clients.add(client)
+        self.client_subscriptions[client] = subscription
+        return subscription
+
+    def unsubscribe(self, client: websockets.WebSocketServerProtocol,
+                    subscription: Subscription) -> None:
+        subscription.clients.discard(client)
+        if not subscription.clients:
+            del self.subscriptions[subscription.key]
+
+    def remove_client(self, client: websockets.WebSocketServerProtocol) -> None:
+        """Forget a client that disconnected or was evicted"""
+        self.clients.discard(client)
+        subscription = self.client_subscriptions.pop(client, None)
+        if subscription is not None:
+            self.unsubscribe(client, subscription)
+        self.client_seq.pop(client, None)
+        self.update_sampling()
+
+    def set_sample_interval(self, interval_ms: int) -> None:
+        """Ask the source to sample every interval_ms, or pause at 0.
+
+        Only an interval the kernel module accepts is recorded: one out of
+        its range is not sent, and where the module's parameter can be
+        read back it is what counts.
+        """
+        self.idle_handle = None
+        if interval_ms == self.sample_interval:
+            return
+        if interval_ms and not SAMPLE_MIN_MS <= interval_ms <= SAMPLE_MAX_MS:
+            logger.warning(f"Ignoring sampling interval {interval_ms} ms, "
+                           f"not 0 or {SAMPLE_MIN_MS} to {SAMPLE_MAX_MS}")
+            return
+        if self.source is not None:
+            self.source.set_interval(interval_ms)
+        else:
+            message = netlink_frame(CONTROL_MSG.pack(interval_ms),
+                                    SM_MSG_CONTROL, NLM_F_REQUEST)
+            try:
+                self.sock.sendto(message, (0, 0))
+            except OSError as e:
+                logger.warning(f"Could not set the module's sampling "
+                               f"interval: {e}")
+                return
+            # The module handles the message before sendto returns
+            current = read_module_interval()
+            if current is not None and current != interval_ms:
+                logger.warning(f"Module rejected sampling interval "
+                               f"{interval_ms} ms, keeps {current} ms")
+                self.sample_interval = current
+                return
+        self.sample_interval = interval_ms
+        if interval_ms:
+            logger.info(f"Sampling every {interval_ms} ms")
+        else:
+            logger.info("Sampling paused")
+
+    def update_sampling(self) -> None:
+        """Sample fast while clients are connected, slow down once they
+        have all been gone for SAMPLE_IDLE_GRACE seconds"""
+        if not self.sample_intervals or not self.running:
+            return
+        active, idle = self.sample_intervals
+        if self.clients:
+            if self.idle_handle is not None:
+                self.idle_handle.cancel()
+                self.idle_handle = None
+            self.set_sample_interval(active)
+        elif self.idle_handle is None and self.sample_interval != idle:
+            self.idle_handle = self.loop.call_later(
+                SAMPLE_IDLE_GRACE, self.set_sample_interval, idle)
+
+    def persist_metrics(self, metrics: Dict[str, Any]) -> None:
+        """Append a sample to the on-disk store, if enabled"""
+        if not self.store:
+            return
+        try:
+            if self.store.append(metrics):
+                # A new hour began: expire and compact old segments off-loop
+                self.loop.run_in_executor(None, self.store.maintain)
+        except OSError as e:
+            logger.error(f"Error writing metrics store: {e}")
+
+    def on_netlink_readable(self) -> None:
+        """Drain every queued datagram, keeping only the newest frame.
+
+        Runs as the loop's reader callback for the netlink fd. Frames that
+        arrive while an earlier one is still pending are coalesced: only
+        the latest is handed to handle_netlink.
+        """
+        stats = self.netlink_stats
+        while self.running:
+            try:
+                frames = self.recv_ring.receive(self.sock)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # Kernel dropped datagrams because our queue overflowed
+                    stats['overruns'] += 1
+                    logger.warning(f"Netlink receive queue overrun "
+                                   f"(total: {stats['overruns']})")
+                    continue
+                logger.error(f"Error reading netlink socket: {e}")
+                break
+
+            stats['datagrams'] += 1
+            if not frames:
+                continue
+            stats['frames'] += len(frames)
+            if self.pending_frame is not None:
+                stats['coalesced'] += 1
+            stats['coalesced'] += len(frames) - 1
+            self.pending_frame = frames[-1]
+            self.pending_received = time.monotonic()
+
+        if self.pending_frame is not None:
+            self.frame_ready.set()
 
     async def handle_netlink(self) -> None:
-        """Handle Netlink socket communication"""
+        """Format, record and broadcast the latest received frame"""
         while self.running:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            metrics = self.pending_frame
+            received = self.pending_received
+            self.pending_frame = None
+            if metrics is None or not self.running:
+                continue
+
             try:
-                if not self.running:
-                    break
+                logger.debug(f"Received metrics with timestamp: {metrics.timestamp}")
+                formatted_metrics = self.format_metrics(metrics)
+                if formatted_metrics and self.enricher:
+                    processes = formatted_metrics['processes']
+                    self.enricher.merge(processes)
+                    self.enricher.refresh(processes)
+                if formatted_metrics:
+                    history_delta = self.update_metrics_history(
+                        formatted_metrics)
+                    # Rows are sorted busiest first. Only the usual top
+                    # rows are indexed, however many are sent for a tree
+                    # view, so the index does not churn through them
+                    self.process_index.update(
+                        formatted_metrics['epoch'],
+                        formatted_metrics['processes'][:PROCESS_ROWS])
+                    await self.broadcast_metrics(formatted_metrics,
+                                                 history_delta)
+                    self.persist_metrics(formatted_metrics)
+                else:
+                    logger.warning("Failed to format metrics")
 
-                data = await asyncio.get_event_loop().sock_recv(
-                    self.sock, 65536)
-                
-                if data and self.running:
-                    logger.debug(f"Received data size: {len(data)} bytes")
-                    # Skip netlink header (16 bytes)
-                    metrics = SystemMetrics.from_buffer_copy(data[16:])
-                    logger.debug(f"Received metrics with timestamp: {metrics.timestamp}")
-                    
-                    formatted_metrics = self.format_metrics(metrics)
-                    if formatted_metrics:
-                        self.update_metrics_history(formatted_metrics)
-                        await self.broadcast_metrics(formatted_metrics)
-                    else:
-                        logger.warning("Failed to format metrics")
-                    
-            except BlockingIOError:
-                await asyncio.sleep(0.1)
+                stats = self.netlink_stats
+                latency = (time.monotonic() - received) * 1000
+                stats['last_latency_ms'] = latency
+                if latency > stats['max_latency_ms']:
+                    stats['max_latency_ms'] = latency
+                if metrics.collect_ns is not None:
+                    collect = metrics.collect_ns / 1e6
+                    stats['last_collect_ms'] = collect
+                    if collect > stats['max_collect_ms']:
+                        stats['max_collect_ms'] = collect
             except Exception as e:
                 if self.running:  # Only log if not shutting down
                     logger.error(f"Error handling netlink data: {e}", 
                                exc_info=True)
-                await asyncio.sleep(1)
 
     async def register_client(self, 
                             websocket: websockets.WebSocketServerProtocol) -> None:
-        """Register new WebSocket client"""
+        """Register new WebSocket client and serve its requests"""
         self.clients.add(websocket)
+        self.subscribe(websocket, Subscription.default(self.process_limit))
+        self.update_sampling()
         logger.info(f"New client connected. Total clients: {len(self.clients)}")
         try:
-            await websocket.wait_closed()
+            self.client_seq[websocket] = self.sequence
+            await websocket.send(self.history_snapshot())
+            async for message in websocket:
+                await self.handle_client_message(websocket, message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
         finally:
-            self.clients.remove(websocket)
+            self.remove_client(websocket)
             logger.info(f"Client disconnected. Total clients: {len(self.clients)}")
 
+    async def handle_client_message(self,
+                                    websocket: websockets.WebSocketServerProtocol,
+                                    message: str) -> None:
+        """Handle a request sent by a client"""
+        try:
+            request = json.loads(message)
+        except (TypeError, ValueError):
+            request = None
+        if not isinstance(request, dict):
+            logger.warning(f"Ignoring malformed client message: {message!r:.80}")
+            return
+
+        request_type = request.get('type')
+        if request_type == 'resync':
+            logger.debug("Client requested history resync")
+            self.client_seq[websocket] = self.sequence
+            await websocket.send(self.history_snapshot())
+        elif request_type == 'subscribe':
+            try:
+                subscription = Subscription.parse(request, self.process_limit)
+            except ValueError as e:
+                await websocket.send(json.dumps(
+                    {'type': 'error', 'message': f"bad subscription: {e}"}))
+                return
+            if websocket not in self.clients:
+                return  # evicted meanwhile
+            subscription = self.subscribe(websocket, subscription)
+            await websocket.send(json.dumps(
+                dict(subscription.describe(), type='subscribed'),
+                separators=(',', ':')))
+        elif request_type == 'top_processes':
+            await websocket.send(self.top_processes(request))
+        elif request_type == 'process_history':
+            series = self.process_index.series(request.get('pid'),
+                                               request.get('start_time'))
+            await websocket.send(json.dumps(
+                {'type': 'process_history', 'process': series},
+                separators=(',', ':')))
+        elif request_type == 'query':
+            await websocket.send(await self.query_store(request))
+        elif request_type == 'history':
+            await websocket.send(self.history_window(
+                request.get('seconds'), request.get('resolution')))
+        else:
+            logger.warning(f"Unknown client request: {request_type!r}")
+
     async def start_server(self) -> None:
         """Start WebSocket server and Netlink handler"""
         self.server = await websockets.serve(
             self.register_client, 
             "localhost", 
-            self.websocket_port
+            self.websocket_port,
+            subprotocols=[SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON],
+            # permessage-deflate compresses each message once per
+            # connection, which would undo encoding it once per tick
+            compression=None
         )
         logger.info(f"WebSocket server started on port {self.websocket_port}")
+        self.frame_ready = asyncio.Event()
+        self.loop.add_reader(self.sock.fileno(), self.on_netlink_readable)
+        if self.sample_intervals:
+            if self.source is None:
+                self.initial_interval = read_module_interval()
+            self.set_sample_interval(self.sample_intervals[1])
         await self.handle_netlink()
 
     def run(self) -> None:
@@ -318,15 +2974,131 @@ class SystemMonitorDaemon:
         finally:
             logger.info("Daemon shutdown complete")
 
+def read_module_interval() -> Optional[int]:
+    """The kernel module's current interval_ms parameter, if readable"""
+    try:
+        with open(MODULE_INTERVAL_PARAM) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+def parse_time(value: str) -> float:
+    """Parse epoch seconds or a local ISO 8601 time"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="System Monitor Daemon")
+    parser.add_argument('--port', type=int, default=8765,
+                        help='WebSocket port (default: 8765)')
+    parser.add_argument('--store-dir',
+                        help=f'metrics store directory (default: {STORE_DIR}, '
+                             'none for --replay and --synthetic)')
+    parser.add_argument('--no-store', action='store_true',
+                        help='do not persist metrics to disk')
+    parser.add_argument('--record', metavar='FILE',
+                        help='write every received datagram to a capture file')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--replay', metavar='FILE',
+                        help='read frames from a capture file instead of '
+                             'the kernel module')
+    source.add_argument('--synthetic', action='store_true',
+                        help='generate synthetic frames instead of reading '
+                             'the kernel module')
+    source.add_argument('--proc', action='store_true',
+                        help='collect metrics from /proc instead of the '
+                             'kernel module')
+    parser.add_argument('--no-enrich', action='store_true',
+                        help='do not add /proc details (user, VIRT, SHR, '
+                             'TIME+, command line) to process rows')
+    parser.add_argument('--rate', type=float,
+                        help='frames per second for --proc and --synthetic '
+                             '(default: 1) or --replay (default: recorded '
+                             'timing)')
+    parser.add_argument('--interval', type=int, default=SAMPLE_ACTIVE_MS,
+                        help='milliseconds between samples from the kernel '
+                             'module or --proc while clients are connected '
+                             f'(default: {SAMPLE_ACTIVE_MS})')
+    parser.add_argument('--idle-interval', type=int, default=SAMPLE_IDLE_MS,
+                        help='milliseconds between samples with no clients, '
+                             f'0 to pause sampling (default: {SAMPLE_IDLE_MS})')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='--replay time scale (default: 1.0)')
+    parser.add_argument('--loop', action='store_true',
+                        help='restart --replay at the end of the capture')
+    parser.add_argument('--cpus', type=int, default=8,
+                        help='--synthetic CPU count (default: 8)')
+    parser.add_argument('--processes', type=int, default=PROCESS_ROWS,
+                        help=f'--synthetic process count '
+                             f'(default: {PROCESS_ROWS})')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='how many of the --synthetic processes are '
+                             'extra threads of the others (default: 0)')
+    parser.add_argument('--process-rows', type=int, default=PROCESS_ROWS,
+                        help='process rows sent to clients per frame, e.g. '
+                             'all of them for a tree view (default: '
+                             f'{PROCESS_ROWS})')
+    parser.add_argument('--query', nargs=2, metavar=('START', 'END'),
+                        help='print stored samples between two times '
+                             '(epoch seconds or ISO 8601) and exit')
+    args = parser.parse_args()
+
+    if args.query:
+        store = MetricsStore(args.store_dir or STORE_DIR)
+        for sample in store.query(*map(parse_time, args.query)):
+            print(json.dumps(sample))
+        return
+
     try:
-        # Check if running as root
-        if os.geteuid() != 0:
-            logger.error("This program must be run as root")
-            sys.exit(1)
+        if args.replay:
+            source = ReplaySource(args.replay, rate=args.rate,
+                                  speed=args.speed, repeat=args.loop)
+        elif args.proc:
+            source = ProcCollector(rate=args.rate or 1.0,
+                                   max_processes=max(args.process_rows,
+                                                     FRAME_MAX_PROCESSES))
+        elif args.synthetic:
+            source = SyntheticSource(rate=args.rate or 1.0,
+                                     cpu_count=args.cpus,
+                                     process_count=args.processes,
+                                     threads=args.threads)
+        else:
+            source = None
+            # The kernel module's netlink socket needs root
+            if os.geteuid() != 0:
+                logger.error("This program must be run as root")
+                sys.exit(1)
+
+        # A fixed --rate, a capture and synthetic load keep their own pace
+        adaptive = source is None or (args.proc and not args.rate)
+        if adaptive and not SAMPLE_MIN_MS <= args.interval <= SAMPLE_MAX_MS:
+            parser.error(f'--interval must be {SAMPLE_MIN_MS} to '
+                         f'{SAMPLE_MAX_MS}')
+        if adaptive and args.idle_interval and not (
+                SAMPLE_MIN_MS <= args.idle_interval <= SAMPLE_MAX_MS):
+            parser.error(f'--idle-interval must be 0 or {SAMPLE_MIN_MS} to '
+                         f'{SAMPLE_MAX_MS}')
+        if not 0 <= args.process_rows <= BINARY_MAX_COUNT:
+            parser.error(f'--process-rows must be 0 to {BINARY_MAX_COUNT}')
 
-        daemon = SystemMonitorDaemon()
+        # Replayed and synthetic samples stay out of the host's store
+        # unless one is named
+        store_dir = args.store_dir
+        if store_dir is None and not (args.replay or args.synthetic):
+            store_dir = STORE_DIR
+        daemon = SystemMonitorDaemon(
+            websocket_port=args.port,
+            store_dir=None if args.no_store else store_dir,
+            source=source,
+            record_path=args.record,
+            # Replayed and synthetic pids do not exist on this host
+            enrich=not (args.no_enrich or args.replay or args.synthetic),
+            sample_intervals=((args.interval, args.idle_interval)
+                              if adaptive else None),
+            process_limit=args.process_rows)
         daemon.run()
     except Exception as e:
         logger.error(f"Failed to start daemon: {e}", exc_info=True)
@@ -5,7 +5,8 @@
 #include <linux/sched.h>
 #include <linux/sched/signal.h>
 #include <linux/mm.h>
-#include <linux/timer.h>
+#include <linux/workqueue.h>
+#include <linux/mutex.h>
 #include <linux/proc_fs.h>
 #include <linux/cpumask.h>
 #include <linux/init.h>
@@ -22,10 +23,80 @@
 #include <linux/swap.h>
 #include <linux/mm_types.h>
 #include <linux/mmzone.h>
+#include <linux/hashtable.h>
+#include <linux/math64.h>
 
 #define NETLINK_TEST 31
-#define MAX_PROCESSES 100
-#define MAX_PAYLOAD 8620
+
+// Frame protocol: a versioned header, then cpu_count CPU usage values, then
+// process_count process_info records. Frames larger than SM_PART_MAX are
+// split across several netlink messages, each carrying a frame_part header.
+#define METRICS_MAGIC 0x534d4652        // "SMFR"
+#define METRICS_VERSION 2
+#define SM_MSG_METRICS (NLMSG_MIN_TYPE + 1)
+#define SM_MSG_CONTROL (NLMSG_MIN_TYPE + 2)  // userspace -> module
+#define SM_PART_MAX (32 * 1024)         // frame bytes per netlink message
+
+// frame_header.flags
+#define FRAME_SORTED_CPU 0x1            // processes sorted by CPU, busiest first
+#define FRAME_TOP_RSS 0x2               // processes chosen by RSS, not CPU
+#define FRAME_CPU_TIME 0x4              // process_info.cpu_time is filled in
+#define FRAME_TASK_IDS 0x8              // process_info.ppid and tgid are filled in
+#define FRAME_THREADS 0x10              // one record per thread, not per process
+
+static unsigned int max_processes = 100;
+module_param(max_processes, uint, 0444);
+MODULE_PARM_DESC(max_processes, "Number of processes reported per frame (top N)");
+
+static bool rank_by_rss;
+module_param(rank_by_rss, bool, 0644);
+MODULE_PARM_DESC(rank_by_rss, "Report the top N processes by RSS instead of by CPU");
+
+static bool report_threads;
+module_param(report_threads, bool, 0644);
+MODULE_PARM_DESC(report_threads, "Rank and report every thread on its own instead of each process");
+
+#define TASK_HISTORY_BITS 10
+
+// Sampling interval; 0 pauses collection until a new interval is set
+#define SM_INTERVAL_MIN_MS 100
+#define SM_INTERVAL_MAX_MS 60000
+
+static unsigned int interval_ms = 1000;
+static bool collect_armed;              // false before init and during exit
+static DEFINE_SPINLOCK(interval_lock);
+static void collect_work_fn(struct work_struct *work);
+static DECLARE_DELAYED_WORK(collect_work, collect_work_fn);
+
+// Apply a new interval, rescheduling the next sample from now
+static int set_interval(unsigned int ms)
+{
+    if (ms && (ms < SM_INTERVAL_MIN_MS || ms > SM_INTERVAL_MAX_MS))
+        return -EINVAL;
+
+    spin_lock(&interval_lock);
+    WRITE_ONCE(interval_ms, ms);
+    if (collect_armed && ms)
+        mod_delayed_work(system_unbound_wq, &collect_work,
+                         msecs_to_jiffies(ms));
+    spin_unlock(&interval_lock);
+    return 0;
+}
+
+static int interval_param_set(const char *val, const struct kernel_param *kp)
+{
+    unsigned int ms;
+    int ret = kstrtouint(val, 0, &ms);
+
+    return ret ? ret : set_interval(ms);
+}
+
+static const struct kernel_param_ops interval_param_ops = {
+    .set = interval_param_set,
+    .get = param_get_uint,
+};
+module_param_cb(interval_ms, &interval_param_ops, &interval_ms, 0644);
+MODULE_PARM_DESC(interval_ms, "Sampling interval in ms (100-60000, 0 pauses)");
 
 // Debug macros
 #define DEBUG_PRINT(fmt, ...) \
@@ -45,6 +116,10 @@ struct process_info {
     long state;                     // Process state
     unsigned long priority;         // Process priority
     unsigned long nice;            // Nice value
+    unsigned long long start_time;  // Start time (ns since boot), tells reused PIDs apart
+    __u64 cpu_time;                 // Total CPU time of all threads (or the thread), in ns
+    pid_t ppid;                     // Parent process (thread group) ID
+    pid_t tgid;                     // Thread group ID, pid for a whole process
 };
 
 // Memory information structure
@@ -57,22 +132,86 @@ struct memory_info {
     unsigned long buffers;
 };
 
-// Main metrics structure
-struct system_metrics {
-    unsigned long cpu_usage[32];    // Per-CPU usage
+// Frame header, followed by __u64 cpu_usage[cpu_count] and
+// struct process_info processes[process_count]
+struct frame_header {
+    __u32 magic;                    // METRICS_MAGIC
+    __u16 version;                  // METRICS_VERSION
+    __u16 header_len;               // sizeof(struct frame_header)
+    __u32 cpu_count;                // Entries in the CPU usage array
+    __u32 process_count;            // Entries in the process array
+    __u16 process_info_len;         // sizeof(struct process_info)
+    __u16 flags;
+    __u64 timestamp_ns;             // Wall clock time of collection
     struct memory_info memory;      // Memory information
-    struct process_info processes[MAX_PROCESSES];  // Process information
-    int process_count;              // Number of processes
-    unsigned long timestamp;        // Current timestamp
+    __u64 collect_ns;               // Time spent collecting this frame
+};
+
+// Payload of SM_MSG_CONTROL
+struct control_msg {
+    __u32 interval_ms;              // As the interval_ms parameter
+};
+
+// Leads every netlink message carrying (part of) a frame
+struct frame_part {
+    __u32 sequence;                 // Frame number, same for all parts
+    __u32 offset;                   // Offset of this part within the frame
+    __u32 total_len;                // Length of the whole frame
 };
 
 #pragma pack(pop)
 
+// CPU time of a process at the previous tick, to turn totals into usage
+struct task_sample {
+    struct hlist_node node;
+    pid_t pid;
+    u64 start_time;                 // Tells a reused pid apart
+    u64 runtime;                    // Total ns on CPU, all threads or one
+    u32 seen;                       // walk_sequence of the last walk it was in
+};
+
+// Ranking key of a candidate process, compared primary first
+struct task_rank {
+    u64 primary;
+    u64 secondary;
+};
+
+// One of the two frame buffers, each sized for every possible CPU and
+// max_processes tasks
+struct metrics_frame {
+    void *buf;
+    struct frame_header *hdr;
+    __u64 *cpu_usage;
+    struct process_info *processes;
+};
+
 // Global variables
 static struct sock *nl_sk = NULL;
-static struct timer_list metrics_timer;
-static struct system_metrics *current_metrics = NULL;
-static DEFINE_SPINLOCK(metrics_lock);
+static u32 frame_sequence;              // Numbers netlink frames, send_work only
+
+// Collection fills the back frame, then swaps it with the front one under
+// front_lock. Sending reads the front frame under the same lock, so the
+// frame being sent is never the one being collected into.
+static struct metrics_frame frames[2];
+static struct metrics_frame *front_frame = &frames[0];
+static DEFINE_MUTEX(front_lock);
+static void send_work_fn(struct work_struct *work);
+static DECLARE_WORK(send_work, send_work_fn);
+
+// Sections of the back frame, only touched by collect_work
+static struct frame_header *frame_hdr;
+static __u64 *frame_cpu_usage;
+static struct process_info *frame_processes;
+
+// Min-heap of the N best candidates seen so far during a process walk:
+// heap_rank[i] ranks frame_processes[i], the root is the weakest
+static struct task_rank *heap_rank;
+static DEFINE_HASHTABLE(task_history, TASK_HISTORY_BITS);
+static u64 prev_walk_ns;
+static bool history_threads;            // task_history holds thread samples
+// Counts process walks. Only collect_work uses it, unlike frame_sequence,
+// which send_work advances concurrently.
+static u32 walk_sequence;
 
 // Previous CPU statistics for delta calculation
 static struct kernel_cpustat prev_cpu_stat[NR_CPUS];
@@ -87,9 +226,6 @@ static void get_cpu_stats(void)
     u64 total, idle_time, non_idle_time;
 
     for_each_possible_cpu(cpu) {
-        if (cpu >= NR_CPUS)
-            break;
-
         curr_cpu_stat = kcpustat_cpu(cpu);
 
         if (!first_run) {
@@ -113,10 +249,9 @@ static void get_cpu_stats(void)
             total = idle_time + non_idle_time;
 
             if (total > 0) {
-                current_metrics->cpu_usage[cpu] = 
-                    (non_idle_time * 100) / total;
+                frame_cpu_usage[cpu] = (non_idle_time * 100) / total;
             } else {
-                current_metrics->cpu_usage[cpu] = 0;
+                frame_cpu_usage[cpu] = 0;
             }
         }
 
@@ -135,16 +270,16 @@ static void get_memory_stats(void)
     si_meminfo(&si);
     cached = global_node_page_state(NR_FILE_PAGES);
 
-    current_metrics->memory.total = si.totalram << PAGE_SHIFT;
-    current_metrics->memory.free = si.freeram << PAGE_SHIFT;
-    current_metrics->memory.buffers = si.bufferram << PAGE_SHIFT;
-    current_metrics->memory.cached = cached << PAGE_SHIFT;
-    current_metrics->memory.available = si_mem_available() << PAGE_SHIFT;
+    frame_hdr->memory.total = si.totalram << PAGE_SHIFT;
+    frame_hdr->memory.free = si.freeram << PAGE_SHIFT;
+    frame_hdr->memory.buffers = si.bufferram << PAGE_SHIFT;
+    frame_hdr->memory.cached = cached << PAGE_SHIFT;
+    frame_hdr->memory.available = si_mem_available() << PAGE_SHIFT;
     
-    current_metrics->memory.used = current_metrics->memory.total -
-                                 current_metrics->memory.free -
-                                 current_metrics->memory.buffers -
-                                 current_metrics->memory.cached;
+    frame_hdr->memory.used = frame_hdr->memory.total -
+                             frame_hdr->memory.free -
+                             frame_hdr->memory.buffers -
+                             frame_hdr->memory.cached;
 }
 
 // Function to get process state
@@ -161,95 +296,360 @@ static char get_task_state(struct task_struct *task)
     return 'S';
 }
 
-// Function to get process information
-static void get_process_stats(void)
+static bool rank_less(const struct task_rank *a, const struct task_rank *b)
 {
-    struct task_struct *task;
-    int i = 0;
-    unsigned long flags;
+    if (a->primary != b->primary)
+        return a->primary < b->primary;
+    return a->secondary < b->secondary;
+}
 
-    rcu_read_lock();
-    for_each_process(task) {
-        if (i >= MAX_PROCESSES)
+static void heap_swap(unsigned int a, unsigned int b)
+{
+    swap(heap_rank[a], heap_rank[b]);
+    swap(frame_processes[a], frame_processes[b]);
+}
+
+static void heap_sift_up(unsigned int i)
+{
+    while (i > 0 && rank_less(&heap_rank[i], &heap_rank[(i - 1) / 2])) {
+        heap_swap(i, (i - 1) / 2);
+        i = (i - 1) / 2;
+    }
+}
+
+static void heap_sift_down(unsigned int i, unsigned int n)
+{
+    unsigned int child;
+
+    while ((child = 2 * i + 1) < n) {
+        if (child + 1 < n &&
+            rank_less(&heap_rank[child + 1], &heap_rank[child]))
+            child++;
+        if (!rank_less(&heap_rank[child], &heap_rank[i]))
             break;
+        heap_swap(i, child);
+        i = child;
+    }
+}
+
+// Total CPU time of a thread group in ns, including exited threads
+static u64 task_group_runtime(struct task_struct *task)
+{
+    struct task_struct *t;
+    u64 runtime = READ_ONCE(task->signal->sum_sched_runtime);
+
+    for_each_thread(task, t)
+        runtime += READ_ONCE(t->se.sum_exec_runtime);
+    return runtime;
+}
 
-        get_task_struct(task);
-        
-        current_metrics->processes[i].pid = task->pid;
-        memcpy(current_metrics->processes[i].comm, task->comm, TASK_COMM_LEN);
-        current_metrics->processes[i].state = get_task_state(task);
-        current_metrics->processes[i].priority = task->prio;
-        current_metrics->processes[i].nice = task_nice(task);
-        
-        if (task->mm) {
-            current_metrics->processes[i].mem_usage = 
-                get_mm_rss(task->mm) << PAGE_SHIFT;
+// CPU time used since the previous walk, tracked per process
+static u64 task_runtime_delta(struct task_struct *task, u64 runtime)
+{
+    struct task_sample *sample;
+    u64 delta;
+
+    hash_for_each_possible(task_history, sample, node, task->pid) {
+        if (sample->pid != task->pid)
+            continue;
+        if (sample->start_time != task->start_time) {
+            // The pid was reused: start over
+            sample->start_time = task->start_time;
+            sample->runtime = runtime;
+            sample->seen = walk_sequence;
+            return 0;
         }
+        delta = runtime > sample->runtime ? runtime - sample->runtime : 0;
+        sample->runtime = runtime;
+        sample->seen = walk_sequence;
+        return delta;
+    }
+
+    // First sight: usage is known from the next tick on
+    sample = kmalloc(sizeof(*sample), GFP_ATOMIC);
+    if (sample) {
+        sample->pid = task->pid;
+        sample->start_time = task->start_time;
+        sample->runtime = runtime;
+        sample->seen = walk_sequence;
+        hash_add(task_history, &sample->node, task->pid);
+    }
+    return 0;
+}
+
+// Forget processes that were not in the last walk, or all of them
+static void prune_task_history(bool all)
+{
+    struct task_sample *sample;
+    struct hlist_node *tmp;
+    int bkt;
+
+    hash_for_each_safe(task_history, bkt, tmp, sample, node) {
+        if (all || sample->seen != walk_sequence) {
+            hash_del(&sample->node);
+            kfree(sample);
+        }
+    }
+}
+
+// Offer a task to the heap of the top max_processes. runtime is the CPU
+// time of the whole thread group, or of the task alone in thread mode.
+static void rank_task(struct task_struct *task, u64 runtime, u64 interval,
+                      bool by_rss, unsigned int *n)
+{
+    struct process_info *proc;
+    struct task_rank rank;
+    u64 delta = task_runtime_delta(task, runtime);
+    u64 rss = task->mm ? get_mm_rss(task->mm) << PAGE_SHIFT : 0;
+    unsigned int i;
+
+    rank.primary = by_rss ? rss : delta;
+    rank.secondary = by_rss ? delta : rss;
+
+    if (*n < max_processes) {
+        i = (*n)++;
+    } else if (rank_less(&heap_rank[0], &rank)) {
+        i = 0;  // Replaces the weakest task kept so far
+    } else {
+        return;
+    }
 
-        // Calculate CPU usage based on task's time values
-        local_irq_save(flags);
-        current_metrics->processes[i].cpu_usage = 
-            (task->utime + task->stime) * 100UL /
-            (jiffies - task->start_time + 1);
-        local_irq_restore(flags);
+    heap_rank[i] = rank;
+    proc = &frame_processes[i];
+    proc->pid = task->pid;
+    memcpy(proc->comm, task->comm, TASK_COMM_LEN);
+    proc->state = get_task_state(task);
+    proc->priority = task->prio;
+    proc->nice = task_nice(task);
+    proc->start_time = task->start_time;
+    proc->mem_usage = rss;
+    proc->cpu_time = runtime;
+    // Percent of one CPU over the last interval
+    proc->cpu_usage = interval ? div64_u64(delta * 100, interval) : 0;
+    proc->ppid = rcu_dereference(task->real_parent)->tgid;
+    proc->tgid = task->tgid;
+
+    if (i)
+        heap_sift_up(i);
+    else
+        heap_sift_down(0, *n);
+}
+
+// Function to get process information
+//
+// Every process (or every thread, with report_threads) is ranked by CPU
+// used since the previous tick (or by RSS when rank_by_rss is set) and
+// only the top max_processes are kept, in a bounded min-heap, so a full
+// process_info is only filled in for candidates that beat the weakest one
+// kept. The heap is then sorted in place, busiest first.
+static void get_process_stats(void)
+{
+    struct task_struct *p, *task;
+    unsigned int n = 0;
+    unsigned int i;
+    u64 now = ktime_get_ns();
+    u64 interval = prev_walk_ns ? now - prev_walk_ns : 0;
+    bool by_rss = READ_ONCE(rank_by_rss);
+    bool threads = READ_ONCE(report_threads);
+
+    prev_walk_ns = now;
+    walk_sequence++;
+
+    // A thread's CPU time is not comparable with its process's: start over
+    if (threads != history_threads) {
+        prune_task_history(true);
+        history_threads = threads;
+    }
 
-        put_task_struct(task);
-        i++;
+    rcu_read_lock();
+    if (threads) {
+        for_each_process_thread(p, task)
+            rank_task(task, READ_ONCE(task->se.sum_exec_runtime), interval,
+                      by_rss, &n);
+    } else {
+        for_each_process(task)
+            rank_task(task, task_group_runtime(task), interval, by_rss, &n);
     }
     rcu_read_unlock();
 
-    current_metrics->process_count = i;
+    prune_task_history(false);
+
+    // Heapsort: popping the minimum to the end leaves the best first
+    for (i = n; i > 1; i--) {
+        heap_swap(0, i - 1);
+        heap_sift_down(0, i - 1);
+    }
+
+    frame_hdr->process_count = n;
+    frame_hdr->flags = FRAME_CPU_TIME | FRAME_TASK_IDS |
+                       (threads ? FRAME_THREADS : 0) |
+                       (by_rss ? FRAME_TOP_RSS : FRAME_SORTED_CPU);
 }
 
-// Timer callback function
-static void metrics_timer_callback(struct timer_list *t)
+// Multicast a frame, split into as many netlink messages as it needs
+static void send_frame(const struct metrics_frame *frame)
 {
     struct sk_buff *skb;
     struct nlmsghdr *nlh;
+    size_t total_len = sizeof(*frame->hdr) +
+                       frame->hdr->cpu_count * sizeof(*frame->cpu_usage) +
+                       frame->hdr->process_count * sizeof(*frame->processes);
+    struct frame_part part = {
+        .sequence = frame_sequence++,
+        .total_len = total_len,
+    };
+    size_t offset = 0;
+    size_t chunk;
     int ret;
-    
-    spin_lock(&metrics_lock);
-    
+
+    while (offset < total_len) {
+        chunk = min_t(size_t, total_len - offset, SM_PART_MAX);
+
+        skb = nlmsg_new(sizeof(part) + chunk, GFP_KERNEL);
+        if (!skb) {
+            ERROR_PRINT("Failed to allocate new skb");
+            return;
+        }
+
+        // Every part but the last is flagged as part of a multipart message
+        nlh = nlmsg_put(skb, 0, part.sequence, SM_MSG_METRICS,
+                        sizeof(part) + chunk,
+                        offset + chunk < total_len ? NLM_F_MULTI : 0);
+        if (!nlh) {
+            ERROR_PRINT("Failed to put nlmsg");
+            kfree_skb(skb);
+            return;
+        }
+
+        part.offset = offset;
+        memcpy(nlmsg_data(nlh), &part, sizeof(part));
+        memcpy((char *)nlmsg_data(nlh) + sizeof(part),
+               (const char *)frame->buf + offset, chunk);
+        nlmsg_end(skb, nlh);
+
+        // Send message using multicast
+        ret = nlmsg_multicast(nl_sk, skb, 0, 1, GFP_KERNEL);
+        if (ret == -ESRCH)
+            return;  // Nobody is listening
+        if (ret < 0) {
+            ERROR_PRINT("Failed to send netlink message, error: %d", ret);
+            return;
+        }
+        offset += chunk;
+    }
+    DEBUG_PRINT("Netlink frame sent successfully");
+}
+
+// Send the latest complete frame
+static void send_work_fn(struct work_struct *work)
+{
+    mutex_lock(&front_lock);
+    send_frame(front_frame);
+    mutex_unlock(&front_lock);
+}
+
+// Collect a frame into the back buffer, publish it and schedule the next
+// one. Runs in process context on an unbound worker, so walking every
+// process does not hold up softirqs on whichever CPU a timer fired on.
+static void collect_work_fn(struct work_struct *work)
+{
+    struct metrics_frame *back;
+    u64 started = ktime_get_ns();
+    unsigned int ms;
+
+    back = &frames[front_frame == &frames[0]];
+    frame_hdr = back->hdr;
+    frame_cpu_usage = back->cpu_usage;
+    frame_processes = back->processes;
+
     // Collect metrics
     get_cpu_stats();
     get_memory_stats();
     get_process_stats();
-    current_metrics->timestamp = ktime_get_real_seconds();
-
-    DEBUG_PRINT("Collecting metrics at timestamp: %lu", 
-                current_metrics->timestamp);
+    frame_hdr->timestamp_ns = ktime_get_real_ns();
+    frame_hdr->collect_ns = ktime_get_ns() - started;
+
+    DEBUG_PRINT("Collected metrics at timestamp: %llu in %llu ns",
+                frame_hdr->timestamp_ns, frame_hdr->collect_ns);
+
+    // Waits for a send still reading the old front frame
+    mutex_lock(&front_lock);
+    front_frame = back;
+    mutex_unlock(&front_lock);
+    queue_work(system_unbound_wq, &send_work);
+
+    // Schedule next update, unless paused
+    ms = READ_ONCE(interval_ms);
+    if (ms)
+        queue_delayed_work(system_unbound_wq, &collect_work,
+                           msecs_to_jiffies(ms));
+}
 
-    // Create new skb with proper size
-    skb = nlmsg_new(NLMSG_ALIGN(sizeof(struct system_metrics)), GFP_ATOMIC);
-    if (!skb) {
-        ERROR_PRINT("Failed to allocate new skb");
-        goto out;
-    }
+// Control messages from userspace, e.g. the daemon asking for faster
+// sampling while someone is watching
+static void monitor_nl_input(struct sk_buff *skb)
+{
+    struct nlmsghdr *nlh = nlmsg_hdr(skb);
+    struct control_msg *msg;
+    int ret;
 
-    // Add netlink header
-    nlh = nlmsg_put(skb, 0, 0, NLMSG_DONE, 
-                    NLMSG_ALIGN(sizeof(struct system_metrics)), 0);
-    if (!nlh) {
-        ERROR_PRINT("Failed to put nlmsg");
-        kfree_skb(skb);
-        goto out;
-    }
+    if (skb->len < NLMSG_HDRLEN || nlh->nlmsg_len < NLMSG_HDRLEN ||
+        skb->len < nlh->nlmsg_len)
+        return;
+    if (nlh->nlmsg_type != SM_MSG_CONTROL ||
+        nlmsg_len(nlh) < sizeof(*msg))
+        return;
+    if (!netlink_capable(skb, CAP_NET_ADMIN))
+        return;
+
+    msg = nlmsg_data(nlh);
+    ret = set_interval(msg->interval_ms);
+    if (ret)
+        ERROR_PRINT("Rejected sampling interval %u ms", msg->interval_ms);
+    else
+        DEBUG_PRINT("Sampling interval set to %u ms", msg->interval_ms);
+}
 
-    // Copy data
-    memcpy(nlmsg_data(nlh), current_metrics, sizeof(struct system_metrics));
-    nlmsg_end(skb, nlh);
+static void free_frames(void)
+{
+    int i;
 
-    // Send message using multicast
-    ret = nlmsg_multicast(nl_sk, skb, 0, 1, GFP_ATOMIC);
-    if (ret < 0 && ret != -ESRCH) {
-        ERROR_PRINT("Failed to send netlink message, error: %d", ret);
-    } else {
-        DEBUG_PRINT("Netlink message sent successfully");
+    for (i = 0; i < ARRAY_SIZE(frames); i++) {
+        kvfree(frames[i].buf);
+        frames[i].buf = NULL;
     }
+}
 
-out:
-    spin_unlock(&metrics_lock);
-    mod_timer(&metrics_timer, jiffies + HZ);  // Schedule next update
+// Allocate both frame buffers, for every possible CPU and max_processes
+// tasks, and fill in the parts of the header that never change
+static int alloc_frames(void)
+{
+    struct metrics_frame *frame;
+    int i;
+
+    for (i = 0; i < ARRAY_SIZE(frames); i++) {
+        frame = &frames[i];
+        frame->buf = kvzalloc(sizeof(*frame->hdr) +
+                              nr_cpu_ids * sizeof(*frame->cpu_usage) +
+                              (size_t)max_processes *
+                              sizeof(*frame->processes),
+                              GFP_KERNEL);
+        if (!frame->buf) {
+            free_frames();
+            return -ENOMEM;
+        }
+        frame->hdr = frame->buf;
+        frame->cpu_usage = (__u64 *)(frame->hdr + 1);
+        frame->processes =
+            (struct process_info *)(frame->cpu_usage + nr_cpu_ids);
+
+        frame->hdr->magic = METRICS_MAGIC;
+        frame->hdr->version = METRICS_VERSION;
+        frame->hdr->header_len = sizeof(*frame->hdr);
+        frame->hdr->cpu_count = nr_cpu_ids;
+        frame->hdr->process_info_len = sizeof(*frame->processes);
+    }
+    return 0;
 }
 
 // Module initialization
@@ -258,12 +658,18 @@ static int __init monitor_init(void)
     struct netlink_kernel_cfg cfg = {
         .groups = 1,
         .flags = 0,
-        .input = NULL,
+        .input = monitor_nl_input,
         .cb_mutex = NULL,
     };
+    int ret;
 
     DEBUG_PRINT("Initializing System Monitor");
 
+    if (!max_processes) {
+        ERROR_PRINT("max_processes must be at least 1");
+        return -EINVAL;
+    }
+
     // Create netlink socket
     nl_sk = netlink_kernel_create(&init_net, NETLINK_TEST, &cfg);
     if (!nl_sk) {
@@ -271,17 +677,27 @@ static int __init monitor_init(void)
         return -ENOMEM;
     }
 
-    // Allocate metrics structure
-    current_metrics = kzalloc(sizeof(struct system_metrics), GFP_KERNEL);
-    if (!current_metrics) {
-        ERROR_PRINT("Failed to allocate metrics structure");
+    ret = alloc_frames();
+    if (ret) {
+        ERROR_PRINT("Failed to allocate metrics frames");
+        netlink_kernel_release(nl_sk);
+        return ret;
+    }
+    heap_rank = kvcalloc(max_processes, sizeof(*heap_rank), GFP_KERNEL);
+    if (!heap_rank) {
+        ERROR_PRINT("Failed to allocate process ranking heap");
+        free_frames();
         netlink_kernel_release(nl_sk);
         return -ENOMEM;
     }
 
-    // Initialize timer
-    timer_setup(&metrics_timer, metrics_timer_callback, 0);
-    mod_timer(&metrics_timer, jiffies + HZ);
+    // Start collecting
+    spin_lock(&interval_lock);
+    collect_armed = true;
+    if (interval_ms)
+        queue_delayed_work(system_unbound_wq, &collect_work,
+                           msecs_to_jiffies(interval_ms));
+    spin_unlock(&interval_lock);
 
     DEBUG_PRINT("Module loaded successfully");
     return 0;
@@ -292,17 +708,21 @@ static void __exit monitor_exit(void)
 {
     DEBUG_PRINT("Cleaning up System Monitor");
     
-    // Cancel any pending timer
-    del_timer_sync(&metrics_timer);
+    // Stop collecting, and keep set_interval from rescheduling it
+    spin_lock(&interval_lock);
+    collect_armed = false;
+    spin_unlock(&interval_lock);
+    cancel_delayed_work_sync(&collect_work);
+    cancel_work_sync(&send_work);
 
     // Wait for any in-progress operations to complete
     synchronize_rcu();
 
     // Free resources
-    if (current_metrics) {
-        kfree(current_metrics);
-        current_metrics = NULL;
-    }
+    free_frames();
+    kvfree(heap_rank);
+    heap_rank = NULL;
+    prune_task_history(true);
 
     // Release netlink socket
     if (nl_sk) {
@@ -0,0 +1,136 @@
+# tests/bench_encoding.py
+"""Benchmark the encodings of a metrics message.
+
+Synthetic frames are formatted by the daemon, given the /proc details the
+enricher would add, and wrapped like broadcast_metrics does. Each message
+is encoded as JSON and in the binary sysmon.binary.v1 layout, and decoded
+again. Reported: encode and decode time, message size, and size after
+zlib as permessage-deflate would send it.
+"""
+import argparse
+import json
+import logging
+import random
+import socket
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'daemon'))
+
+import monitor_daemon as md  # noqa: E402
+
+logging.getLogger('SystemMonitor').setLevel(logging.WARNING)
+
+
+def build_messages(count: int, cpus: int, processes: int,
+                   enrich: bool) -> List[Dict[str, Any]]:
+    """Format count synthetic frames into metrics messages"""
+    source = md.SyntheticSource(rate=None, cpu_count=cpus,
+                                process_count=processes)
+    daemon = md.SystemMonitorDaemon(store_dir=None, enrich=False,
+                                    source=source)
+    rng = random.Random(0)
+    tx, rx = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    messages = []
+    try:
+        frames = source.datagrams()
+        for seq in range(1, count + 1):
+            _offset, datagrams = next(frames)
+            for datagram in datagrams:
+                tx.send(datagram)
+                received = daemon.recv_ring.receive(rx)
+            metrics = daemon.format_metrics(received[-1])
+            if enrich:
+                for row in metrics['processes']:
+                    row.update(virt=rng.randint(1 << 24, 1 << 34),
+                               shared=rng.randint(1 << 20, 1 << 28),
+                               threads=rng.randint(1, 64),
+                               user=rng.choice(('root', 'www-data', 'alice')),
+                               cmdline=f"/usr/bin/{row['name']} --config "
+                                       f"/etc/{row['name']}.conf")
+            history = {'cpu': [metrics['cpu_average']],
+                       'memory': [rng.uniform(10, 90)],
+                       'timestamp': [metrics['epoch']], 'since': seq - 1}
+            messages.append(dict(metrics, type='metrics', seq=seq,
+                                 history_delta=history))
+    finally:
+        tx.close()
+        rx.close()
+        source.close()
+    return messages
+
+
+def timed(function, items, rounds: int) -> float:
+    """Mean seconds per call of function over items"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for item in items:
+            function(item)
+    return (time.perf_counter() - start) / (rounds * len(items))
+
+
+def encode_json(message: Dict[str, Any]) -> str:
+    return json.dumps(message, separators=(',', ':'))
+
+
+def check(message: Dict[str, Any], decoded: Dict[str, Any]) -> None:
+    """The binary round trip keeps every row and number it carries"""
+    rows, decoded_rows = message['processes'], decoded['processes']
+    assert len(rows) == len(decoded_rows)
+    for row, decoded_row in zip(rows, decoded_rows):
+        for key, value in decoded_row.items():
+            if isinstance(value, float):
+                assert abs(value - row[key]) <= 1e-3 * max(1, abs(row[key]))
+            else:
+                assert value == row[key], (key, value, row[key])
+    assert decoded['history_delta']['since'] == \
+        message['history_delta']['since']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=32,
+                        help='number of distinct messages')
+    parser.add_argument('--rounds', type=int, default=50,
+                        help='times the message set is encoded')
+    parser.add_argument('--cpus', type=int, default=32)
+    parser.add_argument('--no-enrich', action='store_true',
+                        help='leave out the /proc details')
+    args = parser.parse_args()
+
+    print(f"{'processes':>9} {'format':<7}{'encode us':>10}{'decode us':>10}"
+          f"{'bytes':>8}{'deflated':>9}")
+    for processes in (10, md.PROCESS_ROWS):
+        messages = build_messages(args.frames, args.cpus, processes,
+                                  not args.no_enrich)
+        encoded_json = [encode_json(m) for m in messages]
+        encoded_binary = [md.encode_binary_metrics(m) for m in messages]
+        for message, data in zip(messages, encoded_binary):
+            check(message, md.decode_binary_metrics(data))
+
+        results = {}
+        for name, encode, decode, encoded in (
+                ('json', encode_json, json.loads, encoded_json),
+                ('binary', md.encode_binary_metrics,
+                 md.decode_binary_metrics, encoded_binary)):
+            raw = [data.encode() if isinstance(data, str) else data
+                   for data in encoded]
+            results[name] = (
+                timed(encode, messages, args.rounds),
+                timed(decode, encoded, args.rounds),
+                sum(map(len, raw)) / len(raw),
+                sum(len(zlib.compress(data)) for data in raw) / len(raw))
+            encode_s, decode_s, size, deflated = results[name]
+            print(f"{processes:>9} {name:<7}{encode_s * 1e6:>10.1f}"
+                  f"{decode_s * 1e6:>10.1f}{size:>8.0f}{deflated:>9.0f}")
+        ratios = [j / b for j, b in zip(results['json'], results['binary'])]
+        print(f"{processes:>9} {'ratio':<7}" +
+              ''.join(f"{ratio:>{width}.2f}x"
+                      for ratio, width in zip(ratios, (9, 9, 7, 8))))
+
+
+if __name__ == "__main__":
+    main()
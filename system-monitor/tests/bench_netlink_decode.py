@@ -0,0 +1,192 @@
+# tests/bench_netlink_decode.py
+"""Benchmark the daemon's netlink ingest path.
+
+Frames are built the way the kernel module emits them, pushed through a
+datagram socket pair and decoded. The v1 fixed struct system_metrics is
+decoded with both the legacy copy path and the zero-copy ring path, and
+v2 frames are decoded by the ring both when they fit in one datagram and
+when a large process table is split into several parts.
+
+The ring path's gain is allocation: a few hundred bytes of small objects
+per frame where the copy path allocates a 64 KB receive buffer. Its time
+per frame stays close to, and for v1 frames slightly above, the copy
+path's.
+"""
+import argparse
+import ctypes
+import logging
+import random
+import socket
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'daemon'))
+
+import monitor_daemon as md  # noqa: E402
+
+logging.getLogger('SystemMonitor').setLevel(logging.WARNING)
+
+
+def build_frame(seed: int) -> List[bytes]:
+    """Build one netlink datagram carrying a populated v1 SystemMetrics"""
+    rng = random.Random(seed)
+    metrics = md.SystemMetrics()
+    for cpu in range(8):
+        metrics.cpu_usage[cpu] = rng.randint(1, 100)
+    metrics.memory.total = 16 << 30
+    metrics.memory.used = rng.randint(1 << 30, 12 << 30)
+    metrics.memory.free = metrics.memory.total - metrics.memory.used
+    for i in range(md.MAX_PROCESSES):
+        proc = metrics.processes[i]
+        proc.pid = 1000 + i
+        proc.cpu_usage = rng.randint(0, 100)
+        proc.comm = f"proc{i}".encode()
+        proc.mem_usage = rng.randint(1 << 20, 1 << 30)
+        proc.state = ord('S')
+        proc.priority = 120
+    metrics.process_count = md.MAX_PROCESSES
+    metrics.timestamp = int(time.time())
+
+    payload = bytes(metrics)
+    payload += b'\0' * (md.nlmsg_align(len(payload)) - len(payload))
+    header = md.NLMSG_HDR.pack(md.NLMSG_HDRLEN + len(payload),
+                               md.NLMSG_DONE, 0, 0, 0)
+    return [header + payload]
+
+
+def build_v2_frame(seed: int, cpu_count: int,
+                   process_count: int) -> List[bytes]:
+    """Build the datagrams of one populated v2 frame"""
+    rng = random.Random(seed)
+    frame = md.FrameBuffer(cpu_count, process_count)
+    for cpu in range(cpu_count):
+        frame.cpu_usage[cpu] = rng.randint(1, 100)
+    memory = frame.header.memory
+    memory.total = 16 << 30
+    memory.used = rng.randint(1 << 30, 12 << 30)
+    memory.free = memory.total - memory.used
+    for i in range(process_count):
+        proc = frame.processes[i]
+        proc.pid = 1000 + i
+        proc.cpu_usage = rng.randint(0, 100)
+        proc.comm = f"proc{i}".encode()
+        proc.mem_usage = rng.randint(1 << 20, 1 << 30)
+        proc.state = ord('S')
+        proc.priority = 120
+    frame.header.process_count = process_count
+    frame.header.timestamp_ns = time.time_ns()
+    return [bytes(datagram) for datagram in frame.datagrams(seed)]
+
+
+def decode_copy(sock: socket.socket, parts: int) -> md.SystemMetrics:
+    """Baseline: recv into a fresh bytes object, slice, copy"""
+    data = sock.recv(md.RECV_BUFFER_SIZE)
+    return md.SystemMetrics.from_buffer_copy(data[16:])
+
+
+class RingDecoder:
+    """Zero-copy: recv_into the daemon's receive ring and overlay in place"""
+
+    def __init__(self):
+        self.ring = md.NetlinkReceiveRing()
+
+    def __call__(self, sock: socket.socket, parts: int) -> md.MetricsFrame:
+        for _ in range(parts):
+            frames = self.ring.receive(sock)
+        return frames[0]
+
+
+def run(decoder, frames, rounds: int, touch: bool) -> float:
+    """Return seconds per frame for decoder over the recorded frames.
+
+    This is the median of the per-round means, so a round disturbed by the
+    scheduler does not skew the comparison.
+    """
+    tx, rx = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    tx.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 22)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    means = []
+    try:
+        for _ in range(rounds):
+            elapsed = 0.0
+            for frame in frames:
+                for datagram in frame:
+                    tx.send(datagram)
+                start = time.perf_counter()
+                metrics = decoder(rx, len(frame))
+                if touch:
+                    metrics.processes[0].pid
+                    metrics.memory.used
+                elapsed += time.perf_counter() - start
+            means.append(elapsed / len(frames))
+    finally:
+        tx.close()
+        rx.close()
+    return statistics.median(means)
+
+
+def peak_allocation(decoder, frame: List[bytes]) -> int:
+    """Return the peak bytes allocated while receiving and decoding a frame"""
+    tx, rx = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        # Warm up so cached overlays are not counted
+        for _ in range(md.RECV_RING_SLOTS):
+            for datagram in frame:
+                tx.send(datagram)
+            decoder(rx, len(frame))
+        for datagram in frame:
+            tx.send(datagram)
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        metrics = decoder(rx, len(frame))
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        del metrics
+    finally:
+        tx.close()
+        rx.close()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=64,
+                        help='number of distinct recorded frames')
+    parser.add_argument('--rounds', type=int, default=200,
+                        help='times the frame set is replayed')
+    parser.add_argument('--cpus', type=int, default=8,
+                        help='CPUs in v2 frames')
+    parser.add_argument('--large', type=int, default=1024,
+                        help='processes in the multipart v2 frames')
+    args = parser.parse_args()
+
+    frames = [build_frame(seed) for seed in range(args.frames)]
+    print(f"v1 frame size: {len(frames[0][0])} bytes "
+          f"(payload {ctypes.sizeof(md.SystemMetrics)})")
+    copy_s = run(decode_copy, frames, args.rounds, touch=True)
+    ring_s = run(RingDecoder(), frames, args.rounds, touch=True)
+    print(f"v1 copy path:      {copy_s * 1e6:8.2f} us/frame")
+    print(f"v1 zero-copy path: {ring_s * 1e6:8.2f} us/frame "
+          f"({copy_s / ring_s:.2f}x)")
+    print(f"peak allocation per frame: "
+          f"copy {peak_allocation(decode_copy, frames[0])} B, "
+          f"zero-copy {peak_allocation(RingDecoder(), frames[0])} B")
+
+    for processes in (md.MAX_PROCESSES, args.large):
+        frames = [build_v2_frame(seed, args.cpus, processes)
+                  for seed in range(args.frames)]
+        size = sum(len(datagram) for datagram in frames[0])
+        v2_s = run(RingDecoder(), frames, args.rounds, touch=True)
+        print(f"v2 {processes} processes: {v2_s * 1e6:8.2f} us/frame "
+              f"({size} bytes in {len(frames[0])} parts, "
+              f"{v2_s / processes * 1e9:.1f} ns/process, peak allocation "
+              f"{peak_allocation(RingDecoder(), frames[0])} B)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# tests/bench_pipeline.py
+"""End-to-end benchmark of the daemon's ingest -> format -> broadcast path.
+
+A SystemMonitorDaemon is fed synthetic frames at a fixed rate and serves
+N WebSocket clients running in separate processes. Each frame carries its
+sequence number in the timestamp field, so clients can match what they
+receive to the moment the frame was sent. Clients can subscribe to part
+of each message, e.g. --subscribe '{"fields": ["memory"]}', and ask for
+the binary encoding with --binary. Reported: frames/s handled,
+ingest-to-client latency percentiles, CPU time per tick of the event
+loop thread, messages encoded per tick and RSS growth. Results can be
+saved as JSON and compared with a previous run. --sweep runs once per
+client count: CPU per tick should barely grow with clients, since each
+message is encoded once and only written to each connection.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'daemon'))
+
+import monitor_daemon as md  # noqa: E402
+import websockets  # noqa: E402
+
+logging.getLogger('SystemMonitor').setLevel(logging.WARNING)
+logging.getLogger('websockets').setLevel(logging.WARNING)
+
+# Metrics where a larger value is a regression
+LOWER_IS_BETTER = ('dropped', 'coalesced', 'evicted', 'latency_p50_ms',
+                   'latency_p99_ms', 'latency_max_ms', 'cpu_per_tick_ms',
+                   'encoded_per_tick', 'rss_growth_kb')
+
+
+class StampedSource(md.SyntheticSource):
+    """Synthetic source that stamps each frame with base + frame number"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.base = int(time.time())
+        self.sent_at = []  # CLOCK_MONOTONIC send time per frame number
+
+    def timestamp_ns(self, index: int) -> int:
+        # Scheduled send time: the feeder sleeps until then after yield
+        self.sent_at.append(self.started + index / self.rate)
+        return (self.base + index) * 1000000000
+
+
+def rss_kb() -> int:
+    """Current resident set size of this process"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def run_clients(port: int, count: int, stop, results,
+                subscribe: str, binary: bool) -> None:
+    """Child process: hold count connections, record (frame, receive time)"""
+    subprotocols = [md.SUBPROTOCOL_BINARY] if binary else None
+
+    async def client(samples):
+        async with websockets.connect(f"ws://localhost:{port}",
+                                      max_size=None,
+                                      subprotocols=subprotocols) as ws:
+            if subscribe:
+                await ws.send(json.dumps(dict(json.loads(subscribe),
+                                              type='subscribe')))
+            while not stop.is_set():
+                try:
+                    message = await asyncio.wait_for(ws.recv(), 0.2)
+                except asyncio.TimeoutError:
+                    continue
+                received = time.monotonic()
+                if isinstance(message, bytes):
+                    # Only the header is needed to match the frame
+                    epoch = md.BINARY_HEADER.unpack_from(message)[4]
+                    samples.append((int(epoch), received))
+                    continue
+                data = json.loads(message)
+                if data.get('type') == 'metrics':
+                    samples.append((int(data['epoch']), received))
+
+    async def main():
+        samples = [[] for _ in range(count)]
+        await asyncio.gather(*(client(s) for s in samples))
+        return samples
+
+    for samples in asyncio.run(main()):
+        results.put(samples)
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(args) -> dict:
+    source = StampedSource(rate=args.rate, cpu_count=args.cpus,
+                           process_count=args.processes)
+    daemon = md.SystemMonitorDaemon(websocket_port=args.port, store_dir=None,
+                                    source=source)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    daemon.loop = loop
+    server = loop.create_task(daemon.start_server())
+    loop.run_until_complete(asyncio.sleep(0.2))
+
+    ctx = multiprocessing.get_context('spawn')
+    stop = ctx.Event()
+    results = ctx.Queue()
+    workers = min(args.clients, os.cpu_count() or 1)
+    procs = []
+    for i in range(workers):
+        count = args.clients // workers + (i < args.clients % workers)
+        proc = ctx.Process(target=run_clients,
+                           args=(args.port, count, stop, results,
+                                 args.subscribe, args.binary))
+        proc.start()
+        procs.append(proc)
+
+    def counters():
+        return (time.monotonic(), time.thread_time(), daemon.sequence,
+                len(source.sent_at), rss_kb(), source.dropped,
+                daemon.netlink_stats['coalesced'],
+                daemon.broadcast_stats['encoded'])
+
+    async def measure():
+        while len(daemon.clients) < args.clients:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(args.warmup)
+        start = counters()
+        await asyncio.sleep(args.duration)
+        return start, counters()
+
+    async def collect():
+        # Keep the loop running so clients can finish their close handshake
+        stop.set()
+        samples = []
+        for _ in range(args.clients):
+            samples.extend(await loop.run_in_executor(None, results.get))
+        for proc in procs:
+            await loop.run_in_executor(None, proc.join)
+        return samples
+
+    start, end = loop.run_until_complete(measure())
+    samples = loop.run_until_complete(collect())
+
+    daemon.running = False
+    daemon.frame_ready.set()
+    loop.run_until_complete(server)
+    loop.run_until_complete(daemon.cleanup())
+    loop.close()
+
+    base, sent_at = source.base, source.sent_at
+    latencies = sorted(
+        (received - sent_at[frame - base]) * 1000
+        for frame, received in samples
+        if start[0] <= sent_at[frame - base] < end[0])
+    elapsed = end[0] - start[0]
+    ticks = end[2] - start[2]
+    return {
+        'config': {key: getattr(args, key) for key in
+                   ('rate', 'duration', 'clients', 'cpus', 'processes',
+                    'subscribe', 'binary')},
+        'frames_sent_per_s': (end[3] - start[3]) / elapsed,
+        'frames_per_s': ticks / elapsed,
+        'dropped': end[5] - start[5],
+        'coalesced': end[6] - start[6],
+        'evicted': daemon.broadcast_stats['evicted'],
+        'latency_p50_ms': percentile(latencies, 0.50),
+        'latency_p99_ms': percentile(latencies, 0.99),
+        'latency_max_ms': latencies[-1] if latencies else 0.0,
+        'cpu_per_tick_ms': (end[1] - start[1]) * 1000 / max(ticks, 1),
+        'encoded_per_tick': (end[7] - start[7]) / max(ticks, 1),
+        'rss_growth_kb': end[4] - start[4],
+    }
+
+
+def compare(result: dict, baseline: dict) -> None:
+    if result['config'] != baseline.get('config'):
+        print(f"\nwarning: baseline was run with {baseline.get('config')}")
+    print(f"\n{'metric':<20}{'baseline':>12}{'current':>12}{'change':>10}")
+    for key, value in result.items():
+        old = baseline.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(
+                old, (int, float)):
+            continue
+        change = (value - old) / old * 100 if old else 0.0
+        worse = change > 0 if key in LOWER_IS_BETTER else change < 0
+        flag = ' !' if worse and abs(change) > 10 else ''
+        print(f"{key:<20}{old:>12.2f}{value:>12.2f}{change:>+9.1f}%{flag}")
+
+
+def sweep(args) -> None:
+    """Run once per client count and print how the cost grows"""
+    print(f"{'clients':>8}{'frames/s':>10}{'CPU/tick ms':>13}"
+          f"{'encoded':>9}{'p99 ms':>9}")
+    for clients in args.sweep:
+        args.clients = clients
+        result = run(args)
+        print(f"{clients:>8}{result['frames_per_s']:>10.1f}"
+              f"{result['cpu_per_tick_ms']:>13.3f}"
+              f"{result['encoded_per_tick']:>9.2f}"
+              f"{result['latency_p99_ms']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=100,
+                        help='synthetic frames per second')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='seconds run before measuring')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='number of WebSocket clients')
+    parser.add_argument('--cpus', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=md.PROCESS_ROWS)
+    parser.add_argument('--subscribe', metavar='JSON',
+                        help='subscription every client sends, without '
+                             'the type field')
+    parser.add_argument('--binary', action='store_true',
+                        help='clients negotiate the binary encoding')
+    parser.add_argument('--sweep', type=int, nargs='+', metavar='CLIENTS',
+                        help='run once per client count and compare CPU '
+                             'per tick, instead of --clients')
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare with results from a previous run')
+    args = parser.parse_args()
+    if args.sweep and (args.output or args.compare):
+        parser.error('--sweep cannot be combined with --output or --compare')
+
+    if args.sweep:
+        sweep(args)
+        return
+
+    result = run(args)
+    print(f"frames/s:        {result['frames_per_s']:8.1f} "
+          f"(sent {result['frames_sent_per_s']:.1f}, "
+          f"dropped {result['dropped']}, "
+          f"coalesced {result['coalesced']})")
+    print(f"latency p50/p99: {result['latency_p50_ms']:8.2f} / "
+          f"{result['latency_p99_ms']:.2f} ms "
+          f"(max {result['latency_max_ms']:.2f} ms)")
+    print(f"CPU per tick:    {result['cpu_per_tick_ms']:8.3f} ms "
+          f"({result['encoded_per_tick']:.2f} messages encoded)")
+    print(f"RSS growth:      {result['rss_growth_kb']:8d} KB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# tests/bench_tui.py
+"""Benchmark how much the TUI writes to the terminal per update.
+
+A SystemMonitorDaemon serves synthetic frames at a fixed rate and the TUI
+runs against it in a pseudo-terminal of fixed size. Everything the TUI
+writes to the terminal is counted. Reported: bytes per frame received,
+the TUI's CPU time per frame, the time from a key press (moving the
+selection) to the first output that follows it, and the TUI's CPU time
+per key press while no frames arrive. --keys are typed into the TUI before
+measuring, e.g. --keys p to sort by PID so rows keep their place. --tui
+runs another copy of monitor_tui.py, e.g. an older one to compare
+against.
+"""
+import argparse
+import asyncio
+import fcntl
+import logging
+import os
+import pty
+import random
+import select
+import signal
+import struct
+import sys
+import tempfile
+import termios
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'daemon'))
+
+import monitor_daemon as md  # noqa: E402
+
+logging.getLogger('SystemMonitor').setLevel(logging.WARNING)
+logging.getLogger('websockets').setLevel(logging.WARNING)
+
+
+class Terminal:
+    """The TUI running in a pseudo-terminal, its output drained and counted"""
+
+    def __init__(self, tui: str, url: str, lines: int, cols: int):
+        self.cwd = tempfile.TemporaryDirectory()  # for monitor_tui.log
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            os.chdir(self.cwd.name)
+            env = dict(os.environ, TERM='xterm-256color',
+                       LINES=str(lines), COLUMNS=str(cols))
+            try:
+                os.execve(sys.executable,
+                          [sys.executable, tui, '--url', url], env)
+            finally:
+                os._exit(127)
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ,
+                    struct.pack('HHHH', lines, cols, 0, 0))
+        self.written = 0
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self.drain, daemon=True)
+        self.reader.start()
+
+    def drain(self) -> None:
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            with self.lock:
+                self.written += len(data)
+
+    def bytes_written(self) -> int:
+        with self.lock:
+            return self.written
+
+    def cpu_seconds(self) -> float:
+        """User and system time of the TUI process"""
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    async def key_latency(self, key: bytes, timeout: float = 2.0):
+        """Seconds from typing key to the next output, None if there is none"""
+        before = self.bytes_written()
+        start = time.monotonic()
+        os.write(self.fd, key)
+        while time.monotonic() - start < timeout:
+            if self.bytes_written() != before:
+                return time.monotonic() - start
+            await asyncio.sleep(0.001)
+        return None
+
+    def close(self) -> None:
+        os.write(self.fd, b'q')
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline:
+            if os.waitpid(self.pid, os.WNOHANG)[0]:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+        self.reader.join(1)
+        os.close(self.fd)
+        self.cwd.cleanup()
+
+
+def run(args) -> dict:
+    # Send every process, not just the daemon's usual top rows
+    md.PROCESS_ROWS = max(md.PROCESS_ROWS, args.processes)
+    source = md.SyntheticSource(rate=args.rate, cpu_count=args.cpus,
+                                process_count=args.processes)
+    daemon = md.SystemMonitorDaemon(websocket_port=args.port, store_dir=None,
+                                    enrich=False, source=source)
+    daemon.process_limit = args.processes
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    daemon.loop = loop
+    server = loop.create_task(daemon.start_server())
+    loop.run_until_complete(asyncio.sleep(0.2))
+
+    terminal = Terminal(os.path.abspath(args.tui), f"ws://localhost:{args.port}",
+                        args.lines, args.cols)
+
+    async def measure():
+        while not daemon.clients:
+            await asyncio.sleep(0.05)
+        if args.keys:
+            os.write(terminal.fd, args.keys.encode())
+        await asyncio.sleep(args.warmup)
+        start = (daemon.sequence, terminal.bytes_written(),
+                 terminal.cpu_seconds())
+        await asyncio.sleep(args.duration)
+        end = (daemon.sequence, terminal.bytes_written(),
+               terminal.cpu_seconds())
+
+        # Move the selection down and back up, at times unrelated to frames
+        rng = random.Random(0)
+        latencies = []
+        for i in range(args.presses):
+            await asyncio.sleep(rng.uniform(0.1, 0.3))
+            latencies.append(await terminal.key_latency(b'jk'[i % 2:][:1]))
+
+        # Scroll down and back up with the data standing still
+        source.set_interval(0)
+        await asyncio.sleep(0.5)
+        keys = b'j' * args.presses + b'k' * args.presses
+        cpu = terminal.cpu_seconds()
+        for key in keys:
+            await terminal.key_latency(bytes([key]))
+            await asyncio.sleep(0.01)
+        key_cpu = (terminal.cpu_seconds() - cpu) / len(keys)
+        return start, end, latencies, key_cpu
+
+    try:
+        start, end, latencies, key_cpu = loop.run_until_complete(measure())
+    finally:
+        terminal.close()
+        daemon.running = False
+        daemon.frame_ready.set()
+        loop.run_until_complete(server)
+        loop.run_until_complete(daemon.cleanup())
+        loop.close()
+
+    frames = max(end[0] - start[0], 1)
+    answered = sorted(latency * 1000 for latency in latencies
+                      if latency is not None)
+    return {
+        'key_p50_ms': answered[len(answered) // 2] if answered else None,
+        'key_max_ms': answered[-1] if answered else None,
+        'key_unanswered': len(latencies) - len(answered),
+        'cpu_per_key_ms': key_cpu * 1000,
+        'frames': frames,
+        'bytes_per_frame': (end[1] - start[1]) / frames,
+        'cpu_per_frame_ms': (end[2] - start[2]) * 1000 / frames,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tui', default=str(ROOT / 'ui' / 'tui' /
+                                             'monitor_tui.py'),
+                        help='monitor_tui.py to run')
+    parser.add_argument('--keys', default='',
+                        help='keys to press before measuring')
+    parser.add_argument('--presses', type=int, default=20,
+                        help='key presses timed after measuring')
+    parser.add_argument('--rate', type=float, default=4.0,
+                        help='frames per second')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--cpus', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=md.PROCESS_ROWS)
+    parser.add_argument('--lines', type=int, default=50)
+    parser.add_argument('--cols', type=int, default=160)
+    parser.add_argument('--port', type=int, default=8791)
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"frames:           {result['frames']}")
+    print(f"bytes per frame:  {result['bytes_per_frame']:.0f}")
+    print(f"cpu per frame:    {result['cpu_per_frame_ms']:.2f} ms")
+    if result['key_p50_ms'] is not None:
+        print(f"key to screen:    p50 {result['key_p50_ms']:.1f} ms, "
+              f"max {result['key_max_ms']:.1f} ms")
+    print(f"cpu per key:      {result['cpu_per_key_ms']:.2f} ms")
+    if result['key_unanswered']:
+        print(f"unanswered keys:  {result['key_unanswered']}")
+
+
+if __name__ == "__main__":
+    main()
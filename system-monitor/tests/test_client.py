@@ -1,32 +1,61 @@
 # tests/test_client.py
 import asyncio
+import random
 import websockets
 import json
 
+# Seconds before reconnecting, doubling per failed attempt up to the max
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 30.0
+
+async def receive(websocket) -> bool:
+    """Print messages until the connection closes; True if any metrics came"""
+    received = False
+    while True:
+        try:
+            data = await websocket.recv()
+            metrics = json.loads(data)
+            if metrics.get('type') == 'snapshot':
+                history = metrics.get('history', {})
+                print(f"\nReceived history snapshot: "
+                      f"{len(history.get('cpu', []))} points "
+                      f"(seq {metrics.get('seq')})")
+                continue
+            received = True
+            print(f"\nReceived metrics (seq {metrics.get('seq')}):")
+            print(f"CPU Average: {metrics.get('cpu_average', 0)}%")
+            print(f"Process Count: {len(metrics.get('processes', []))}")
+            if metrics.get('collect_ms') is not None:
+                print(f"Collection Time: {metrics['collect_ms']:.3f} ms")
+            print(f"Memory Used: {metrics.get('memory', {}).get('used', 0) / (1024**3):.2f} GB")
+        except websockets.exceptions.ConnectionClosed:
+            print("\nConnection closed by server")
+            return received
+        except Exception as e:
+            print(f"\nError: {e}")
+            return received
+
 async def test_connection():
     uri = "ws://localhost:8765"
-    try:
-        async with websockets.connect(uri) as websocket:
-            print("Connected to daemon")
-            while True:
-                try:
-                    data = await websocket.recv()
-                    metrics = json.loads(data)
-                    print("\nReceived metrics:")
-                    print(f"CPU Average: {metrics.get('cpu_average', 0)}%")
-                    print(f"Process Count: {len(metrics.get('processes', []))}")
-                    print(f"Memory Used: {metrics.get('memory', {}).get('used', 0) / (1024**3):.2f} GB")
-                except websockets.exceptions.ConnectionClosed:
-                    print("\nConnection closed by server")
-                    break
-                except Exception as e:
-                    print(f"\nError: {e}")
-                    break
-    except Exception as e:
-        print(f"Connection failed: {e}")
+    attempts = 0
+    while True:
+        try:
+            # The daemon sends a history snapshot on every connect
+            async with websockets.connect(uri) as websocket:
+                print("Connected to daemon")
+                if await receive(websocket):
+                    attempts = 0
+        except Exception as e:
+            print(f"Connection failed: {e}")
+        # Exponential backoff, jittered so clients do not retry in step
+        delay = min(RECONNECT_MAX, RECONNECT_MIN * 2 ** attempts)
+        delay = random.uniform(delay / 2, delay)
+        attempts += 1
+        print(f"Reconnecting in {delay:.1f}s")
+        await asyncio.sleep(delay)
 
 if __name__ == "__main__":
     try:
         asyncio.get_event_loop().run_until_complete(test_connection())
     except KeyboardInterrupt:
-        print("\nExiting...")
\ No newline at end of file
+        print("\nExiting...")
@@ -5,13 +5,19 @@
 #include <stdio.h>
 #include <unistd.h>
 #include <errno.h>
+#include <stdint.h>
 #include <time.h>
 
 #define NETLINK_TEST 31
-#define MAX_PAYLOAD 8620
-#define MAX_PROCESSES 100
+#define RECV_BUFFER_SIZE 65536
 #define TASK_COMM_LEN 16
 
+// Frame protocol, see kernel_module/README.md
+#define METRICS_MAGIC 0x534d4652
+#define METRICS_VERSION 2
+#define FRAME_SORTED_CPU 0x1  // processes arrive sorted by CPU usage
+#define SM_MSG_METRICS (NLMSG_MIN_TYPE + 1)
+
 // Matching structures with kernel module
 #pragma pack(push, 1)
 struct process_info {
@@ -22,24 +28,47 @@ struct process_info {
     long state;
     unsigned long priority;
     unsigned long nice;
+    unsigned long long start_time;
+    uint64_t cpu_time;  // Only valid with FRAME_CPU_TIME
+    pid_t ppid;         // Only valid with FRAME_TASK_IDS
+    pid_t tgid;
+};
+
+struct memory_info {
+    unsigned long total;
+    unsigned long used;
+    unsigned long free;
+    unsigned long cached;
+    unsigned long available;
+    unsigned long buffers;
 };
 
-struct system_metrics {
-    unsigned long cpu_usage[32];  // NR_CPUS
-    struct {
-        unsigned long total;
-        unsigned long used;
-        unsigned long free;
-        unsigned long cached;
-        unsigned long available;
-        unsigned long buffers;
-    } memory;
-    struct process_info processes[MAX_PROCESSES];
-    int process_count;
-    unsigned long timestamp;
+struct frame_header {
+    uint32_t magic;
+    uint16_t version;
+    uint16_t header_len;
+    uint32_t cpu_count;
+    uint32_t process_count;
+    uint16_t process_info_len;
+    uint16_t flags;
+    uint64_t timestamp_ns;
+    struct memory_info memory;
+    uint64_t collect_ns;        // only if header_len covers it
+};
+
+struct frame_part {
+    uint32_t sequence;
+    uint32_t offset;
+    uint32_t total_len;
 };
 #pragma pack(pop)
 
+// Frame being reassembled from its parts
+static char *frame;
+static size_t frame_capacity;
+static size_t frame_received;
+static uint32_t frame_sequence;
+
 void format_bytes(char *buf, size_t buf_size, unsigned long bytes) {
     const char *units[] = {"B", "KB", "MB", "GB", "TB"};
     int i = 0;
@@ -53,20 +82,38 @@ void format_bytes(char *buf, size_t buf_size, unsigned long bytes) {
     snprintf(buf, buf_size, "%.2f %s", size, units[i]);
 }
 
-void print_metrics(struct system_metrics *metrics) {
+static const struct process_info *process_at(const struct frame_header *hdr,
+                                             uint32_t i) {
+    const char *cpus = (const char *)hdr + hdr->header_len;
+    const char *procs = cpus + hdr->cpu_count * sizeof(uint64_t);
+    return (const struct process_info *)(procs + (size_t)i * hdr->process_info_len);
+}
+
+static const struct frame_header *sort_frame;
+
+static int by_cpu_desc(const void *a, const void *b) {
+    unsigned long ca = process_at(sort_frame, *(const uint32_t *)a)->cpu_usage;
+    unsigned long cb = process_at(sort_frame, *(const uint32_t *)b)->cpu_usage;
+    return (ca < cb) - (ca > cb);
+}
+
+void print_metrics(const struct frame_header *hdr) {
     char buf[64];
-    time_t t = (time_t)metrics->timestamp;
+    time_t t = (time_t)(hdr->timestamp_ns / 1000000000ULL);
+    const uint64_t *cpu_usage = (const uint64_t *)((const char *)hdr + hdr->header_len);
     printf("\033[2J\033[H");  // Clear screen and move cursor to top
     printf("=== System Metrics at %s", ctime(&t));
+    if (hdr->header_len >= sizeof(*hdr))
+        printf("Collected in %.3f ms\n", hdr->collect_ns / 1e6);
     
     // CPU Usage
-    printf("\nCPU Usage:\n");
-    for (int i = 0; i < 8; i++) {
-        if (metrics->cpu_usage[i] > 0) {
-            printf("CPU%d: %3lu%% ", i, metrics->cpu_usage[i]);
+    printf("\nCPU Usage (%u CPUs):\n", hdr->cpu_count);
+    for (uint32_t i = 0; i < hdr->cpu_count && i < 8; i++) {
+        if (cpu_usage[i] > 0) {
+            printf("CPU%u: %3lu%% ", i, (unsigned long)cpu_usage[i]);
             // Print bar graph
             printf("[");
-            int bars = metrics->cpu_usage[i] / 2;
+            int bars = cpu_usage[i] / 2;
             for (int j = 0; j < 50; j++) {
                 if (j < bars) {
                     printf("|");
@@ -80,15 +127,15 @@ void print_metrics(struct system_metrics *metrics) {
 
     // Memory Information
     printf("\nMemory Information:\n");
-    format_bytes(buf, sizeof(buf), metrics->memory.total);
+    format_bytes(buf, sizeof(buf), hdr->memory.total);
     printf("Total:     %s\n", buf);
-    format_bytes(buf, sizeof(buf), metrics->memory.used);
+    format_bytes(buf, sizeof(buf), hdr->memory.used);
     printf("Used:      %s\n", buf);
-    format_bytes(buf, sizeof(buf), metrics->memory.free);
+    format_bytes(buf, sizeof(buf), hdr->memory.free);
     printf("Free:      %s\n", buf);
-    format_bytes(buf, sizeof(buf), metrics->memory.cached);
+    format_bytes(buf, sizeof(buf), hdr->memory.cached);
     printf("Cached:    %s\n", buf);
-    format_bytes(buf, sizeof(buf), metrics->memory.available);
+    format_bytes(buf, sizeof(buf), hdr->memory.available);
     printf("Available: %s\n", buf);
 
     // Process Information
@@ -97,40 +144,91 @@ void print_metrics(struct system_metrics *metrics) {
            "PID", "CPU%", "MEM", "PRI", "NICE", "STATE", "NAME");
     printf("--------------------------------------------------\n");
 
-    // Sort processes by CPU usage (simple bubble sort)
-    struct process_info sorted[MAX_PROCESSES];
-    memcpy(sorted, metrics->processes, sizeof(struct process_info) * metrics->process_count);
-    for (int i = 0; i < metrics->process_count - 1; i++) {
-        for (int j = 0; j < metrics->process_count - i - 1; j++) {
-            if (sorted[j].cpu_usage < sorted[j + 1].cpu_usage) {
-                struct process_info temp = sorted[j];
-                sorted[j] = sorted[j + 1];
-                sorted[j + 1] = temp;
-            }
-        }
+    // Sort process indices by CPU usage, unless the module already did
+    uint32_t *order = malloc(sizeof(uint32_t) * (hdr->process_count + 1));
+    if (!order)
+        return;
+    for (uint32_t i = 0; i < hdr->process_count; i++)
+        order[i] = i;
+    if (!(hdr->flags & FRAME_SORTED_CPU)) {
+        sort_frame = hdr;
+        qsort(order, hdr->process_count, sizeof(uint32_t), by_cpu_desc);
     }
 
     // Print top 10 processes
-    for (int i = 0; i < 10 && i < metrics->process_count; i++) {
-        format_bytes(buf, sizeof(buf), sorted[i].mem_usage);
-        printf("%-6d %-6lu %-6s %-6lu %-4ld %-4c %-15s\n",
-               sorted[i].pid,
-               sorted[i].cpu_usage,
+    for (uint32_t i = 0; i < 10 && i < hdr->process_count; i++) {
+        const struct process_info *proc = process_at(hdr, order[i]);
+        format_bytes(buf, sizeof(buf), proc->mem_usage);
+        printf("%-6d %-6lu %-6s %-6lu %-4ld %-4c %-15.16s\n",
+               proc->pid,
+               proc->cpu_usage,
                buf,
-               sorted[i].priority,
-               sorted[i].nice,
-               (char)sorted[i].state,
-               sorted[i].comm);
+               proc->priority,
+               (long)proc->nice,
+               (char)proc->state,
+               proc->comm);
     }
+    free(order);
 
-    printf("\nTotal processes: %d\n", metrics->process_count);
+    printf("\nTotal processes: %u\n", hdr->process_count);
     printf("\nPress 'q' to quit...\n");
 }
 
+// Add one netlink message's part to the frame; returns 1 once it is complete
+static int add_frame_part(const char *data, size_t len) {
+    const struct frame_part *part = (const struct frame_part *)data;
+    size_t chunk;
+
+    if (len < sizeof(*part))
+        return 0;
+    chunk = len - sizeof(*part);
+    if (part->offset == 0) {
+        // First part of a new frame
+        if (part->total_len > frame_capacity) {
+            char *grown = realloc(frame, part->total_len);
+            if (!grown)
+                return 0;
+            frame = grown;
+            frame_capacity = part->total_len;
+        }
+        frame_sequence = part->sequence;
+        frame_received = 0;
+    } else if (part->sequence != frame_sequence ||
+               part->offset != frame_received) {
+        frame_received = 0;  // Lost a part: wait for the next frame
+        return 0;
+    }
+    if (part->offset + chunk > frame_capacity)
+        return 0;
+    memcpy(frame + part->offset, data + sizeof(*part), chunk);
+    frame_received = part->offset + chunk;
+    return frame_received == part->total_len;
+}
+
+static void handle_datagram(char *buf, int len) {
+    struct nlmsghdr *nlh;
+
+    for (nlh = (struct nlmsghdr *)buf; NLMSG_OK(nlh, len);
+         nlh = NLMSG_NEXT(nlh, len)) {
+        if (nlh->nlmsg_type != SM_MSG_METRICS)
+            continue;
+        if (!add_frame_part(NLMSG_DATA(nlh), NLMSG_PAYLOAD(nlh, 0)))
+            continue;
+
+        const struct frame_header *hdr = (const struct frame_header *)frame;
+        if (hdr->magic != METRICS_MAGIC || hdr->version < METRICS_VERSION) {
+            printf("Unsupported frame (magic %#x, version %u)\n",
+                   hdr->magic, hdr->version);
+            continue;
+        }
+        print_metrics(hdr);
+    }
+}
+
 int main() {
     struct sockaddr_nl src_addr;
     int sock_fd;
-    struct nlmsghdr *nlh = NULL;
+    char *buf = NULL;
     
     // Create socket
     sock_fd = socket(PF_NETLINK, SOCK_RAW, NETLINK_TEST);
@@ -153,8 +251,8 @@ int main() {
     }
 
     // Allocate receive buffer
-    nlh = malloc(NLMSG_SPACE(MAX_PAYLOAD));
-    if (!nlh) {
+    buf = malloc(RECV_BUFFER_SIZE);
+    if (!buf) {
         printf("Failed to allocate buffer\n");
         close(sock_fd);
         return -1;
@@ -192,21 +290,21 @@ int main() {
         }
 
         if (FD_ISSET(sock_fd, &readfds)) {
-            ret = recv(sock_fd, nlh, NLMSG_SPACE(MAX_PAYLOAD), 0);
+            ret = recv(sock_fd, buf, RECV_BUFFER_SIZE, 0);
             if (ret < 0) {
                 printf("recv failed: %s\n", strerror(errno));
                 continue;
             }
 
-            struct system_metrics *metrics = NLMSG_DATA(nlh);
-            print_metrics(metrics);
+            handle_datagram(buf, ret);
         }
     }
 
     // Restore terminal settings
     system("stty sane");
 
-    free(nlh);
+    free(buf);
+    free(frame);
     close(sock_fd);
     return 0;
 }
\ No newline at end of file
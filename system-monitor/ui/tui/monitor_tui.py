@@ -1,29 +1,249 @@
 #!/usr/bin/env python3
 
+import argparse
 import asyncio
 import curses
 import json
+import random
 import websockets
 import signal
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Tuple
 from collections import deque
+from itertools import islice
 import logging
 import sys
 
 # Configure logging
+# Not to stdout, which is the curses screen
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('monitor_tui.log'),
-        logging.StreamHandler(sys.stdout)
+        logging.FileHandler('monitor_tui.log')
     ]
 )
 logger = logging.getLogger('MonitorTUI')
 
-class MonitorTUI:
+Segment = Tuple[str, int]  # text and curses attributes
+# A row of the process table: the process, the CPU and memory to show
+# for it and the tree drawn before its name
+TableRow = Tuple[Dict[str, Any], float, int, str]
+
+class Region:
+    """A full-width sub-window drawn row by row.
+
+    Each row remembers the segments last drawn on it and is only rewritten
+    when they change, so unchanged rows cost nothing and the terminal is
+    sent only the cells that differ.
+    """
+
+    def __init__(self, y: int, height: int, width: int):
+        self.height = height
+        self.width = width
+        self.window = curses.newwin(height, width, y, 0)
+        self.rows: List[Optional[Tuple[Segment, ...]]] = [None] * height
+
+    def draw(self, row: int, *segments: Segment) -> None:
+        """Draw (text, attr) segments left to right, blanking the rest"""
+        if row >= self.height or self.rows[row] == segments:
+            return
+        self.rows[row] = segments
+        try:
+            self.window.move(row, 0)
+            self.window.clrtoeol()
+            x = 0
+            for text, attr in segments:
+                if x >= self.width:
+                    break
+                self.window.addstr(row, x, text[:self.width - x], attr)
+                x += len(text)
+        except curses.error:
+            pass  # Writing the bottom-right cell fails after drawing it
+
+    def clear_rows(self, start: int) -> None:
+        """Blank the rows from start on"""
+        for row in range(start, self.height):
+            self.draw(row)
+
+class ProcessTree:
+    """Parent -> children index over the process rows of successive frames.
+
+    A process's parent is its ppid and a thread's is its process (tgid);
+    threads are indexed apart from child processes so they can be left out
+    without filtering. update() only relinks rows that appeared,
+    disappeared or changed parent since the previous frame, so keeping the
+    index up to date costs a dict lookup per row rather than a rebuild.
+    """
+
     def __init__(self):
+        self.rows: Dict[int, Dict[str, Any]] = {}
+        self.parent: Dict[int, int] = {}  # process -> ppid
+        self.leader: Dict[int, int] = {}  # thread -> tgid
+        # Parent -> child processes and process -> threads, parents need
+        # not be rows
+        self.children: Dict[int, Set[int]] = {}
+        self.threads: Dict[int, Set[int]] = {}
+        self.collapsed: Set[int] = set()
+        # Set by table(): CPU per row, subtree totals of collapsed rows
+        # and the tree drawn before names
+        self.cpu: Dict[int, float] = {}
+        self.totals: Dict[int, Tuple[float, int]] = {}
+        self.branches: Dict[int, str] = {}
+
+    def update(self, processes: List[Dict[str, Any]]) -> None:
+        """Take the rows of a new frame"""
+        rows = {row['pid']: row for row in processes}
+        for pid in self.rows.keys() - rows.keys():
+            self.unlink(pid)
+        parents, leaders = self.parent, self.leader
+        for pid, row in rows.items():
+            tgid = row.get('tgid', pid)
+            if tgid != pid:
+                if leaders.get(pid) != tgid:
+                    self.unlink(pid)
+                    leaders[pid] = tgid
+                    self.threads.setdefault(tgid, set()).add(pid)
+                continue
+            ppid = row.get('ppid', 0)
+            if ppid == pid:
+                ppid = 0
+            if parents.get(pid) != ppid:
+                self.unlink(pid)
+                parents[pid] = ppid
+                self.children.setdefault(ppid, set()).add(pid)
+        self.rows = rows
+        if self.collapsed:
+            self.collapsed = {pid for pid in self.collapsed if pid in rows}
+
+    def unlink(self, pid: int) -> None:
+        for links, index in ((self.parent, self.children),
+                             (self.leader, self.threads)):
+            parent = links.pop(pid, None)
+            if parent is not None:
+                siblings = index[parent]
+                siblings.discard(pid)
+                if not siblings:
+                    del index[parent]
+
+    def toggle(self, pid: int, collapse: bool) -> bool:
+        """Collapse or expand pid's subtree; False if nothing changed"""
+        if (collapse == (pid in self.collapsed)
+                or (pid not in self.children and pid not in self.threads)):
+            return False
+        if collapse:
+            self.collapsed.add(pid)
+        else:
+            self.collapsed.discard(pid)
+        return True
+
+    def table(self, sort_by: str, reverse: bool, threads: bool,
+              tree: bool) -> List[int]:
+        """The pids to show, sorted, as a tree or a flat list.
+
+        Without threads, a process's threads are folded into it: their CPU
+        is added to the process's and they get no row of their own. In a
+        tree, siblings are sorted and a collapsed process shows the CPU
+        and memory of its whole subtree, which is not walked otherwise.
+        Threads share their process's memory, so it is only counted once.
+        Rows are built by entry(), for only those that are drawn.
+        """
+        rows = self.rows
+        cpu = {pid: row.get('cpu_usage', 0) for pid, row in rows.items()}
+        hidden: Set[int] = set()
+        if not threads:
+            for leader, tids in self.threads.items():
+                if leader in rows:
+                    cpu[leader] += sum(map(cpu.__getitem__, tids))
+                    hidden |= tids
+        self.cpu = cpu
+        self.totals = {}
+        self.branches = {}
+
+        if sort_by == 'cpu_usage':
+            key = cpu.__getitem__
+        else:
+            key = lambda pid: rows[pid].get(sort_by, 0)
+
+        if not tree:
+            pids = list(rows.keys() - hidden) if hidden else list(rows)
+            pids.sort(key=key, reverse=reverse)
+            return pids
+
+        # Walk the tree depth first, siblings in sort order
+        children = self.children
+        thread_index = self.threads if threads else {}
+        roots = [pid for pid, ppid in self.parent.items() if ppid not in rows]
+        roots += [pid for pid, tgid in self.leader.items() if tgid not in rows]
+        roots.sort(key=key, reverse=reverse)
+        collapsed = self.collapsed
+        branches = self.branches
+        order = []
+        stack = [(pid, '', '') for pid in reversed(roots)]
+        while stack:
+            pid, branch, indent = stack.pop()
+            order.append(pid)
+            kids = children.get(pid)
+            tids = thread_index.get(pid)
+            if tids:
+                kids = kids | tids if kids else tids
+            if not kids:
+                if branch:
+                    branches[pid] = branch
+                continue
+            if pid in collapsed:
+                self.totals[pid] = self.subtree_total(pid, thread_index)
+                branches[pid] = branch + '+ '
+                continue
+            if branch:
+                branches[pid] = branch
+            kids = sorted(kids, key=key, reverse=reverse)
+            # Siblings share their branch strings
+            stack.append((kids[-1], indent + '└─ ', indent + '   '))
+            middle, below = indent + '├─ ', indent + '│  '
+            stack.extend([(kid, middle, below) for kid in kids[-2::-1]])
+        return order
+
+    def subtree_total(self, pid: int,
+                      thread_index: Dict[int, Set[int]]) -> Tuple[float, int]:
+        """CPU and memory of pid and everything below it"""
+        rows, cpu, children = self.rows, self.cpu, self.children
+        total_cpu = cpu[pid]
+        total_mem = rows[pid].get('mem_usage', 0)
+        stack = [pid]
+        while stack:
+            node = stack.pop()
+            for tid in thread_index.get(node, ()):
+                total_cpu += cpu[tid]
+            kids = children.get(node)
+            if kids:
+                for kid in kids:
+                    total_cpu += cpu[kid]
+                    total_mem += rows[kid].get('mem_usage', 0)
+                stack.extend(kids)
+        return total_cpu, total_mem
+
+    def entry(self, pid: int) -> TableRow:
+        """The table row of a pid returned by the last table()"""
+        row = self.rows[pid]
+        total = self.totals.get(pid)
+        if total is None:
+            total = self.cpu[pid], row.get('mem_usage', 0)
+        return row, total[0], total[1], self.branches.get(pid, '')
+
+class MonitorTUI:
+    MAX_FPS = 30  # screen updates per second at most
+    INPUT_POLL = 0.25  # seconds between checks for a terminal resize
+    # Seconds before reconnecting, doubling per failed attempt up to the max
+    RECONNECT_MIN = 0.5
+    RECONNECT_MAX = 30.0
+    # Process fields shown in a row of the table, besides CPU and memory
+    LINE_FIELDS = ('user', 'priority', 'nice', 'virt', 'shared', 'state',
+                   'cpu_time', 'name')
+
+    def __init__(self, url: str = 'ws://localhost:8765'):
+        self.url = url
+
         # Color definitions
         self.COLORS = {
             'header': (curses.COLOR_WHITE, curses.COLOR_BLUE, 1),
@@ -53,10 +273,37 @@ class MonitorTUI:
         self.show_threads: bool = False
         self.update_interval: float = 1.0
         self.running: bool = True
+
+        # Rendering: regions are (re)built by layout() on first draw and
+        # on resize
+        self.regions: Optional[List[Region]] = None
+        self.cpu_rows: List[int] = []  # CPUs with a meter
+        self.visible_rows: int = 1  # process rows that fit the table
+        self.help_window = None
+        self.help_shown: bool = False
+        # Process table: the process tree, its pids in display order and
+        # the lines on screen
+        self.tree = ProcessTree()
+        self.tree_source: Optional[List[Dict[str, Any]]] = None
+        self.table_order: Optional[tuple] = None
+        self.table: List[int] = []
+        self.tree_changes: int = 0  # collapses and expands so far
+        self.line_cache: Dict[int, Tuple[tuple, str]] = {}
+        self.redraw: Optional[asyncio.Event] = None  # set by run()
+        self.last_draw: float = 0.0
+        self.frames_received: int = 0
+        self.frames_drawn: int = 0
+
+        # Connection: while it is down the last frame stays on screen
+        self.disconnected_at: Optional[datetime] = None
+        self.reconnect_attempts: int = 0  # since the last frame
         
         # History tracking
+        self.history_times: deque = deque(maxlen=100)
         self.cpu_history: deque = deque(maxlen=100)
         self.memory_history: deque = deque(maxlen=100)
+        self.last_seq: Optional[int] = None
+        self.resync_pending: bool = False
         
         # Initialize curses
         self.screen = curses.initscr()
@@ -87,151 +334,209 @@ class MonitorTUI:
             bytes_value /= 1024
         return f"{bytes_value:.1f}P"
 
-    def draw_meter(self, y: int, x: int, width: int, 
-                  percentage: float, title: str) -> None:
-        """Draw a meter bar with percentage"""
-        try:
-            meter_width = width - len(title) - 8
-            filled = int(meter_width * percentage / 100)
-            
-            # Draw title
-            self.screen.addstr(y, x, title, 
-                             curses.color_pair(self.COLORS['meter_text'][2]))
-            
-            # Select color based on percentage
-            if percentage < 50:
-                color = self.COLORS['cpu_low'][2]
-            elif percentage < 80:
-                color = self.COLORS['cpu_med'][2]
-            else:
-                color = self.COLORS['cpu_high'][2]
-                
-            # Draw meter
-            self.screen.addstr(y, x + len(title), " [")
-            self.screen.addstr(y, x + len(title) + 2, 
-                             "█" * filled + "░" * (meter_width - filled), 
-                             curses.color_pair(color))
-            self.screen.addstr(y, x + len(title) + 2 + meter_width, 
-                             f"] {percentage:5.1f}%")
-        except curses.error:
-            pass  # Ignore curses errors for boundary cases
+    def meter_segments(self, width: int, percentage: float,
+                       title: str) -> Tuple[Segment, ...]:
+        """Segments of a meter bar with percentage"""
+        # Room left by the title, " [" and "] 100.0%"
+        meter_width = max(width - len(title) - 10, 0)
+        filled = min(int(meter_width * percentage / 100), meter_width)
+
+        # Select color based on percentage
+        if percentage < 50:
+            color = self.COLORS['cpu_low'][2]
+        elif percentage < 80:
+            color = self.COLORS['cpu_med'][2]
+        else:
+            color = self.COLORS['cpu_high'][2]
+
+        return ((" ", 0),
+                (title, curses.color_pair(self.COLORS['meter_text'][2])),
+                (" [", 0),
+                ("█" * filled + "░" * (meter_width - filled),
+                 curses.color_pair(color)),
+                (f"] {percentage:5.1f}%", 0))
+
+    def layout(self) -> None:
+        """Split the screen into header, meter and process table regions"""
+        curses.update_lines_cols()
+        # Nothing is drawn on stdscr itself; refreshing it now keeps
+        # getch() from repainting it over the regions later
+        self.screen.erase()
+        self.screen.noutrefresh()
+        lines, cols = curses.LINES, curses.COLS
+        # CPU meters, a blank row, memory meter, details and a blank row
+        meters = min(len(self.cpu_rows) + 4, max(lines - 2, 1))
+        self.header_region = Region(0, 1, cols)
+        self.meter_region = Region(1, meters, cols)
+        self.table_region = Region(1 + meters, max(lines - 1 - meters, 1),
+                                   cols)
+        self.regions = [self.header_region, self.meter_region,
+                        self.table_region]
+
+    def track_cpus(self) -> None:
+        """Add CPUs that became active to the meters, relaying out if any.
+
+        Idle CPUs are not shown, but one that has been shown keeps its row
+        so the process table does not jump around.
+        """
+        cpus = self.current_metrics.get('cpu_usage', [])
+        active = [i for i, usage in enumerate(cpus) if usage > 0]
+        if not set(active) <= set(self.cpu_rows):
+            self.cpu_rows = sorted(set(self.cpu_rows).union(active))
+            self.regions = None
 
     def draw_header(self) -> None:
         """Draw the header bar with system info"""
-        try:
-            header = (f" System Monitor {self.update_interval}s | "
-                     f"Sort[{self.sort_by}] | "
-                     f"{'Tree' if self.tree_view else 'List'} | "
-                     f"{'Threads' if self.show_threads else 'Processes'} | "
-                     f"Press 'h' for help")
-            self.screen.addstr(0, 0, header.ljust(curses.COLS), 
-                             curses.color_pair(self.COLORS['header'][2]))
-        except curses.error:
-            pass
-
-    def draw_system_info(self, y_pos: int) -> int:
-        """Draw system information section"""
+        header = (f" System Monitor {self.update_interval}s | "
+                 f"Sort[{self.sort_by}] | "
+                 f"{'Tree' if self.tree_view else 'List'} | "
+                 f"{'Threads' if self.show_threads else 'Processes'} | "
+                 f"Press 'h' for help")
+        status = self.connection_status()
+        region = self.header_region
+        attr = curses.color_pair(self.COLORS['header'][2])
+        if status is None:
+            region.draw(0, (header.ljust(region.width), attr))
+        else:
+            region.draw(0, (header + ' ', attr),
+                        (status, curses.color_pair(
+                            self.COLORS['status_warn'][2]) | curses.A_REVERSE),
+                        (' ' * region.width, attr))
+
+    def connection_status(self) -> Optional[str]:
+        """What the header says about the connection, None if it is fine"""
+        if self.disconnected_at is not None:
+            return (f" STALE since {self.disconnected_at:%H:%M:%S}, "
+                    f"reconnecting ")
         if not self.current_metrics:
-            return y_pos
-
-        try:
-            # CPU information
-            cpus = self.current_metrics.get('cpu_usage', [])
-            for i, usage in enumerate(cpus):
-                if usage > 0:  # Only show active CPUs
-                    self.draw_meter(y_pos + i, 1, curses.COLS - 2, 
-                                  usage, f"CPU{i:2d}")
-
-            y_pos += len([cpu for cpu in cpus if cpu > 0]) + 1
-
-            # Memory information
-            mem = self.current_metrics.get('memory', {})
-            if mem:
-                total = mem.get('total', 0)
-                used = mem.get('used', 0)
-                if total > 0:
-                    mem_percent = (used / total) * 100
-                    self.draw_meter(y_pos, 1, curses.COLS - 2, 
-                                  mem_percent, "Mem ")
-                    
-                    details = (f"Total: {self.format_bytes(total)} | "
-                              f"Used: {self.format_bytes(used)} | "
-                              f"Free: {self.format_bytes(mem.get('free', 0))} | "
-                              f"Buffers: {self.format_bytes(mem.get('buffers', 0))}")
-                    self.screen.addstr(y_pos + 1, 2, details)
-                    y_pos += 3
+            return f" Connecting to {self.url} "
+        return None
 
-        except curses.error:
-            pass
+    def draw_system_info(self) -> None:
+        """Draw the CPU and memory meters"""
+        region = self.meter_region
+        if not self.current_metrics:
+            region.clear_rows(0)
+            return
 
-        return y_pos
-    def draw_process_list(self, y_pos: int) -> None:
+        # CPU information
+        cpus = self.current_metrics.get('cpu_usage', [])
+        width = region.width - 2
+        for row, cpu in enumerate(self.cpu_rows):
+            usage = cpus[cpu] if cpu < len(cpus) else 0
+            region.draw(row, *self.meter_segments(width, usage, f"CPU{cpu:2d}"))
+        y_pos = len(self.cpu_rows)
+        region.draw(y_pos)
+        y_pos += 1
+
+        # Memory information
+        mem = self.current_metrics.get('memory', {})
+        total = mem.get('total', 0)
+        if total > 0:
+            used = mem.get('used', 0)
+            mem_percent = (used / total) * 100
+            region.draw(y_pos, *self.meter_segments(width, mem_percent, "Mem "))
+            details = (f"Total: {self.format_bytes(total)} | "
+                      f"Used: {self.format_bytes(used)} | "
+                      f"Free: {self.format_bytes(mem.get('free', 0))} | "
+                      f"Buffers: {self.format_bytes(mem.get('buffers', 0))}")
+            region.draw(y_pos + 1, ("  " + details, 0))
+            y_pos += 2
+        region.clear_rows(y_pos)
+
+    def draw_process_list(self) -> None:
         """Draw the process list"""
+        region = self.table_region
         if 'processes' not in self.current_metrics:
+            region.clear_rows(0)
             return
 
-        try:
-            # Header
-            header = (" PID   USER     PR  NI    VIRT    RES    SHR S  %CPU  %MEM   TIME+   Command")
-            self.screen.addstr(y_pos, 0, header, 
-                             curses.color_pair(self.COLORS['header'][2]))
-            y_pos += 1
-
-            # Get and sort processes
-            processes = self.current_metrics['processes']
-            processes.sort(
-                key=lambda x: x[self.sort_by],
-                reverse=self.sort_reverse
-            )
-
-            # Calculate visible rows
-            visible_rows = curses.LINES - y_pos - 1
-            start_idx = self.scroll_offset
-            end_idx = min(start_idx + visible_rows, len(processes))
-
-            # Draw processes
-            for i, proc in enumerate(processes[start_idx:end_idx], start=start_idx):
-                color = (self.COLORS['highlight'][2] 
-                        if i == self.selected_row 
-                        else self.COLORS['normal'][2])
-                
-                # Format process information
-                virt = self.format_bytes(proc.get('virt', 0))
-                res = self.format_bytes(proc.get('mem_usage', 0))
-                shr = self.format_bytes(proc.get('shared', 0))
-                cpu = proc.get('cpu_usage', 0)
-                mem = (proc.get('mem_usage', 0) / 
-                      self.current_metrics['memory']['total'] * 100)
-
-                # Format CPU time
-                cpu_time = proc.get('cpu_time', 0)
-                hours = int(cpu_time / 3600)
-                minutes = int((cpu_time % 3600) / 60)
-                seconds = cpu_time % 60
-                time_str = f"{hours:02d}:{minutes:02d}.{seconds:02d}"
-
-                # Construct process line
-                line = (f" {proc['pid']:5d} {'root':8s} "
-                       f"{proc.get('priority', 0):3d} {proc.get('nice', 0):3d} "
-                       f"{virt:7s} {res:7s} {shr:7s} {proc['state']} "
-                       f"{cpu:5.1f} {mem:5.1f} "
-                       f"{time_str:8s} {proc['name']}")
-
-                try:
-                    self.screen.addstr(y_pos + i - start_idx, 0, 
-                                     line.ljust(curses.COLS), 
-                                     curses.color_pair(color))
-                except curses.error:
-                    break  # Stop if we run out of screen space
-
-        except curses.error:
-            pass
+        # Header
+        header = (" PID   USER     PR  NI    VIRT    RES    SHR S  %CPU  %MEM   TIME+   Command")
+        region.draw(0, (header, curses.color_pair(self.COLORS['header'][2])))
+
+        table = self.table_rows()
+        mem_total = self.current_metrics['memory']['total']
+
+        # Calculate visible rows
+        self.visible_rows = region.height - 1
+        # Rows may have gone, e.g. a branch was collapsed
+        self.selected_row = max(0, min(self.selected_row, len(table) - 1))
+        self.scroll_offset = max(0, self.selected_row - self.visible_rows + 1,
+                                 min(self.scroll_offset, self.selected_row))
+        start_idx = self.scroll_offset
+        end_idx = min(start_idx + self.visible_rows, len(table))
+
+        # Draw processes, keeping the lines of only what is on screen
+        lines = {}
+        for i, pid in enumerate(table[start_idx:end_idx], start=start_idx):
+            color = (self.COLORS['highlight'][2] 
+                    if i == self.selected_row 
+                    else self.COLORS['normal'][2])
+            line = self.process_line(self.tree.entry(pid), mem_total,
+                                     region.width, lines)
+            region.draw(1 + i - start_idx, (line, curses.color_pair(color)))
+        self.line_cache = lines
+        region.clear_rows(1 + end_idx - start_idx)
+
+    def table_rows(self) -> List[int]:
+        """The pids of the process table in display order.
+
+        The tree takes in each frame once, and the table is only rebuilt
+        for a new frame, sort key, view or collapsed branch, not on every
+        redraw, so scrolling and other redraws cost only the visible rows.
+        """
+        processes = self.current_metrics.get('processes', [])
+        if processes is not self.tree_source:
+            self.tree.update(processes)
+            self.tree_source = processes
+            self.table_order = None
+        order = (self.sort_by, self.sort_reverse, self.show_threads,
+                 self.tree_view, self.tree_changes)
+        if order != self.table_order:
+            self.table = self.tree.table(self.sort_by, self.sort_reverse,
+                                         self.show_threads, self.tree_view)
+            self.table_order = order
+        return self.table
+
+    def process_line(self, entry: TableRow, mem_total: int, width: int,
+                     lines: Dict[int, Tuple[tuple, str]]) -> str:
+        """Format a process row, reusing the last line if nothing changed.
+
+        The line is added to lines, the cache for the next redraw.
+        """
+        proc, cpu, mem_usage, branch = entry
+        values = (tuple(proc.get(field) for field in self.LINE_FIELDS)
+                  + (cpu, mem_usage, branch, mem_total, width))
+        cached = self.line_cache.get(proc['pid'])
+        if cached is not None and cached[0] == values:
+            lines[proc['pid']] = cached
+            return cached[1]
+
+        # Format process information
+        virt = self.format_bytes(proc.get('virt', 0))
+        res = self.format_bytes(mem_usage)
+        shr = self.format_bytes(proc.get('shared', 0))
+        mem = mem_usage / mem_total * 100
+
+        # Format CPU time
+        cpu_time = proc.get('cpu_time', 0)
+        hours = int(cpu_time / 3600)
+        minutes = int((cpu_time % 3600) / 60)
+        seconds = int(cpu_time % 60)
+        time_str = f"{hours:02d}:{minutes:02d}.{seconds:02d}"
+
+        # Construct process line
+        line = (f" {proc['pid']:5d} {proc.get('user', '-')[:8]:8s} "
+               f"{proc.get('priority', 0):3d} {proc.get('nice', 0):3d} "
+               f"{virt:7s} {res:7s} {shr:7s} {proc['state']} "
+               f"{cpu:5.1f} {mem:5.1f} "
+               f"{time_str:8s} {branch}{proc['name']}").ljust(width)
+        lines[proc['pid']] = (values, line)
+        return line
 
     def draw_help(self) -> None:
         """Draw help overlay"""
-        if not self.help_visible:
-            return
-
         help_text = [
             "Help for System Monitor",
             "",
@@ -242,6 +547,7 @@ class MonitorTUI:
             "  Down/j - Select next process",
             "  Space  - Tag process",
             "  F5     - Tree view",
+            "  +/-    - Expand/collapse the selected branch",
             "  F6     - Sort by",
             "  t      - Show threads",
             "  c      - Sort by CPU usage",
@@ -253,35 +559,43 @@ class MonitorTUI:
         ]
 
         try:
-            # Calculate box dimensions
-            height = len(help_text) + 2
-            width = max(len(line) for line in help_text) + 4
-            y = (curses.LINES - height) // 2
-            x = (curses.COLS - width) // 2
-
-            # Draw box
-            for i in range(height):
-                self.screen.addstr(y + i, x, " " * width, 
-                                 curses.color_pair(self.COLORS['normal'][2]))
-
-            # Draw content
-            for i, line in enumerate(help_text):
-                self.screen.addstr(y + i + 1, x + 2, line)
-
+            if self.help_window is None:
+                # Calculate box dimensions
+                height = len(help_text) + 2
+                width = max(len(line) for line in help_text) + 4
+                y = max((curses.LINES - height) // 2, 0)
+                x = max((curses.COLS - width) // 2, 0)
+                self.help_window = curses.newwin(height, width, y, x)
+                self.help_window.bkgd(
+                    ' ', curses.color_pair(self.COLORS['normal'][2]))
+                for i, line in enumerate(help_text):
+                    self.help_window.addstr(i + 1, 2, line)
+            # Regions redrawn under it this frame may have covered it
+            self.help_window.touchwin()
+            self.help_window.noutrefresh()
         except curses.error:
             pass
 
-    async def handle_input(self) -> bool:
-        """Handle user input"""
+    async def handle_input(self, key: int) -> bool:
+        """Handle a key press. Returns False to quit."""
         try:
-            key = self.screen.getch()
-            
             if key == ord('q'):
                 return False
+            elif key == curses.KEY_RESIZE:
+                self.regions = None
+                self.help_window = None
             elif key == ord('h'):
                 self.help_visible = not self.help_visible
             elif key == ord('t'):
                 self.show_threads = not self.show_threads
+            elif key == curses.KEY_F5:
+                self.tree_view = not self.tree_view
+            elif key in (ord('+'), ord('-')) and self.tree_view:
+                table = self.table_rows()
+                if 0 <= self.selected_row < len(table):
+                    pid = table[self.selected_row]
+                    if self.tree.toggle(pid, key == ord('-')):
+                        self.tree_changes += 1
             elif key == ord('c'):
                 self.sort_by = 'cpu_usage'
                 self.sort_reverse = True
@@ -299,10 +613,10 @@ class MonitorTUI:
                 if self.selected_row < self.scroll_offset:
                     self.scroll_offset = self.selected_row
             elif key in (curses.KEY_DOWN, ord('j')):
-                max_row = len(self.current_metrics.get('processes', [])) - 1
+                max_row = len(self.table_rows()) - 1
                 self.selected_row = min(max_row, self.selected_row + 1)
-                if self.selected_row >= self.scroll_offset + curses.LINES - 6:
-                    self.scroll_offset = self.selected_row - curses.LINES + 7
+                if self.selected_row >= self.scroll_offset + self.visible_rows:
+                    self.scroll_offset = self.selected_row - self.visible_rows + 1
 
             return True
         except Exception as e:
@@ -310,58 +624,208 @@ class MonitorTUI:
             return True
 
     async def update_display(self) -> None:
-        """Update the display with current metrics"""
+        """Redraw what changed since the last update.
+
+        Each region rewrites only the rows whose content changed, and the
+        terminal is updated once with doupdate(), so a refresh sends just
+        the changed cells instead of repainting the whole screen.
+        """
         try:
-            self.screen.clear()
+            self.track_cpus()
+            if self.regions is None:
+                self.layout()
             self.draw_header()
-            y_pos = 1
-            y_pos = self.draw_system_info(y_pos)
-            self.draw_process_list(y_pos)
+            self.draw_system_info()
+            self.draw_process_list()
+            if self.help_shown and not self.help_visible:
+                # Uncover what the help box was hiding
+                for region in self.regions:
+                    region.window.touchwin()
+            for region in self.regions:
+                region.window.noutrefresh()
             if self.help_visible:
                 self.draw_help()
-            self.screen.refresh()
+            self.help_shown = self.help_visible
+            curses.doupdate()
         except Exception as e:
             logger.error(f"Error updating display: {e}")
 
-    async def run(self) -> None:
-        """Main run loop"""
+    def load_history(self, snapshot: Dict[str, Any]) -> None:
+        """Replace local history with a snapshot from the daemon.
+
+        Local points older than the snapshot are kept, so history survives
+        a restart of the daemon, whose own history then starts afresh.
+        """
+        history = snapshot.get('history', {})
+        times = history.get('timestamp', [])
+        first = times[0] if times else float('inf')
+        keep = sum(1 for t in self.history_times if t < first)
+        for series, points in ((self.history_times, times),
+                               (self.cpu_history, history.get('cpu', [])),
+                               (self.memory_history,
+                                history.get('memory', []))):
+            kept = list(islice(series, keep))
+            series.clear()
+            series.extend(kept)
+            series.extend(points)
+        self.last_seq = snapshot.get('seq')
+        self.resync_pending = False
+
+    def apply_history_delta(self, metrics: Dict[str, Any]) -> bool:
+        """Append the history points carried by a metrics frame.
+
+        Returns False if frames were missed and a resync is needed.
+        """
+        delta = metrics.get('history_delta')
+        if delta is None:
+            return True
+        if self.last_seq is None or delta.get('since') != self.last_seq:
+            return False
+        self.history_times.extend(delta.get('timestamp', []))
+        self.cpu_history.extend(delta.get('cpu', []))
+        self.memory_history.extend(delta.get('memory', []))
+        self.last_seq = metrics.get('seq')
+        return True
+
+    def request_redraw(self) -> None:
+        """Have the render loop draw the current state"""
+        self.redraw.set()
+
+    async def render_loop(self) -> None:
+        """Draw whenever something changed, at most MAX_FPS times a second.
+
+        Frames and key presses that arrive while a draw is pending are
+        folded into that draw.
+        """
+        loop = asyncio.get_running_loop()
+        while self.running:
+            await self.redraw.wait()
+            self.redraw.clear()
+            await self.update_display()
+            self.frames_drawn += 1
+            await asyncio.sleep(max(0.0, self.last_draw + 1 / self.MAX_FPS
+                                    - loop.time()))
+            self.last_draw = loop.time()
+
+    async def input_loop(self) -> None:
+        """Handle keys as soon as they are typed"""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = sys.stdin.fileno()
+        loop.add_reader(fd, readable.set)
+        try:
+            while self.running:
+                # Woken by input, or by the timeout to pick up KEY_RESIZE,
+                # which arrives as a signal rather than as input
+                try:
+                    await asyncio.wait_for(readable.wait(), self.INPUT_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                readable.clear()
+                while (key := self.screen.getch()) != -1:
+                    if not await self.handle_input(key):
+                        self.running = False
+                        return
+                    self.request_redraw()
+        finally:
+            loop.remove_reader(fd)
+
+    async def receive_loop(self, websocket) -> None:
+        """Take in messages from the daemon until the connection closes"""
+        while self.running:
+            try:
+                message = await websocket.recv()
+                data = json.loads(message)
+
+                # Update history
+                if data.get('type') == 'snapshot':
+                    self.load_history(data)
+                elif data.get('type') in ('subscribed', 'error'):
+                    logger.info(f"Daemon replied: {data}")
+                    continue
+                else:
+                    self.current_metrics = data
+                    self.frames_received += 1
+                    self.disconnected_at = None
+                    self.reconnect_attempts = 0
+                    if (not self.apply_history_delta(data)
+                            and not self.resync_pending):
+                        logger.info("History gap detected, requesting resync")
+                        self.resync_pending = True
+                        await websocket.send(json.dumps({'type': 'resync'}))
+                self.request_redraw()
+
+            except websockets.exceptions.ConnectionClosed:
+                logger.error("Connection lost")
+                return
+            except Exception as e:
+                logger.error(f"Error in main loop: {e}")
+                await asyncio.sleep(1)
+
+    async def session(self) -> None:
+        """Connect to the daemon and take in messages until disconnected.
+
+        The daemon sends a history snapshot on every connect, so after a
+        reconnect local history is resynced rather than started over.
+        """
         try:
-            async with websockets.connect('ws://localhost:8765') as websocket:
+            async with websockets.connect(self.url, max_size=None) as websocket:
                 logger.info("Connected to daemon")
-                while self.running:
-                    try:
-                        message = await websocket.recv()
-                        self.current_metrics = json.loads(message)
-                        
-                        # Update history
-                        if 'cpu_usage' in self.current_metrics:
-                            self.cpu_history.append(
-                                sum(self.current_metrics['cpu_usage']) / 
-                                len(self.current_metrics['cpu_usage'])
-                            )
-                        if 'memory' in self.current_metrics:
-                            self.memory_history.append(
-                                self.current_metrics['memory']['used'] / 
-                                self.current_metrics['memory']['total'] * 100
-                            )
-                        
-                        await self.update_display()
-                        if not await self.handle_input():
-                            break
-                            
-                    except websockets.exceptions.ConnectionClosed:
-                        logger.error("Connection lost. Retrying...")
-                        self.screen.addstr(0, 0, "Connection lost. Retrying...")
-                        self.screen.refresh()
-                        await asyncio.sleep(1)
-                        break
-                    except Exception as e:
-                        logger.error(f"Error in main loop: {e}")
-                        await asyncio.sleep(1)
-
+                # Only what the screen draws
+                await websocket.send(json.dumps({
+                    'type': 'subscribe',
+                    'fields': ['cpu_usage', 'memory', 'processes',
+                               'history_delta']
+                }))
+                await self.receive_loop(websocket)
         except Exception as e:
             logger.error(f"Error connecting to daemon: {e}")
+
+    def reconnect_delay(self) -> float:
+        """Seconds to wait before the next connection attempt.
+
+        The delay doubles with each failed attempt and is jittered, so the
+        clients of a restarted daemon do not all come back at once.
+        """
+        delay = min(self.RECONNECT_MAX,
+                    self.RECONNECT_MIN * 2 ** self.reconnect_attempts)
+        self.reconnect_attempts += 1
+        return random.uniform(delay / 2, delay)
+
+    async def run(self) -> None:
+        """Run input, network and rendering as separate tasks.
+
+        Keys are handled as they arrive and the screen is redrawn at a
+        capped rate, however fast or slow the daemon sends frames. When
+        the connection is lost the last frame stays on screen, marked
+        stale, until a reconnect brings new ones.
+        """
+        self.redraw = asyncio.Event()
+        input_task = asyncio.create_task(self.input_loop())
+        tasks = [input_task, asyncio.create_task(self.render_loop())]
+        try:
+            # Only quitting ends the program
+            while not input_task.done():
+                session = asyncio.create_task(self.session())
+                tasks.append(session)
+                await asyncio.wait([input_task, session],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if input_task.done():
+                    break
+                tasks.remove(session)
+                if self.current_metrics and self.disconnected_at is None:
+                    self.disconnected_at = datetime.now()
+                self.request_redraw()
+                delay = self.reconnect_delay()
+                logger.info(f"Reconnecting in {delay:.1f}s")
+                await asyncio.wait([input_task], timeout=delay)
         finally:
+            self.running = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"Drew {self.frames_drawn} screens for "
+                        f"{self.frames_received} frames")
             curses.endwin()
 
 def cleanup():
@@ -370,12 +834,16 @@ def cleanup():
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description='System Monitor TUI')
+    parser.add_argument('--url', default='ws://localhost:8765',
+                        help='WebSocket address of the daemon')
+    args = parser.parse_args()
     try:
         # Register cleanup handler
         signal.signal(signal.SIGINT, lambda x, y: cleanup())
         
         # Initialize and run TUI
-        tui = MonitorTUI()
+        tui = MonitorTUI(args.url)
         asyncio.get_event_loop().run_until_complete(tui.run())
     except Exception as e:
         cleanup()
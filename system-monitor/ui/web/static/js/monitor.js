@@ -8,6 +8,8 @@ class SystemMonitor {
         this.maxReconnectAttempts = 5;
         this.reconnectDelay = 1000;
         this.historyLength = 50;
+        this.lastSeq = null;
+        this.resyncPending = false;
         
         this.initializeWebSocket();
         this.initializeCharts();
@@ -20,6 +22,8 @@ class SystemMonitor {
         this.ws.onopen = () => {
             this.setConnectionStatus('connected');
             this.reconnectAttempts = 0;
+            this.lastSeq = null;
+            this.resyncPending = true;  // the daemon sends a snapshot on connect
             console.log('Connected to WebSocket server');
         };
         
@@ -37,7 +41,11 @@ class SystemMonitor {
         this.ws.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
-                this.updateMetrics(data);
+                if (data.type === 'snapshot') {
+                    this.loadHistory(data);
+                } else {
+                    this.updateMetrics(data);
+                }
             } catch (error) {
                 console.error('Error processing message:', error);
             }
@@ -208,7 +216,7 @@ class SystemMonitor {
         this.updateCPUMetrics(data.cpu_usage);
         this.updateMemoryMetrics(data.memory);
         this.updateProcesses(data.processes);
-        this.updateCharts(data);
+        this.applyHistoryDelta(data.seq, data.history_delta);
     }
 
     updateCPUMetrics(cpuData) {
@@ -274,32 +282,58 @@ class SystemMonitor {
         this.processTable.rows.add(processes).draw();
     }
 
-    updateCharts(data) {
-        const timestamp = new Date().toLocaleTimeString();
+    requestResync() {
+        if (this.resyncPending || !this.ws || this.ws.readyState !== WebSocket.OPEN) {
+            return;
+        }
+        this.resyncPending = true;
+        this.ws.send(JSON.stringify({ type: 'resync' }));
+    }
 
-        // Update CPU chart
-        const cpuAverage = data.cpu_average || 
-            (data.cpu_usage.reduce((a, b) => a + b, 0) / data.cpu_usage.length);
+    loadHistory(snapshot) {
+        const history = snapshot.history;
+        const start = Math.max(0, history.timestamp.length - this.historyLength);
+        const labels = history.timestamp.slice(start)
+            .map(ts => new Date(ts * 1000).toLocaleTimeString());
 
-        if (this.charts.cpu.data.labels.length > this.historyLength) {
-            this.charts.cpu.data.labels.shift();
-            this.charts.cpu.data.datasets[0].data.shift();
-        }
-        this.charts.cpu.data.labels.push(timestamp);
-        this.charts.cpu.data.datasets[0].data.push(cpuAverage.toFixed(1));
+        this.charts.cpu.data.labels = labels;
+        this.charts.cpu.data.datasets[0].data = history.cpu.slice(start);
         this.charts.cpu.update();
 
-        // Update Memory chart
-        const memoryPercent = 
-            (data.memory.used / data.memory.total * 100).toFixed(1);
+        this.charts.memory.data.labels = [...labels];
+        this.charts.memory.data.datasets[0].data = history.memory.slice(start);
+        this.charts.memory.update();
+
+        this.lastSeq = snapshot.seq;
+        this.resyncPending = false;
+    }
+
+    applyHistoryDelta(seq, delta) {
+        if (!delta) return;
 
-        if (this.charts.memory.data.labels.length > this.historyLength) {
-            this.charts.memory.data.labels.shift();
-            this.charts.memory.data.datasets[0].data.shift();
+        // A gap means we missed frames; ask for the full history again
+        if (this.lastSeq === null || delta.since !== this.lastSeq) {
+            this.requestResync();
+            return;
         }
-        this.charts.memory.data.labels.push(timestamp);
-        this.charts.memory.data.datasets[0].data.push(memoryPercent);
+
+        delta.timestamp.forEach((ts, i) => {
+            const label = new Date(ts * 1000).toLocaleTimeString();
+            this.pushPoint(this.charts.cpu, label, delta.cpu[i]);
+            this.pushPoint(this.charts.memory, label, delta.memory[i]);
+        });
+        this.charts.cpu.update();
         this.charts.memory.update();
+        this.lastSeq = seq;
+    }
+
+    pushPoint(chart, label, value) {
+        if (chart.data.labels.length >= this.historyLength) {
+            chart.data.labels.shift();
+            chart.data.datasets[0].data.shift();
+        }
+        chart.data.labels.push(label);
+        chart.data.datasets[0].data.push(value);
     }
 }
 